@@ -1,141 +1,237 @@
 import os
 import json
+import sqlite3
 import time
 from datetime import datetime, timedelta
 import pandas as pd
 import pytz
-from tinkoff.invest import Client, CandleInterval
-from tinkoff.invest.exceptions import RequestError
+from ta.volatility import AverageTrueRange
 
-from DEEPCKAITRADE.modules.api_client import DeepSeekClient
+from DEEPCKAITRADE.modules.api_client import BatchSizer, DeepSeekClient
 from DEEPCKAITRADE.modules.indicators import calculate_indicators
-from DEEPCKAITRADE.modules.data_loader import cast_money, detect_patterns
+from DEEPCKAITRADE.modules.feature_store import FeatureStore, compute_features, features_to_frame, indicators_at
+from DEEPCKAITRADE.modules.payload import PayloadBuilder
+from DEEPCKAITRADE.modules.patterns import scan_last, scan_patterns, build_patterns
+from DEEPCKAITRADE.modules.swing_index import SwingIndex
+from DEEPCKAITRADE.modules.timeframes import MultiTimeframe
+from DEEPCKAITRADE.modules.candle_source import fetch_candles
+from DEEPCKAITRADE.modules.candle_integrity import GapIndex, check_candles, export_report, parse_sessions, refetch_gaps
 from DEEPCKAITRADE.config import Config
 from DEEPCKAITRADE.backtest.prediction_validator import PredictionValidator
+from DEEPCKAITRADE.backtest.portfolio_simulator import PortfolioSimulator, build_signals
+from DEEPCKAITRADE.backtest.analytics import compute_analytics, predictions_to_columns, save_columnar
+from DEEPCKAITRADE.backtest.results_index import ResultsIndex, config_snapshot
 from DEEPCKAITRADE.utils.logger import logger
+from DEEPCKAITRADE.utils.profiling import profiler
 
 
-def run_accuracy_test():
-    config = Config()
-    validator = PredictionValidator(lookahead_candles=6)  # 30 мин
-    deepseek_client = DeepSeekClient()  # Синглтон
-
-    logger.info(f"Тест точности с {config.BACKTEST_START} по {config.BACKTEST_END}")
+def load_history(config, figi=None, start_date=None, end_date=None):
+    """Загружает M5-свечи за период бэктеста и добавляет ATR для валидации"""
+    figi = figi or config.INSTRUMENT_FIGI
+    start_date = start_date or datetime.strptime(config.BACKTEST_START, "%Y-%m-%d").replace(tzinfo=pytz.utc)
+    end_date = end_date or datetime.strptime(config.BACKTEST_END, "%Y-%m-%d").replace(tzinfo=pytz.utc)
 
-    start_date = datetime.strptime(config.BACKTEST_START, "%Y-%m-%d").replace(tzinfo=pytz.utc)
-    end_date = datetime.strptime(config.BACKTEST_END, "%Y-%m-%d").replace(tzinfo=pytz.utc)
+    from tinkoff.invest import Client  # только при загрузке с биржи: импорт модуля не тянет gRPC
 
     with Client(config.TINKOFF_TOKEN) as client:
         logger.info("Загрузка исторических данных...")
-        candles = client.get_all_candles(
-            figi=config.INSTRUMENT_FIGI,
-            from_=start_date,
-            to=end_date,
-            interval=CandleInterval.CANDLE_INTERVAL_5_MIN
-        )
-
-        df = pd.DataFrame([{
-            'time': c.time,
-            'open': cast_money(c.open),
-            'high': cast_money(c.high),
-            'low': cast_money(c.low),
-            'close': cast_money(c.close),
-            'volume': c.volume
-        } for c in candles])
+        df = fetch_candles(client, figi, start_date, end_date)
 
         if df.empty:
             raise ValueError("Нет исторических данных!")
 
         logger.info(f"Загружено {len(df)} свечей")
 
+        # Пропуски по календарю сессий дозапрашиваем точечно, а не всю историю заново
+        sessions = parse_sessions(config.SESSION_HOURS_UTC)
+        df, report = check_candles(df, sessions)
+        gap_index = GapIndex()
+        gap_index.update(report["gaps"])
+        logger.info(f"[Gaps] Дубликатов: {report['duplicates']}, не по порядку: {report['out_of_order']}, "
+                    f"пропущено свечей: {report['missing_bars']} в {len(report['gaps'])} интервалах")
+        df = refetch_gaps(df, gap_index, lambda start, end: fetch_candles(client, figi, start, end),
+                          sessions, config.GAP_REFETCH_MAX_BACKTEST)
+        export_report(report, gap_index)
+
     # Добавляем ATR для валидации
-    from ta.volatility import AverageTrueRange
     df['atr'] = AverageTrueRange(high=df['high'], low=df['low'], close=df['close'], window=14).average_true_range()
+    return df
+
+
+def load_history_with_features(config, figi=None, start_date=None, end_date=None):
+    """(df, features): свечи и предрасчитанные индикаторы; при USE_FEATURE_STORE — из кэша на диске"""
+    figi = figi or config.INSTRUMENT_FIGI
+    start_date = start_date or datetime.strptime(config.BACKTEST_START, "%Y-%m-%d").replace(tzinfo=pytz.utc)
+    end_date = end_date or datetime.strptime(config.BACKTEST_END, "%Y-%m-%d").replace(tzinfo=pytz.utc)
+
+    if not config.USE_FEATURE_STORE:
+        df = load_history(config, figi, start_date, end_date)
+        return df, compute_features(df)
+
+    features = FeatureStore().load_or_build(
+        figi, config.CANDLE_INTERVAL, start_date, end_date,
+        lambda start, end: load_history(config, figi, start, end)
+    )
+    if not len(features["time"]):
+        raise ValueError("Нет исторических данных!")
+    return features_to_frame(features), features
+
 
+BACKTEST_INSTRUMENT = {"symbol": "TEST", "asset_class": "equity", "tick_value": 0.01, "min_order_size": 1}
+
+
+def build_backtest_market_data(config, current_df, indicators, patterns, multi_timeframe=None, builder=None):
+    builder = builder or PayloadBuilder(config)
+    return builder.build(
+        current_df, current_df['time'].iloc[-1].isoformat() + "Z", indicators, patterns,
+        10000.0,  # Фикс для теста
+        BACKTEST_INSTRUMENT, 1000000, {}, multi_timeframe)
+
+
+def batch_order(count, gap):
+    """Порядок снимков для пакетов: соседи в пакете отстоят на gap позиций (0, gap, 2*gap, ..., 1, 1+gap, ...)"""
+    gap = max(1, min(gap, count))
+    return [p for r in range(gap) for p in range(r, count, gap)]
+
+
+def evaluate_history(df, deepseek_client, validator, config, start_idx=50, rate_limit_sec=0.5, end_idx=None,
+                     rate_limiter=None, features=None, batch_size=None):
+    """Основной цикл: прогноз на каждой свече [start_idx, end_idx) и проверка по будущим lookahead_candles.
+
+    Возвращает (results, successful_predictions). deepseek_client — любой объект с get_prediction(),
+    rate_limiter — общий лимитер с acquire() (вместо паузы rate_limit_sec после каждого запроса),
+    features — колонки из feature_store: индикаторы читаются по индексу вместо пересчёта префикса,
+    batch_size — начальный K пакетного режима (по умолчанию config.LLM_BATCH_SIZE; нужен get_predictions()).
+    """
     results = []
     successful_predictions = 0
+    last_idx = len(df) - validator.lookahead_candles
+    end_idx = last_idx if end_idx is None else min(end_idx, last_idx)
+    batch_size = config.LLM_BATCH_SIZE if batch_size is None else batch_size
+    # Паттерны по всей серии один раз — дальше только чтение строки
+    pattern_masks = scan_patterns(features["open"], features["high"], features["low"],
+                                  features["close"]) if features is not None else None
+    swing_index = SwingIndex()  # дополняется свеча за свечой, как в live
+    multi_timeframe = MultiTimeframe(config.MTF_TIMEFRAMES, config.MTF_MAX_BARS) if config.MTF_TIMEFRAMES else None
+    builder = PayloadBuilder(config)  # статичные секции снимка кодируются один раз на прогон
 
-    for idx in range(50, len(df) - validator.lookahead_candles):
-        current_df = df.iloc[:idx + 1].copy()
-        current_price = current_df['close'].iloc[-1]
-        timestamp = current_df['time'].iloc[-1]
+    def snapshots():
+        """(idx, timestamp, current_price, market_data) по свечам; состояние индексов — строго по порядку"""
+        for idx in range(start_idx, end_idx):
+            # С признаками нужна только текущая свеча, без копии всей истории
+            current_df = df.iloc[idx:idx + 1] if features is not None else df.iloc[:idx + 1].copy()
+            timestamp = current_df['time'].iloc[-1]
 
-        try:
-            indicators = calculate_indicators(current_df)
-            patterns = detect_patterns(current_df, indicators)
-        except Exception as e:
-            logger.warning(f"[Test] Skip {timestamp}: {e}")
-            continue
+            try:
+                with profiler.maybe("backtest_step"):
+                    if features is not None:
+                        indicators = indicators_at(features, idx, swing_index)
+                        o, h, l, c, atr = (float(features[name][idx])
+                                           for name in ("open", "high", "low", "close", "atr"))
+                        patterns = build_patterns(pattern_masks, idx, indicators, h, l, atr,
+                                                  zones=swing_index.zones_at(o, h, l, c, atr))
+                    else:
+                        indicators = calculate_indicators(current_df, swing_index)
+                        patterns = scan_last(current_df, indicators, swing_index)
+            except Exception as e:
+                logger.warning(f"[Test] Skip {timestamp}: {e}")
+                continue
 
-        market_data = {
-            "timestamp": timestamp.isoformat() + "Z",
-            "market_data": {
-                "price_current": float(current_price),
-                "candle_current": {
-                    "open": float(current_df['open'].iloc[-1]),
-                    "high": float(current_df['high'].iloc[-1]),
-                    "low": float(current_df['low'].iloc[-1]),
-                    "close": float(current_price)
-                },
-                "volume_current": int(current_df['volume'].iloc[-1]),
-                "indicators": indicators,
-                "patterns": patterns
-            },
-            "risk_params": {
-                "account_equity": 10000.0,  # Фикс для теста
-                "max_risk_per_trade_pct": config.RISK_PER_TRADE_PCT,
-                "max_exposure_per_asset_pct": config.MAX_EXPOSURE_PCT,
-                "min_risk_reward": config.MIN_RISK_REWARD,
-                "volatility_threshold": config.VOLATILITY_THRESHOLD
-            },
-            "instrument_specs": {
-                "symbol": "TEST",
-                "asset_class": "equity",
-                "tick_value": 0.01,
-                "min_order_size": 1,
-                "avg_daily_volume": 1000000,
-                "margin_requirement": 0
-            },
-            "current_positions": {},
-            "cost_structure": {
-                "commission_per_share": config.COMMISSION_PER_SHARE,
-                "fixed_commission": config.FIXED_COMMISSION,
-                "max_slippage": config.MAX_SLIPPAGE
-            }
-        }
+            # Агрегатор читает только свечи после последнего закрытого бара — префикс не копируется
+            mtf_section = multi_timeframe.snapshot(df.iloc[:idx + 1]) if multi_timeframe is not None else None
+            yield idx, timestamp, current_df['close'].iloc[-1], \
+                build_backtest_market_data(config, current_df, indicators, patterns, mtf_section, builder)
 
-        try:
-            prediction = deepseek_client.get_prediction(market_data)
-            successful_predictions += 1
+    def record(idx, timestamp, current_price, prediction):
+        validation_result = validator.validate_prediction(prediction, idx, df)
+        results.append({
+            "index": idx,
+            "timestamp": timestamp.isoformat(),
+            "prediction": prediction,
+            "validation": validation_result,
+            "current_price": float(current_price),
+            "future_slice": df.iloc[idx + 1: idx + 1 + validator.lookahead_candles][
+                ['time', 'high', 'low', 'close']].to_dict('records')
+        })
 
-            validation_result = validator.validate_prediction(prediction, idx, df)
+        if prediction["confidence"] >= 80:
+            status = "✅" if validation_result["accuracy"] == "correct" else "❌" if validation_result[
+                                                                                       "accuracy"] == "incorrect" else "⚠️"
+            logger.info(
+                f"[{timestamp.strftime('%m-%d %H:%M')}] {status} {prediction['action']} @ {current_price:.2f} (conf: {prediction['confidence']}%)")
 
-            result_entry = {
-                "timestamp": timestamp.isoformat(),
-                "prediction": prediction,
-                "validation": validation_result,
-                "current_price": float(current_price),
-                "future_slice": df.iloc[idx + 1: idx + 1 + validator.lookahead_candles][
-                    ['time', 'high', 'low', 'close']].to_dict('records')
-            }
-            results.append(result_entry)
+    if batch_size > 1 and hasattr(deepseek_client, "get_predictions"):
+        # Пакетный режим: снимки строятся заранее, в пакет идут снимки через LLM_BATCH_GAP свечей
+        steps = list(snapshots())
+        order = batch_order(len(steps), config.LLM_BATCH_GAP)
+        sizer = BatchSizer.from_config(config, batch_size)
+        position = 0
+        while position < len(order):
+            chunk = [steps[i] for i in order[position:position + sizer.size]]
+            position += len(chunk)
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            predictions = deepseek_client.get_predictions([step[3] for step in chunk], sizer)
+            for (idx, timestamp, current_price, _), prediction in zip(chunk, predictions):
+                if prediction is None:
+                    continue
+                successful_predictions += 1
+                try:
+                    record(idx, timestamp, current_price, prediction)
+                except Exception as e:
+                    logger.error(f"[Test API] {timestamp}: {e}")
+            if rate_limit_sec and rate_limiter is None:
+                time.sleep(rate_limit_sec)
+        results.sort(key=lambda r: r["index"])
+        return results, successful_predictions
 
-            if prediction["confidence"] >= 80:
-                status = "✅" if validation_result["accuracy"] == "correct" else "❌" if validation_result[
-                                                                                           "accuracy"] == "incorrect" else "⚠️"
-                logger.info(
-                    f"[{timestamp.strftime('%m-%d %H:%M')}] {status} {prediction['action']} @ {current_price:.2f} (conf: {prediction['confidence']}%)")
+    for idx, timestamp, current_price, market_data in snapshots():
+        try:
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            prediction = deepseek_client.get_prediction(market_data)
+            successful_predictions += 1
+            record(idx, timestamp, current_price, prediction)
 
-            time.sleep(0.5)  # Rate limit
+            if rate_limit_sec and rate_limiter is None:
+                time.sleep(rate_limit_sec)  # Rate limit
 
         except Exception as e:
             logger.error(f"[Test API] {timestamp}: {e}")
             continue
 
+    return results, successful_predictions
+
+
+def run_accuracy_test(config=None):
+    """config — снимок Config.freeze() из точки входа; без него строится здесь (с валидацией .env)"""
+    if config is None:
+        config = Config.freeze()
+    else:
+        config.validate()
+    validator = PredictionValidator(lookahead_candles=6)  # 30 мин
+    if config.ENSEMBLE_MODELS:
+        from DEEPCKAITRADE.modules.ensemble import EnsemblePredictor
+        deepseek_client = EnsemblePredictor(config)
+    else:
+        deepseek_client = DeepSeekClient(config)  # Синглтон, настройки — из снимка
+
+    logger.info(f"Тест точности с {config.BACKTEST_START} по {config.BACKTEST_END}")
+
+    df, features = load_history_with_features(config)
+    results, successful_predictions = evaluate_history(df, deepseek_client, validator, config, features=features)
+
     metrics = validator.calculate_accuracy_metrics(results)
 
+    # Прогон сигналов через симулятор: SL/TP по high/low следующих свечей
+    simulator = PortfolioSimulator(config.INITIAL_BALANCE)
+    simulation = simulator.run(df, build_signals([(r["index"], r["prediction"]) for r in results]))
+    simulation["analytics"] = compute_analytics(simulator.trades, simulator.equity_history, simulator.initial_balance)
+
     os.makedirs(config.ACCURACY_RESULTS_DIR, exist_ok=True)
     filename = f"{config.ACCURACY_RESULTS_DIR}/accuracy_test_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    columnar_file = save_columnar(filename[:-len(".json")] + ".npz", simulator.trades, simulator.equity_history,
+                                  simulator.equity_times, predictions_to_columns(results))
 
     final_report = {
         "metadata": {
@@ -144,13 +240,27 @@ def run_accuracy_test():
             "instrument": config.INSTRUMENT_FIGI,
             "total_candles": len(df),
             "successful_predictions": successful_predictions,
-            "lookahead_minutes": validator.lookahead_candles * 5
+            "lookahead_minutes": validator.lookahead_candles * 5,
+            "columnar_file": os.path.basename(columnar_file),
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "model": "+".join(config.ENSEMBLE_MODELS) if config.ENSEMBLE_MODELS else config.DEEPSEEK_MODEL,
+            "prompt_hash": deepseek_client.prompt_hash(),
+            "config": config_snapshot(config)
         },
-        "metrics": metrics
+        "metrics": metrics,
+        "simulation": simulation
     }
+    if config.ENSEMBLE_MODELS:
+        final_report["ensemble"] = deepseek_client.stats()
 
     with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(final_report, f, indent=2, ensure_ascii=False)
+        json.dump(final_report, f, indent=2, ensure_ascii=False, default=str)
+
+    try:
+        with ResultsIndex(config.RESULTS_INDEX_PATH) as index:
+            index.register(final_report, filename)
+    except sqlite3.Error as e:
+        logger.error(f"[Index] Прогон не добавлен в индекс: {e}")
 
     logger.info("=" * 60)
     logger.info("РЕЗУЛЬТАТЫ ТЕСТА ТОЧНОСТИ")
@@ -158,6 +268,7 @@ def run_accuracy_test():
     logger.info(f"Точные: {metrics['correct_predictions']}")
     logger.info(f"Неточные: {metrics['incorrect_predictions']}")
     logger.info(f"Общая точность: {metrics['accuracy_rate']:.1f}%")
+    logger.info(f"Симуляция: {simulation['total_trades']} сделок | доходность {simulation['total_return_pct']:.2f}%")
     logger.info(f"Сохранено: {filename}")
     logger.info("=" * 60)
 
@@ -0,0 +1,150 @@
+# backtest/analytics.py
+import argparse
+import json
+from datetime import datetime
+
+import numpy as np
+
+from DEEPCKAITRADE.config import Config
+
+CONFIDENCE_BUCKETS = np.array([0, 50, 60, 70, 80, 90])  # левые границы: [0,50), [50,60), ... [90, ∞)
+
+
+def drawdown_series(equity):
+    peak = np.maximum.accumulate(equity)
+    return np.where(peak > 0, equity / peak - 1.0, 0.0)
+
+
+def longest_run(mask):
+    """Длина самой длинной серии True (в барах)"""
+    if not mask.any():
+        return 0
+    padded = np.concatenate(([False], mask, [False])).astype(np.int8)
+    edges = np.flatnonzero(np.diff(padded))
+    return int((edges[1::2] - edges[::2]).max())
+
+
+def exposure_mask(n_bars, entry_idx, exit_idx):
+    """Бары, на которых позиция открыта: (entry_idx, exit_idx]"""
+    delta = np.zeros(n_bars + 1, dtype=np.int64)
+    np.add.at(delta, np.clip(entry_idx + 1, 0, n_bars), 1)
+    np.add.at(delta, np.clip(exit_idx + 1, 0, n_bars), -1)
+    return np.cumsum(delta[:n_bars]) > 0
+
+
+def compute_analytics(trades, equity, initial_balance, bars_per_year=None):
+    """Метрики риска и доходности по колонкам сделок (PortfolioSimulator.trades) и equity по барам"""
+    bars_per_year = bars_per_year or Config.BARS_PER_YEAR
+    equity = np.asarray(equity, dtype=np.float64)
+    pnl = np.asarray(trades["pnl"], dtype=np.float64)
+    n_bars = len(equity)
+
+    dd = drawdown_series(equity) if n_bars else np.empty(0)
+    returns = np.diff(equity) / equity[:-1] if n_bars > 1 else np.empty(0)
+    std = returns.std(ddof=1) if len(returns) > 1 else 0.0
+    downside = returns[returns < 0]
+    downside_std = np.sqrt((downside ** 2).sum() / len(returns)) if len(returns) else 0.0
+    mean_ret = returns.mean() if len(returns) else 0.0
+
+    wins, losses = pnl[pnl > 0], pnl[pnl < 0]
+    gross_profit, gross_loss = wins.sum(), -losses.sum()
+    notional = np.asarray(trades["size"]) * (np.asarray(trades["entry_price"]) + np.asarray(trades["exit_price"]))
+    in_market = exposure_mask(n_bars, np.asarray(trades["entry_idx"]), np.asarray(trades["exit_idx"])) if n_bars else []
+
+    # PnL по корзинам уверенности
+    confidence = np.nan_to_num(np.asarray(trades["confidence"], dtype=np.float64), nan=0.0)
+    bucket = np.digitize(confidence, CONFIDENCE_BUCKETS) - 1
+    n_buckets = len(CONFIDENCE_BUCKETS)
+    bucket_pnl = np.bincount(bucket, weights=pnl, minlength=n_buckets)
+    bucket_count = np.bincount(bucket, minlength=n_buckets)
+    bucket_wins = np.bincount(bucket, weights=(pnl > 0), minlength=n_buckets)
+    edges = list(CONFIDENCE_BUCKETS) + [None]
+    by_confidence = {
+        f"{edges[i]}-{edges[i + 1] if edges[i + 1] is not None else 'max'}": {
+            "trades": int(bucket_count[i]),
+            "pnl": round(float(bucket_pnl[i]), 2),
+            "win_rate": round(float(bucket_wins[i] / bucket_count[i] * 100), 2) if bucket_count[i] else 0.0
+        }
+        for i in range(n_buckets) if bucket_count[i]
+    }
+
+    final_equity = float(equity[-1]) if n_bars else float(initial_balance)
+    return {
+        "final_equity": round(final_equity, 2),
+        "total_return_pct": round((final_equity / initial_balance - 1) * 100, 4),
+        "max_drawdown_pct": round(float(dd.min()) * 100, 4) if n_bars else 0.0,
+        "max_drawdown_duration_bars": longest_run(dd < 0) if n_bars else 0,
+        "sharpe": round(float(mean_ret / std * np.sqrt(bars_per_year)), 4) if std > 0 else 0.0,
+        "sortino": round(float(mean_ret / downside_std * np.sqrt(bars_per_year)), 4) if downside_std > 0 else 0.0,
+        "exposure_pct": round(float(np.mean(in_market)) * 100, 2) if n_bars else 0.0,
+        "turnover": round(float(notional.sum() / equity.mean()), 4) if n_bars and equity.mean() else 0.0,
+        "total_trades": int(len(pnl)),
+        "win_rate": round(float(len(wins) / len(pnl) * 100), 2) if len(pnl) else 0.0,
+        "profit_factor": round(float(gross_profit / gross_loss), 4) if gross_loss > 0 else None,
+        "avg_win": round(float(wins.mean()), 2) if len(wins) else 0.0,
+        "avg_loss": round(float(losses.mean()), 2) if len(losses) else 0.0,
+        "expectancy": round(float(pnl.mean()), 4) if len(pnl) else 0.0,
+        "pnl_by_confidence": by_confidence
+    }
+
+
+def predictions_to_columns(results):
+    """Результаты evaluate_history -> колонки прогнозов (индекс, время, решение, валидация)"""
+    predictions = [r["prediction"] for r in results]
+    return {
+        "index": np.array([r["index"] for r in results], dtype=np.int64),
+        "time": np.array([int(datetime.fromisoformat(r["timestamp"]).timestamp() * 1e9) for r in results],
+                         dtype=np.int64),
+        "action": np.array([p.get("action", "") for p in predictions], dtype="U4"),
+        "confidence": np.array([p.get("confidence", 0) for p in predictions], dtype=np.int16),
+        "entry_price": np.array([p.get("entry_price", np.nan) for p in predictions], dtype=np.float64),
+        "stop_loss": np.array([p.get("stop_loss", np.nan) for p in predictions], dtype=np.float64),
+        "take_profit": np.array([p.get("take_profit", np.nan) for p in predictions], dtype=np.float64),
+        "source": np.array([p.get("source", "llm") for p in predictions], dtype="U10"),
+        "accuracy": np.array([r["validation"].get("accuracy", "") for r in results], dtype="U10"),
+    }
+
+
+def save_columnar(path, trades, equity, equity_times, predictions=None):
+    """Сделки, кривая equity и прогнозы одним .npz (колонки trade_*, pred_*, equity, drawdown, equity_time)"""
+    arrays = {f"trade_{name}": np.asarray(values) for name, values in trades.items()}
+    arrays.update({f"pred_{name}": np.asarray(values) for name, values in (predictions or {}).items()})
+    equity = np.asarray(equity, dtype=np.float64)
+    np.savez_compressed(path, equity=equity, drawdown=drawdown_series(equity) if len(equity) else equity,
+                        equity_time=np.asarray(equity_times, dtype=np.int64), **arrays)
+    return path
+
+
+def load_columnar(path):
+    """→ (trades, equity, equity_times); все массивы читаются сразу, файл закрывается до возврата"""
+    with np.load(path) as data:
+        trades = {key[len("trade_"):]: data[key] for key in data.files if key.startswith("trade_")}
+        return trades, data["equity"], data["equity_time"]
+
+
+def load_predictions(path):
+    """Колонки прогнозов из .npz (пусто для прогонов, сохранённых до появления pred_*)"""
+    with np.load(path) as data:
+        return {key[len("pred_"):]: data[key] for key in data.files if key.startswith("pred_")}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сравнение результатов симуляций по .npz")
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--initial-balance", type=float, default=Config.INITIAL_BALANCE)
+    args = parser.parse_args(argv)
+
+    reports = {}
+    for path in args.paths:
+        trades, equity, _ = load_columnar(path)
+        reports[path] = compute_analytics(trades, equity, args.initial_balance)
+    keys = [k for k in next(iter(reports.values())) if k != "pnl_by_confidence"]
+    width = max(len(k) for k in keys)
+    for key in keys:
+        values = "  ".join(f"{str(r[key]):>14s}" for r in reports.values())
+        print(f"{key:{width}s}  {values}")
+    print(json.dumps({p: r["pnl_by_confidence"] for p, r in reports.items()}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
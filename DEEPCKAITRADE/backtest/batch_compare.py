@@ -0,0 +1,123 @@
+# backtest/batch_compare.py
+"""Пакетный инференс против обычного: одно окно бэктеста прогоняется в обоих режимах.
+
+    python -m DEEPCKAITRADE.backtest.batch_compare --steps 200 --batch-size 8
+    python -m DEEPCKAITRADE.backtest.batch_compare --start 2024-03-01 --end 2024-03-05 --gap 30
+
+Сравниваются токены и время на прогноз, точность (PredictionValidator) и совпадение решений
+по одинаковым свечам. Запросы настоящие — окно стоит держать небольшим.
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+import pytz
+
+from DEEPCKAITRADE.backtest.accuracy_test import evaluate_history, load_history_with_features
+from DEEPCKAITRADE.backtest.prediction_validator import PredictionValidator
+from DEEPCKAITRADE.config import Config
+from DEEPCKAITRADE.modules.api_client import DeepSeekClient
+from DEEPCKAITRADE.utils.logger import logger
+from DEEPCKAITRADE.utils.metrics import metrics
+
+USAGE_COUNTERS = ("llm_requests", "llm_prompt_tokens", "llm_completion_tokens")
+
+
+def run_mode(df, features, client, validator, config, start_idx, end_idx, batch_size):
+    before = metrics.snapshot()["counters"]
+    started = time.perf_counter()
+    results, successful = evaluate_history(df, client, validator, config, start_idx=start_idx, end_idx=end_idx,
+                                           rate_limit_sec=0, features=features, batch_size=batch_size)
+    wall_sec = time.perf_counter() - started
+    after = metrics.snapshot()["counters"]
+    usage = {name: after.get(name, 0) - before.get(name, 0) for name in USAGE_COUNTERS}
+    per_prediction = max(successful, 1)
+    return results, {
+        "batch_size": batch_size,
+        "predictions": successful,
+        "requests": usage["llm_requests"],
+        "prompt_tokens": usage["llm_prompt_tokens"],
+        "completion_tokens": usage["llm_completion_tokens"],
+        "tokens_per_prediction": round((usage["llm_prompt_tokens"] + usage["llm_completion_tokens"])
+                                       / per_prediction, 1),
+        "wall_sec": round(wall_sec, 2),
+        "wall_sec_per_prediction": round(wall_sec / per_prediction, 3),
+        "metrics": validator.calculate_accuracy_metrics(results),
+    }
+
+
+def agreement(single_results, batch_results):
+    """Доля свечей с одинаковым action в обоих режимах (по общим индексам)"""
+    single = {r["index"]: r["prediction"]["action"] for r in single_results}
+    batch = {r["index"]: r["prediction"]["action"] for r in batch_results}
+    common = single.keys() & batch.keys()
+    same = sum(1 for idx in common if single[idx] == batch[idx])
+    return {"common": len(common), "same_action": same,
+            "same_action_pct": round(same / len(common) * 100, 2) if common else 0.0}
+
+
+def compare_modes(config, steps, batch_size, start_date=None, end_date=None):
+    df, features = load_history_with_features(config, start_date=start_date, end_date=end_date)
+    validator = PredictionValidator(lookahead_candles=6)
+    start_idx = 50
+    end_idx = min(len(df) - validator.lookahead_candles, start_idx + steps)
+    client = DeepSeekClient(config)
+
+    single_results, single = run_mode(df, features, client, validator, config, start_idx, end_idx, 0)
+    client.reset_conversation()  # пакетный режим без истории диалога — и обычный не должен её передать дальше
+    batch_results, batch = run_mode(df, features, client, validator, config, start_idx, end_idx, batch_size)
+
+    return {
+        "metadata": {
+            "created_at": datetime.utcnow().isoformat() + "Z",
+            "instrument": config.INSTRUMENT_FIGI,
+            "model": config.DEEPSEEK_MODEL,
+            "candles": [start_idx, end_idx],
+            "gap": config.LLM_BATCH_GAP,
+        },
+        "single": single,
+        "batch": batch,
+        "agreement": agreement(single_results, batch_results),
+        "tokens_saved_pct": round((1 - batch["tokens_per_prediction"] / single["tokens_per_prediction"]) * 100, 1)
+        if single["tokens_per_prediction"] else None,
+        "speedup": round(single["wall_sec_per_prediction"] / batch["wall_sec_per_prediction"], 2)
+        if batch["wall_sec_per_prediction"] else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сравнение пакетного и обычного инференса на одном окне")
+    parser.add_argument("--steps", type=int, default=200, help="Сколько свечей прогнозировать")
+    parser.add_argument("--batch-size", type=int, default=Config.LLM_BATCH_SIZE or 8, help="Начальный K")
+    parser.add_argument("--gap", type=int, default=Config.LLM_BATCH_GAP, help="Свечей между снимками пакета")
+    parser.add_argument("--start", default=Config.BACKTEST_START)
+    parser.add_argument("--end", default=Config.BACKTEST_END)
+    args = parser.parse_args(argv)
+
+    Config.validate()
+    config = Config()
+    config.LLM_BATCH_GAP = args.gap
+    start = datetime.strptime(args.start, "%Y-%m-%d").replace(tzinfo=pytz.utc)
+    end = datetime.strptime(args.end, "%Y-%m-%d").replace(tzinfo=pytz.utc)
+    report = compare_modes(config, args.steps, args.batch_size, start, end)
+
+    for mode in ("single", "batch"):
+        r = report[mode]
+        logger.info(f"[Batch] {mode:6s} K={r['batch_size']}: {r['predictions']} прогнозов, {r['requests']} запросов, "
+                    f"{r['tokens_per_prediction']} ток/прогноз, {r['wall_sec_per_prediction']} с/прогноз, "
+                    f"точность {r['metrics']['accuracy_rate']:.1f}%")
+    logger.info(f"[Batch] Совпадение решений: {report['agreement']['same_action_pct']}% | "
+                f"токенов меньше на {report['tokens_saved_pct']}% | ускорение x{report['speedup']}")
+
+    os.makedirs(config.ACCURACY_RESULTS_DIR, exist_ok=True)
+    filename = os.path.join(config.ACCURACY_RESULTS_DIR, f"batch_compare_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    logger.info(f"[Batch] Сохранено: {filename}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -1,105 +1,324 @@
 import json
 from datetime import datetime
 import os
+import numpy as np
+import pandas as pd
 from DEEPCKAITRADE.config import Config
+from DEEPCKAITRADE.backtest.analytics import compute_analytics, save_columnar
+
+ACTION_SIDE = {"BUY": 1, "SELL": -1, "HOLD": 0}
+
+# Причины закрытия сделки (колонка exit_reason)
+EXIT_SIGNAL = 0  # закрыта противоположным сигналом
+EXIT_STOP = 1    # stop_loss внутри бара
+EXIT_TAKE = 2    # take_profit внутри бара
+EXIT_END = 3     # принудительно в конце данных
+EXIT_REASONS = {EXIT_SIGNAL: "signal", EXIT_STOP: "stop_loss", EXIT_TAKE: "take_profit", EXIT_END: "end_of_data"}
+
+TRADE_DTYPES = {
+    "entry_idx": np.int64, "exit_idx": np.int64,
+    "entry_time": np.int64, "exit_time": np.int64,  # нс с эпохи (UTC)
+    "side": np.int8, "size": np.float64,
+    "entry_price": np.float64, "exit_price": np.float64,
+    "sl": np.float64, "tp": np.float64,
+    "pnl": np.float64, "commission": np.float64,
+    "confidence": np.float64, "exit_reason": np.int8,
+    "balance_after": np.float64,
+}
+
+
+def _to_ns(values):
+    """Времена свечей → int64 наносекунд (UTC)"""
+    if isinstance(values, (pd.Series, pd.DatetimeIndex)) or (
+            isinstance(values, np.ndarray) and np.issubdtype(values.dtype, np.datetime64)):
+        return pd.DatetimeIndex(values).as_unit("ns").asi8.copy()
+    return np.asarray(values, dtype=np.int64)
+
+
+def _num(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def build_signals(entries):
+    """[(candle_idx, prediction), ...] → колонки сигналов для PortfolioSimulator.run()"""
+    n = len(entries)
+    signals = {
+        "idx": np.empty(n, dtype=np.int64),
+        "side": np.empty(n, dtype=np.int8),
+        "size": np.empty(n, dtype=np.float64),
+        "sl": np.empty(n, dtype=np.float64),
+        "tp": np.empty(n, dtype=np.float64),
+        "confidence": np.empty(n, dtype=np.float64),
+    }
+    for k, (idx, prediction) in enumerate(entries):
+        signals["idx"][k] = idx
+        signals["side"][k] = ACTION_SIDE.get(prediction.get("action"), 0)
+        signals["size"][k] = _num(prediction.get("size"))
+        signals["sl"][k] = _num(prediction.get("stop_loss"))
+        signals["tp"][k] = _num(prediction.get("take_profit"))
+        signals["confidence"][k] = _num(prediction.get("confidence"))
+    return signals
+
 
 class PortfolioSimulator:
-    def __init__(self, initial_balance):
-        self.balance = initial_balance
+    """Событийный симулятор одной позиции по массивам свечей.
+
+    Вход — по close сигнальной свечи, выход — противоположным сигналом или по SL/TP
+    внутри следующих свечей (по high/low; если бар задевает оба — считаем, что первым сработал SL).
+    Сделки и equity хранятся в заранее выделенных массивах NumPy.
+    """
+
+    def __init__(self, initial_balance, commission_per_share=None, fixed_commission=None, slippage=None,
+                 allow_short=True):
+        config = Config()
+        self.commission_per_share = config.COMMISSION_PER_SHARE if commission_per_share is None else commission_per_share
+        self.fixed_commission = config.FIXED_COMMISSION if fixed_commission is None else fixed_commission
+        self.slippage = config.MAX_SLIPPAGE if slippage is None else slippage
+        self.allow_short = allow_short
+        self.start_date = config.BACKTEST_START
+        self.end_date = config.BACKTEST_END
         self.initial_balance = initial_balance
-        self.positions = {}  # {"AAPL": {"quantity": 10, "avg_price": 150.00}}
-        self.trades = []     # История сделок
-        self.equity_history = []  # Для графиков
-    
-    def get_equity(self, current_prices):
-        """Рассчитывает текущую equity с учётом открытых позиций"""
-        equity = self.balance
-        for symbol, pos in self.positions.items():
-            if symbol in current_prices:
-                equity += pos["quantity"] * current_prices[symbol]
-        return equity
-    
-    def execute_trade(self, prediction, current_price, timestamp):
-        """Имитирует исполнение сделки"""
-        symbol = "SIMULATED"  # Для упрощения
-        action = prediction["action"]
-        size = prediction["size"]
-        sl = prediction["stop_loss"]
-        tp = prediction["take_profit"]
-        
-        if action == "HOLD":
+        self.reset()
+
+    def reset(self, capacity=64):
+        self.balance = self.initial_balance
+        self.n_trades = 0
+        self.rejected = 0
+        self._trades = {name: np.empty(capacity, dtype=dtype) for name, dtype in TRADE_DTYPES.items()}
+        self.equity_history = np.empty(0, dtype=np.float64)
+        self.equity_times = np.empty(0, dtype=np.int64)
+        self._event_idx = 0
+        self._clear_position()
+
+    def _clear_position(self):
+        self.pos_side = 0
+        self.pos_size = 0.0
+        self.pos_entry_price = 0.0
+        self.pos_sl = np.nan
+        self.pos_tp = np.nan
+        self.pos_entry_idx = -1
+        self.pos_entry_time = 0
+        self.pos_commission = 0.0
+        self.pos_confidence = np.nan
+
+    # === Учёт сделок ===
+    @property
+    def trades(self):
+        """Колонки закрытых сделок (срезы без копирования)"""
+        return {name: arr[:self.n_trades] for name, arr in self._trades.items()}
+
+    def _reserve(self, extra):
+        capacity = len(self._trades["side"])
+        if self.n_trades + extra <= capacity:
             return
-        
-        # Расчёт комиссии
-        commission = Config().FIXED_COMMISSION + (size * Config().COMMISSION_PER_SHARE)
-        cost = size * current_price if action == "BUY" else 0
-        
-        if action == "BUY":
-            # Проверка достаточности средств
-            if self.balance < cost + commission:
-                print(f"[BACKTEST] Недостаточно средств для BUY {size} по {current_price}")
+        new_capacity = max(capacity * 2, self.n_trades + extra)
+        for name, arr in self._trades.items():
+            grown = np.empty(new_capacity, dtype=arr.dtype)
+            grown[:self.n_trades] = arr[:self.n_trades]
+            self._trades[name] = grown
+
+    def _commission(self, size):
+        return self.fixed_commission + size * self.commission_per_share
+
+    def _open(self, idx, time_ns, side, size, price, sl, tp, confidence):
+        if side == -1 and not self.allow_short:
+            return False
+        if not size or size <= 0 or np.isnan(size):
+            self.rejected += 1
+            return False
+        fill = price + side * self.slippage
+        commission = self._commission(size)
+        if size * fill + commission > self.balance:
+            self.rejected += 1  # недостаточно средств
+            return False
+        self.balance -= side * size * fill + commission
+        self.pos_side = side
+        self.pos_size = size
+        self.pos_entry_price = fill
+        self.pos_sl = sl
+        self.pos_tp = tp
+        self.pos_entry_idx = idx
+        self.pos_entry_time = time_ns
+        self.pos_commission = commission
+        self.pos_confidence = confidence
+        return True
+
+    def _close(self, idx, time_ns, fill, reason):
+        side, size = self.pos_side, self.pos_size
+        commission = self._commission(size)
+        self.balance += side * size * fill - commission
+        self._reserve(1)
+        k = self.n_trades
+        t = self._trades
+        t["entry_idx"][k] = self.pos_entry_idx
+        t["exit_idx"][k] = idx
+        t["entry_time"][k] = self.pos_entry_time
+        t["exit_time"][k] = time_ns
+        t["side"][k] = side
+        t["size"][k] = size
+        t["entry_price"][k] = self.pos_entry_price
+        t["exit_price"][k] = fill
+        t["sl"][k] = self.pos_sl
+        t["tp"][k] = self.pos_tp
+        t["commission"][k] = self.pos_commission + commission
+        t["pnl"][k] = side * size * (fill - self.pos_entry_price) - self.pos_commission - commission
+        t["confidence"][k] = self.pos_confidence
+        t["exit_reason"][k] = reason
+        t["balance_after"][k] = self.balance
+        self.n_trades += 1
+        self._clear_position()
+
+    def _mark(self, close):
+        return self.balance + self.pos_side * self.pos_size * close
+
+    # === Событийный прогон ===
+    def run(self, candles, signals, close_at_end=True):
+        """Один проход по свечам: candles — DataFrame/словарь колонок open/high/low/close(/time),
+        signals — колонки idx/side/size/sl/tp/confidence (см. build_signals)."""
+        o = np.asarray(candles["open"], dtype=np.float64)
+        h = np.asarray(candles["high"], dtype=np.float64)
+        lo = np.asarray(candles["low"], dtype=np.float64)
+        c = np.asarray(candles["close"], dtype=np.float64)
+        n = len(c)
+        times = _to_ns(candles["time"]) if "time" in candles else np.arange(n, dtype=np.int64)
+
+        self.reset(capacity=max(len(signals["idx"]) + 1, 8))
+        self.equity_history = np.empty(n, dtype=np.float64)
+        self.equity_times = times
+        bars = (o, h, lo, c, times)
+
+        order = np.argsort(signals["idx"], kind="stable")
+        sig = {name: np.asarray(signals[name])[order].tolist() for name in ("idx", "side", "size", "sl", "tp", "confidence")}
+        cursor = 0
+        for s, side, size, sl, tp, conf in zip(sig["idx"], sig["side"], sig["size"], sig["sl"], sig["tp"],
+                                                sig["confidence"]):
+            if s < 0 or s >= n:
+                continue
+            self._advance(cursor, s, bars)
+            cursor = max(cursor, s + 1)
+            if side == 0 or side == self.pos_side:
+                continue
+            if self.pos_side:
+                self._close(s, times[s], c[s] - self.pos_side * self.slippage, EXIT_SIGNAL)
+            self._open(s, times[s], side, size, c[s], sl, tp, conf)
+            self.equity_history[s] = self._mark(c[s])
+
+        self._advance(cursor, n - 1, bars)
+        if close_at_end and self.pos_side and n:
+            self._close(n - 1, times[-1], c[-1] - self.pos_side * self.slippage, EXIT_END)
+            self.equity_history[-1] = self.balance
+        return self.summary()
+
+    def _advance(self, start, stop, bars):
+        """Проверяет SL/TP на барах [start, stop] и заполняет equity по close"""
+        o, h, lo, c, times = bars
+        while start <= stop:
+            if not self.pos_side:
+                self.equity_history[start:stop + 1] = self.balance
                 return
-            
-            # Обновление позиции
-            if symbol in self.positions:
-                old_qty = self.positions[symbol]["quantity"]
-                old_avg = self.positions[symbol]["avg_price"]
-                new_avg = (old_qty * old_avg + size * current_price) / (old_qty + size)
-                self.positions[symbol] = {"quantity": old_qty + size, "avg_price": new_avg}
-            else:
-                self.positions[symbol] = {"quantity": size, "avg_price": current_price}
-            
-            self.balance -= (cost + commission)
-            
-        elif action == "SELL":
-            # Для упрощения: закрываем всю позицию
-            if symbol in self.positions:
-                qty = self.positions[symbol]["quantity"]
-                avg_price = self.positions[symbol]["avg_price"]
-                proceeds = qty * current_price
-                self.balance += (proceeds - commission)
-                pnl = (current_price - avg_price) * qty
-                del self.positions[symbol]
+            side, sl, tp = self.pos_side, self.pos_sl, self.pos_tp
+            hi_w, lo_w = h[start:stop + 1], lo[start:stop + 1]
+            if side == 1:
+                hit_sl, hit_tp = lo_w <= sl, hi_w >= tp
             else:
-                print(f"[BACKTEST] Попытка SELL без позиции")
+                hit_sl, hit_tp = hi_w >= sl, lo_w <= tp
+            hits = np.flatnonzero(hit_sl | hit_tp)
+            if not len(hits):
+                self.equity_history[start:stop + 1] = self.balance + side * self.pos_size * c[start:stop + 1]
                 return
-        
-        # Сохраняем сделку
-        self.trades.append({
-            "timestamp": timestamp,
-            "action": action,
-            "size": size,
-            "price": current_price,
-            "sl": sl,
-            "tp": tp,
-            "commission": commission,
-            "balance_after": self.balance
-        })
-    
+            j = start + int(hits[0])
+            self.equity_history[start:j] = self.balance + side * self.pos_size * c[start:j]
+            if hit_sl[j - start]:
+                # Стоп — рыночная заявка: гэп через уровень исполняется по open, плюс проскальзывание
+                fill = (min(o[j], sl) if side == 1 else max(o[j], sl)) - side * self.slippage
+                reason = EXIT_STOP
+            else:
+                # Тейк — лимитная заявка: гэп в нашу сторону исполняется по open
+                fill = max(o[j], tp) if side == 1 else min(o[j], tp)
+                reason = EXIT_TAKE
+            self._close(j, times[j], fill, reason)
+            self.equity_history[j] = self.balance
+            start = j + 1
+
+    # === Потоковый API (один сигнал по текущей цене, без внутрибарных SL/TP) ===
+    def get_equity(self, current_price):
+        """Рассчитывает текущую equity с учётом открытой позиции"""
+        return self._mark(current_price)
+
+    def execute_trade(self, prediction, current_price, timestamp):
+        """Имитирует исполнение сделки"""
+        side = ACTION_SIDE.get(prediction["action"], 0)
+        if not side or side == self.pos_side:
+            return
+        idx = self._event_idx
+        self._event_idx += 1
+        time_ns = int(pd.Timestamp(timestamp).value) if timestamp is not None else idx
+        if self.pos_side:
+            self._close(idx, time_ns, current_price - self.pos_side * self.slippage, EXIT_SIGNAL)
+        self._open(idx, time_ns, side, _num(prediction.get("size")), current_price,
+                   _num(prediction.get("stop_loss")), _num(prediction.get("take_profit")),
+                   _num(prediction.get("confidence")))
+
+    # === Результаты ===
+    def summary(self):
+        trades = self.trades
+        pnl = trades["pnl"]
+        final_equity = float(self.equity_history[-1]) if len(self.equity_history) else self._mark(
+            self.pos_entry_price)
+        return {
+            "initial_balance": self.initial_balance,
+            "final_balance": float(self.balance),
+            "final_equity": float(final_equity),
+            "total_return_pct": ((final_equity / self.initial_balance) - 1) * 100,
+            "total_trades": int(self.n_trades),
+            "winning_trades": int((pnl > 0).sum()),
+            "rejected_signals": int(self.rejected),
+            "stop_loss_exits": int((trades["exit_reason"] == EXIT_STOP).sum()),
+            "take_profit_exits": int((trades["exit_reason"] == EXIT_TAKE).sum()),
+            "total_commission": float(trades["commission"].sum()),
+            "start_date": self.start_date,
+            "end_date": self.end_date
+        }
+
+    def trades_as_records(self):
+        trades = self.trades
+        records = []
+        for k in range(self.n_trades):
+            record = {name: trades[name][k].item() for name in TRADE_DTYPES}
+            record["exit_reason"] = EXIT_REASONS[record["exit_reason"]]
+            record["action"] = "BUY" if record["side"] == 1 else "SELL"
+            records.append(record)
+        return records
+
     def save_results(self, output_dir="backtest_results"):
-        """Сохраняет результаты симуляции"""
+        """Сохраняет результаты: JSON-сводка + колоночный .npz со сделками и equity рядом"""
         os.makedirs(output_dir, exist_ok=True)
-        
+
+        base = f"{output_dir}/backtest_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        columnar_file = save_columnar(base + ".npz", self.trades, self.equity_history, self.equity_times)
+
         results = {
-            "metadata": {
-                "initial_balance": self.initial_balance,
-                "final_balance": self.balance,
-                "total_return_pct": ((self.balance / self.initial_balance) - 1) * 100,
-                "total_trades": len(self.trades),
-                "start_date": Config().BACKTEST_START,
-                "end_date": Config().BACKTEST_END
-            },
-            "trades": self.trades,
-            "final_positions": self.positions
+            "metadata": self.summary(),
+            "analytics": compute_analytics(self.trades, self.equity_history, self.initial_balance),
+            "columnar_file": os.path.basename(columnar_file),
+            "final_position": {
+                "side": int(self.pos_side),
+                "size": self.pos_size,
+                "avg_price": self.pos_entry_price
+            }
         }
-        
-        filename = f"{output_dir}/backtest_results_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+
+        filename = base + ".json"
         with open(filename, 'w') as f:
             json.dump(results, f, indent=2)
-        
+
         print(f"\n✅ Бэктест завершён! Результаты сохранены в {filename}")
         print(f"📈 Доходность: {results['metadata']['total_return_pct']:.2f}%")
+        print(f"📉 Макс. просадка: {results['analytics']['max_drawdown_pct']:.2f}% | Sharpe: {results['analytics']['sharpe']}")
         print(f"💰 Итоговый баланс: ${self.balance:.2f}")
-        print(f"📊 Сделок: {len(self.trades)}")
-        
-        return filename
\ No newline at end of file
+        print(f"📊 Сделок: {self.n_trades}")
+
+        return filename
@@ -3,34 +3,40 @@ import json
 from datetime import datetime
 from DEEPCKAITRADE.utils.logger import setup_logger, logger
 from DEEPCKAITRADE.config import Config
+from DEEPCKAITRADE.modules.payload import encode, payload_bytes
 
 class PredictionHandler:
-    def __init__(self):
-        self.config = Config()
+    def __init__(self, config=None):
+        self.config = config or Config  # снимок Config.freeze() из цикла; без него — текущий Config
         # Используем директорию из config, а не отдельную
         self.prediction_dir = self.config.PREDICTIONS_DIR
         os.makedirs(self.prediction_dir, exist_ok=True)
     
+    def encode_record(self, market_data, prediction, latency=0.0):
+        """Запись {metadata, input_data, prediction}; input_data — готовый JSON цикла, без повторной сериализации"""
+        metadata = {
+            "generated_at": datetime.utcnow().isoformat() + "Z",
+            "latency_sec": latency,
+            "model": os.getenv("DEEPSEEK_MODEL", "deepseek-chat"),
+            "instrument": market_data["instrument_specs"]["symbol"]
+        }
+        return b''.join((b'{"metadata":', encode(metadata), b',"input_data":', payload_bytes(market_data),
+                         b',"prediction":', encode(prediction), b'}'))
+
     def save_prediction(self, market_data, prediction, latency=0.0):
         """Сохраняет прогноз с метаданными в файл"""
-        timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+        # Имя — по времени цикла из market_data (в replay — виртуальное), а не по часам машины:
+        # иначе ускоренный прогон перезаписывает файлы, попавшие в одну секунду
+        try:
+            cycle_time = datetime.fromisoformat(str(market_data["timestamp"]).rstrip("Z"))
+        except (KeyError, ValueError):
+            cycle_time = datetime.utcnow()
+        timestamp = cycle_time.strftime("%Y%m%d_%H%M%S")
         filename = f"pred_{timestamp}.json"
         filepath = os.path.join(self.prediction_dir, filename)
-        
-        # Формируем полную запись с контекстом
-        record = {
-            "metadata": {
-                "generated_at": datetime.utcnow().isoformat() + "Z",
-                "latency_sec": latency,
-                "model": os.getenv("DEEPSEEK_MODEL", "deepseek-chat"),
-                "instrument": market_data["instrument_specs"]["symbol"]
-            },
-            "input_data": market_data,
-            "prediction": prediction
-        }
-        
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(record, f, indent=2, ensure_ascii=False)
+
+        with open(filepath, 'wb') as f:
+            f.write(self.encode_record(market_data, prediction, latency))
         
         print(f"[PREDICTION] Сохранено: {filename} | Действие: {prediction['action']} | Уверенность: {prediction['confidence']}")
         return filepath
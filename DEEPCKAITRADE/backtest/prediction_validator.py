@@ -2,6 +2,7 @@
 import pandas as pd
 from datetime import timedelta
 import numpy as np
+from DEEPCKAITRADE.utils.logger import logger
 
 class PredictionValidator:
     def __init__(self, lookahead_candles=6):  # 6 свечей M5 = 30 минут
@@ -77,38 +78,52 @@ class PredictionValidator:
 
     def calculate_accuracy_metrics(self, results):
         """Собирает финальные метрики"""
-        total_predictions = len(results)
-
-        correct_predictions = len([r for r in results if r.get("validation", {}).get("accuracy") == "correct"])
-        incorrect_predictions = len([r for r in results if r.get("validation", {}).get("accuracy") == "incorrect"])
-        partial_predictions = len([r for r in results if r.get("validation", {}).get("accuracy") == "partial"])
-
-        accuracy_rate = (correct_predictions / total_predictions * 100) if total_predictions > 0 else 0
-
-        precision_buy = self._calculate_precision(results, "BUY")
-        precision_sell = self._calculate_precision(results, "SELL")
-
+        return self.metrics_from_counts(self.accuracy_counts(results))
+
+    @staticmethod
+    def accuracy_counts(results):
+        """Сырые счётчики — их можно суммировать между шардами без потери точности"""
+        counts = {
+            "total": len(results), "correct": 0, "incorrect": 0, "partial": 0,
+            "buy_total": 0, "buy_correct": 0, "sell_total": 0, "sell_correct": 0,
+            "high_conf_total": 0, "high_conf_correct": 0
+        }
+        for r in results:
+            accuracy = r.get("validation", {}).get("accuracy")
+            prediction = r.get("prediction", {})
+            correct = accuracy == "correct"
+            if accuracy in ("correct", "incorrect", "partial"):
+                counts[accuracy] += 1
+            action = prediction.get("action")
+            if action in ("BUY", "SELL"):
+                counts[f"{action.lower()}_total"] += 1
+                counts[f"{action.lower()}_correct"] += correct
+            if prediction.get("confidence", 0) >= 85:
+                counts["high_conf_total"] += 1
+                counts["high_conf_correct"] += correct
+        return counts
+
+    @staticmethod
+    def merge_counts(counts_list):
+        merged = {}
+        for counts in counts_list:
+            for key, value in counts.items():
+                merged[key] = merged.get(key, 0) + value
+        return merged
+
+    @staticmethod
+    def metrics_from_counts(counts):
+        def pct(part, whole):
+            return round((part / whole) * 100, 2) if whole else 0.0
+
+        total_predictions = counts.get("total", 0)
         return {
             "total_predictions": total_predictions,
-            "correct_predictions": correct_predictions,
-            "incorrect_predictions": incorrect_predictions,
-            "partial_predictions": partial_predictions,
-            "accuracy_rate": round(accuracy_rate, 2),
-            "precision_buy": precision_buy,
-            "precision_sell": precision_sell,
-            "win_rate_high_confidence": self._high_confidence_winrate(results),
+            "correct_predictions": counts.get("correct", 0),
+            "incorrect_predictions": counts.get("incorrect", 0),
+            "partial_predictions": counts.get("partial", 0),
+            "accuracy_rate": pct(counts.get("correct", 0), total_predictions),
+            "precision_buy": pct(counts.get("buy_correct", 0), counts.get("buy_total", 0)),
+            "precision_sell": pct(counts.get("sell_correct", 0), counts.get("sell_total", 0)),
+            "win_rate_high_confidence": pct(counts.get("high_conf_correct", 0), counts.get("high_conf_total", 0)),
         }
-
-    def _calculate_precision(self, results, action_type):
-        relevant = [r for r in results if r.get("prediction", {}).get("action") == action_type]
-        if not relevant:
-            return 0.0
-        correct = len([r for r in relevant if r.get("validation", {}).get("accuracy") == "correct"])
-        return round((correct / len(relevant)) * 100, 2)
-
-    def _high_confidence_winrate(self, results):
-        high_conf = [r for r in results if r.get("prediction", {}).get("confidence", 0) >= 85]
-        if not high_conf:
-            return 0.0
-        correct = len([r for r in high_conf if r.get("validation", {}).get("accuracy") == "correct"])
-        return round((correct / len(high_conf)) * 100, 2)
\ No newline at end of file
@@ -0,0 +1,331 @@
+# backtest/results_index.py
+"""Индекс прогонов бэктеста в локальном SQLite: метаданные, плоские метрики и пути к .json/.npz.
+
+    python -m DEEPCKAITRADE.backtest.results_index list --model deepseek-chat --where "accuracy_rate>=55"
+    python -m DEEPCKAITRADE.backtest.results_index list --order-by sharpe --metrics accuracy_rate sharpe --limit 20
+    python -m DEEPCKAITRADE.backtest.results_index diff accuracy_test_20250301_101500 accuracy_test_20250302_093000
+    python -m DEEPCKAITRADE.backtest.results_index show accuracy_test_20250301_101500
+    python -m DEEPCKAITRADE.backtest.results_index reindex      # досканировать ACCURACY_RESULTS_DIR
+
+run_accuracy_test регистрирует каждый прогон сам. Метрики хранятся строками (run_id, name, value)
+с индексом по (name, value): фильтр и сортировка по любой метрике не требуют чтения отчётов.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from datetime import datetime
+
+from DEEPCKAITRADE.config import Config
+from DEEPCKAITRADE.utils.logger import logger
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    created_at TEXT NOT NULL,
+    instrument TEXT,
+    model TEXT,
+    prompt_hash TEXT,
+    config_hash TEXT,
+    start_date TEXT,
+    end_date TEXT,
+    lookahead_minutes INTEGER,
+    report_path TEXT NOT NULL,
+    columnar_path TEXT,
+    config_json TEXT
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id TEXT NOT NULL REFERENCES runs(run_id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (run_id, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS runs_by_instrument ON runs(instrument, created_at);
+CREATE INDEX IF NOT EXISTS runs_by_model ON runs(model, created_at);
+CREATE INDEX IF NOT EXISTS runs_by_prompt ON runs(prompt_hash);
+CREATE INDEX IF NOT EXISTS metrics_by_name ON metrics(name, value);
+"""
+
+RUN_COLUMNS = ("run_id", "created_at", "instrument", "model", "prompt_hash", "config_hash", "start_date",
+               "end_date", "lookahead_minutes", "report_path", "columnar_path")
+DEFAULT_METRICS = ("total_predictions", "accuracy_rate", "win_rate_high_confidence", "total_trades",
+                   "total_return_pct", "sharpe", "max_drawdown_pct")
+SECRET_MARKERS = ("TOKEN", "KEY", "ACCOUNT")
+# Окно дат хранится отдельно: одинаковые настройки на разных окнах — один config_hash
+NOT_HASHED = ("BACKTEST_START", "BACKTEST_END")
+WHERE_RE = re.compile(r"^\s*([\w.]+)\s*(>=|<=|!=|=|>|<)\s*(-?[\d.]+(?:e-?\d+)?)\s*$")
+NAME_RE = re.compile(r"^[\w.]+$")
+
+
+def config_snapshot(config):
+    """Настройки прогона без секретов — для хранения и сравнения"""
+    return {name: getattr(config, name) for name in dir(config)
+            if name.isupper() and not any(marker in name for marker in SECRET_MARKERS)}
+
+
+def config_hash(snapshot):
+    hashed = {k: v for k, v in snapshot.items() if k not in NOT_HASHED}
+    return hashlib.sha1(json.dumps(hashed, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:12]
+
+
+def flatten_metrics(report):
+    """Числовые метрики отчёта: metrics, simulation и simulation.analytics в одном пространстве имён"""
+    flat = {}
+    simulation = report.get("simulation") or {}
+    for section in (report.get("metrics") or {}, simulation, simulation.get("analytics") or {}):
+        for name, value in section.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                flat[name] = float(value)
+    return flat
+
+
+def parse_where(expression):
+    """'accuracy_rate>=55' -> ('accuracy_rate', '>=', 55.0)"""
+    match = WHERE_RE.match(expression)
+    if not match:
+        raise ValueError(f"Условие не распознано: {expression!r} (ожидается метрика<оп>число)")
+    return match.group(1), match.group(2), float(match.group(3))
+
+
+class ResultsIndex:
+    def __init__(self, path=None):
+        self.path = path or Config.RESULTS_INDEX_PATH
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def register(self, report, report_path, config=None, prompt_hash=None):
+        """Добавляет (или перезаписывает) прогон; config/prompt_hash — если их нет в metadata отчёта"""
+        meta = report.get("metadata", {})
+        run_id = os.path.splitext(os.path.basename(report_path))[0]
+        snapshot = config_snapshot(config) if config is not None else meta.get("config")
+        columnar = meta.get("columnar_file")
+        if columnar:
+            columnar = os.path.join(os.path.dirname(os.path.abspath(report_path)), columnar)
+        created_at = meta.get("created_at") or datetime.fromtimestamp(os.path.getmtime(report_path)).isoformat()
+        row = {
+            "run_id": run_id,
+            "created_at": created_at,
+            "instrument": meta.get("instrument"),
+            "model": meta.get("model") or (snapshot or {}).get("DEEPSEEK_MODEL"),
+            "prompt_hash": prompt_hash or meta.get("prompt_hash"),
+            "config_hash": config_hash(snapshot) if snapshot else None,
+            "start_date": meta.get("start_date"),
+            "end_date": meta.get("end_date"),
+            "lookahead_minutes": meta.get("lookahead_minutes"),
+            "report_path": os.path.abspath(report_path),
+            "columnar_path": columnar,
+            "config_json": json.dumps(snapshot, sort_keys=True, default=str) if snapshot else None,
+        }
+        with self.conn:
+            self.conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
+            self.conn.execute(f"INSERT INTO runs ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                              tuple(row.values()))
+            self.conn.executemany("INSERT INTO metrics (run_id, name, value) VALUES (?, ?, ?)",
+                                  [(run_id, name, value) for name, value in flatten_metrics(report).items()])
+        return run_id
+
+    def reindex(self, directory=None):
+        """Регистрирует отчёты accuracy_test_*.json, которых ещё нет в индексе; удаляет записи без файлов"""
+        directory = directory or Config.ACCURACY_RESULTS_DIR
+        known = {r["run_id"]: r["report_path"] for r in self.conn.execute("SELECT run_id, report_path FROM runs")}
+        added = 0
+        for path in sorted(glob.glob(os.path.join(directory, "accuracy_test_*.json"))):
+            if os.path.splitext(os.path.basename(path))[0] in known:
+                continue
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    self.register(json.load(f), path)
+                added += 1
+            except (OSError, ValueError) as e:
+                logger.warning(f"[Index] Пропуск {path}: {e}")
+        missing = [run_id for run_id, path in known.items() if not os.path.exists(path)]
+        with self.conn:
+            self.conn.executemany("DELETE FROM runs WHERE run_id = ?", [(run_id,) for run_id in missing])
+        return added, len(missing)
+
+    def metric_names(self):
+        return [r[0] for r in self.conn.execute("SELECT DISTINCT name FROM metrics ORDER BY name")]
+
+    def query(self, instrument=None, model=None, prompt_hash=None, config_hash=None, since=None, until=None,
+              where=(), metrics=DEFAULT_METRICS, order_by="created_at", descending=True, limit=50):
+        """Прогоны по фильтрам; каждая строка — колонки runs плюс запрошенные метрики"""
+        clauses, params = [], []
+        for column, value in (("instrument", instrument), ("model", model), ("prompt_hash", prompt_hash),
+                              ("config_hash", config_hash)):
+            if value is not None:
+                clauses.append(f"r.{column} = ?")
+                params.append(value)
+        if since:
+            clauses.append("r.created_at >= ?")
+            params.append(since)
+        if until:
+            clauses.append("r.created_at < ?")
+            params.append(until)
+        for expression in where:
+            name, op, value = parse_where(expression) if isinstance(expression, str) else expression
+            clauses.append(f"EXISTS (SELECT 1 FROM metrics w WHERE w.run_id = r.run_id AND w.name = ? "
+                           f"AND w.value {op} ?)")
+            params.extend([name, value])
+
+        metrics = list(metrics)
+        for name in [*metrics, order_by]:
+            if not NAME_RE.match(name):
+                raise ValueError(f"Недопустимое имя метрики: {name!r}")
+        if order_by not in RUN_COLUMNS and order_by not in metrics:
+            metrics.append(order_by)
+        pivot = ", ".join(f'MAX(CASE WHEN m.name = ? THEN m.value END) AS "{name}"' for name in metrics)
+        order = f'"{order_by}"' if order_by not in RUN_COLUMNS else f"r.{order_by}"
+        sql = (f"SELECT {', '.join('r.' + c for c in RUN_COLUMNS)}{', ' + pivot if pivot else ''} "
+               f"FROM runs r LEFT JOIN metrics m ON m.run_id = r.run_id "
+               f"{'WHERE ' + ' AND '.join(clauses) if clauses else ''} "
+               f"GROUP BY r.run_id ORDER BY {order} IS NULL, {order} {'DESC' if descending else 'ASC'} LIMIT ?")
+        rows = self.conn.execute(sql, [*metrics, *params, limit]).fetchall()
+        return [dict(row) for row in rows]
+
+    def get(self, run_id):
+        row = self.conn.execute("SELECT * FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"Прогон не найден: {run_id}")
+        run = dict(row)
+        run["config"] = json.loads(run.pop("config_json")) if run["config_json"] else None
+        run["metrics"] = {r["name"]: r["value"] for r in
+                          self.conn.execute("SELECT name, value FROM metrics WHERE run_id = ?", (run_id,))}
+        return run
+
+    def diff(self, run_ids, names=None):
+        """Метрики бок о бок (+ разница последнего с первым) и отличающиеся настройки"""
+        runs = [self.get(run_id) for run_id in run_ids]
+        names = names or sorted(set().union(*(run["metrics"] for run in runs)))
+        rows = {}
+        for name in names:
+            values = [run["metrics"].get(name) for run in runs]
+            delta = values[-1] - values[0] if values[0] is not None and values[-1] is not None else None
+            rows[name] = {"values": values, "delta": delta}
+        configs = [run["config"] or {} for run in runs]
+        keys = sorted(set().union(*configs))
+        config_diff = {key: [c.get(key) for c in configs] for key in keys
+                       if len({json.dumps(c.get(key), sort_keys=True, default=str) for c in configs}) > 1}
+        for column in ("model", "prompt_hash", "instrument", "start_date", "end_date"):
+            values = [run[column] for run in runs]
+            if len(set(values)) > 1:
+                config_diff[column] = values
+        return {"runs": list(run_ids), "metrics": rows, "config": config_diff}
+
+    def predictions(self, run_id):
+        """Колонки прогнозов прогона из его .npz"""
+        from DEEPCKAITRADE.backtest.analytics import load_predictions
+        path = self.get(run_id)["columnar_path"]
+        if not path or not os.path.exists(path):
+            raise FileNotFoundError(f"Нет колоночных данных для {run_id}")
+        return load_predictions(path)
+
+
+def _fmt(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.4g}" if abs(value) < 1e6 else f"{value:.0f}"
+    return str(value)
+
+
+def print_runs(rows, metrics):
+    headers = ["run_id", "instrument", "model", "prompt_hash", *metrics]
+    table = [[_fmt(row.get(h)) for h in headers] for row in rows]
+    widths = [max(len(h), *(len(r[i]) for r in table)) if table else len(h) for i, h in enumerate(headers)]
+    print("  ".join(h.ljust(w) for h, w in zip(headers, widths)))
+    for r in table:
+        print("  ".join(v.ljust(w) for v, w in zip(r, widths)))
+    print(f"({len(rows)} прогонов)")
+
+
+def print_diff(result):
+    runs = result["runs"]
+    width = max([len(name) for name in result["metrics"]] + [len(k) for k in result["config"]] + [6])
+    col = max(14, *(len(r) for r in runs))
+    print(f"{'':{width}s}  " + "  ".join(r.rjust(col) for r in runs) + "  " + "Δ".rjust(12))
+    for name, row in result["metrics"].items():
+        values = "  ".join(_fmt(v).rjust(col) for v in row["values"])
+        print(f"{name:{width}s}  {values}  {_fmt(row['delta']).rjust(12)}")
+    if result["config"]:
+        print("\nОтличия настроек:")
+        for key, values in result["config"].items():
+            print(f"{key:{width}s}  " + "  ".join(_fmt(v).rjust(col) for v in values))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Индекс прогонов бэктеста: поиск и сравнение")
+    parser.add_argument("--index", default=None, help="Путь к SQLite (по умолчанию Config.RESULTS_INDEX_PATH)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ls = sub.add_parser("list", help="Прогоны по фильтрам")
+    ls.add_argument("--instrument")
+    ls.add_argument("--model")
+    ls.add_argument("--prompt-hash")
+    ls.add_argument("--config-hash")
+    ls.add_argument("--since", help="created_at >= (ISO, например 2025-03-01)")
+    ls.add_argument("--until", help="created_at < (ISO)")
+    ls.add_argument("--where", action="append", default=[], help="Условие по метрике: accuracy_rate>=55")
+    ls.add_argument("--metrics", nargs="+", default=list(DEFAULT_METRICS))
+    ls.add_argument("--order-by", default="created_at")
+    ls.add_argument("--asc", action="store_true")
+    ls.add_argument("--limit", type=int, default=50)
+
+    df = sub.add_parser("diff", help="Метрики прогонов бок о бок")
+    df.add_argument("run_ids", nargs="+")
+    df.add_argument("--metrics", nargs="+", default=None)
+
+    show = sub.add_parser("show", help="Метаданные, метрики и сводка прогнозов прогона")
+    show.add_argument("run_id")
+
+    rx = sub.add_parser("reindex", help="Досканировать каталог отчётов")
+    rx.add_argument("--dir", default=None)
+
+    sub.add_parser("metrics", help="Имена метрик в индексе")
+    args = parser.parse_args(argv)
+
+    with ResultsIndex(args.index) as index:
+        if args.command == "list":
+            rows = index.query(args.instrument, args.model, args.prompt_hash, args.config_hash, args.since,
+                               args.until, args.where, args.metrics, args.order_by, not args.asc, args.limit)
+            print_runs(rows, args.metrics)
+        elif args.command == "diff":
+            print_diff(index.diff(args.run_ids, args.metrics))
+        elif args.command == "show":
+            run = index.get(args.run_id)
+            print(json.dumps({k: v for k, v in run.items() if k != "config"}, indent=2, ensure_ascii=False))
+            try:
+                columns = index.predictions(args.run_id)
+            except FileNotFoundError as e:
+                print(e)
+            else:
+                if columns:
+                    pairs = zip(columns["action"].tolist(), columns["accuracy"].tolist())
+                    summary = {}
+                    for action, accuracy in pairs:
+                        summary.setdefault(action, {}).setdefault(accuracy, 0)
+                        summary[action][accuracy] += 1
+                    print(f"Прогнозов: {len(columns['action'])} | по action/accuracy: {summary}")
+        elif args.command == "reindex":
+            added, removed = index.reindex(args.dir)
+            print(f"Добавлено: {added}, удалено записей без файлов: {removed}")
+        elif args.command == "metrics":
+            print("\n".join(index.metric_names()))
+
+
+if __name__ == "__main__":
+    main()
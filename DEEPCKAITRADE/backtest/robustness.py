@@ -0,0 +1,118 @@
+# backtest/robustness.py
+"""Монте-Карло устойчивость результатов бэктеста по сохранённым сделкам (.npz симулятора).
+
+    python -m DEEPCKAITRADE.backtest.robustness data/accuracy_results/accuracy_test_X.npz --resamples 10000
+
+Методы: bootstrap (сделки с возвращением), block (блочный bootstrap — сохраняет серии),
+shuffle (перестановка порядка сделок — доходность та же, меняется просадка).
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from DEEPCKAITRADE.config import Config
+from DEEPCKAITRADE.backtest.analytics import load_columnar
+
+METHODS = ("bootstrap", "block", "shuffle")
+PERCENTILES = (5, 25, 50, 75, 95)
+CHUNK_SIZE = 1000  # ресемплов на задачу: матрица chunk × n_trades float64 помещается в кэш/память
+
+
+def resample_indices(rng, n_trades, n_resamples, method, block_size):
+    """Матрица индексов сделок n_resamples × n_trades"""
+    if method == "bootstrap":
+        return rng.integers(0, n_trades, size=(n_resamples, n_trades))
+    if method == "shuffle":
+        return rng.permuted(np.tile(np.arange(n_trades), (n_resamples, 1)), axis=1)
+    if method == "block":
+        block_size = max(1, min(block_size, n_trades))
+        n_blocks = -(-n_trades // block_size)
+        starts = rng.integers(0, n_trades, size=(n_resamples, n_blocks, 1))
+        idx = (starts + np.arange(block_size)) % n_trades  # циклические блоки
+        return idx.reshape(n_resamples, -1)[:, :n_trades]
+    raise ValueError(f"Неизвестный метод: {method}")
+
+
+def simulate_chunk(pnl, initial_balance, method, n_resamples, block_size, seed):
+    """Все ресемплы чанка сразу: (return_pct, max_drawdown_pct, win_rate_pct)"""
+    rng = np.random.default_rng(seed)
+    paths = pnl[resample_indices(rng, len(pnl), n_resamples, method, block_size)]
+    equity = initial_balance + np.cumsum(paths, axis=1)
+    peak = np.maximum(np.maximum.accumulate(equity, axis=1), initial_balance)
+    max_dd = ((equity - peak) / peak).min(axis=1)
+    total_return = equity[:, -1] / initial_balance - 1
+    win_rate = (paths > 0).mean(axis=1)
+    return total_return * 100, max_dd * 100, win_rate * 100
+
+
+def _distribution(values):
+    return {
+        "mean": round(float(values.mean()), 4),
+        "std": round(float(values.std()), 4),
+        **{f"p{p}": round(float(v), 4) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+    }
+
+
+def run_robustness(pnl, initial_balance, method="bootstrap", n_resamples=10000, block_size=10, workers=None,
+                   seed=42):
+    pnl = np.asarray(pnl, dtype=np.float64)
+    if not len(pnl):
+        raise ValueError("Нет сделок для ресемплинга")
+    chunks = [min(CHUNK_SIZE, n_resamples - start) for start in range(0, n_resamples, CHUNK_SIZE)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    args = [(pnl, initial_balance, method, size, block_size, s) for size, s in zip(chunks, seeds)]
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(chunks) == 1:
+        parts = [simulate_chunk(*a) for a in args]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+            parts = list(pool.map(simulate_chunk, *zip(*args)))
+
+    returns, drawdowns, win_rates = (np.concatenate(col) for col in zip(*parts))
+    return {
+        "method": method,
+        "resamples": int(n_resamples),
+        "trades": int(len(pnl)),
+        "block_size": block_size if method == "block" else None,
+        "observed_return_pct": round(float(pnl.sum() / initial_balance * 100), 4),
+        "prob_loss_pct": round(float((returns < 0).mean() * 100), 2),
+        "return_pct": _distribution(returns),
+        "max_drawdown_pct": _distribution(drawdowns),
+        "win_rate_pct": _distribution(win_rates)
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bootstrap/shuffle устойчивость результатов бэктеста")
+    parser.add_argument("path", help=".npz со сделками (PortfolioSimulator / run_accuracy_test)")
+    parser.add_argument("--method", choices=METHODS + ("all",), default="all")
+    parser.add_argument("--resamples", type=int, default=10000)
+    parser.add_argument("--block-size", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--initial-balance", type=float, default=Config.INITIAL_BALANCE)
+    parser.add_argument("--output", help="Куда сохранить JSON-отчёт")
+    args = parser.parse_args(argv)
+
+    trades, _, _ = load_columnar(args.path)
+    methods = METHODS if args.method == "all" else (args.method,)
+    report = {m: run_robustness(trades["pnl"], args.initial_balance, m, args.resamples, args.block_size,
+                                args.workers, args.seed) for m in methods}
+
+    for m, r in report.items():
+        print(f"[{m}] сделок={r['trades']} ресемплов={r['resamples']} P(убыток)={r['prob_loss_pct']}%")
+        for key in ("return_pct", "max_drawdown_pct", "win_rate_pct"):
+            d = r[key]
+            print(f"    {key:18s} p5={d['p5']:>9.3f}  p50={d['p50']:>9.3f}  p95={d['p95']:>9.3f}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
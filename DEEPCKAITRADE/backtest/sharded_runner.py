@@ -0,0 +1,222 @@
+# backtest/sharded_runner.py
+"""Бэктест точности, разбитый на шарды (инструмент × окно дат) и запущенный в пуле процессов.
+
+    python -m DEEPCKAITRADE.backtest.sharded_runner --figis BBG000B9XRY4 BBG004730N88 \\
+        --start 2025-01-01 --end 2025-04-01 --window-days 7 --workers 4 --llm-rps 2
+
+Все процессы делят один лимит запросов к LLM. Метрики шардов сливаются через сырые счётчики,
+поэтому итог совпадает с расчётом по объединённому списку результатов.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta
+from multiprocessing import Manager
+
+import pandas as pd
+import pytz
+
+from DEEPCKAITRADE.config import Config
+from DEEPCKAITRADE.backtest.accuracy_test import load_history_with_features, evaluate_history
+from DEEPCKAITRADE.backtest.analytics import compute_analytics, save_columnar
+from DEEPCKAITRADE.backtest.portfolio_simulator import PortfolioSimulator, build_signals
+from DEEPCKAITRADE.backtest.prediction_validator import PredictionValidator
+from DEEPCKAITRADE.modules.api_client import DeepSeekClient
+from DEEPCKAITRADE.utils.logger import logger
+
+WARMUP_DAYS = 5            # запас истории до начала окна (≥ 50 свечей с учётом выходных)
+LOOKAHEAD_MARGIN_DAYS = 4  # запас после конца окна для валидации последних прогнозов
+
+
+class SharedRateLimiter:
+    """Глобальный интервал между запросами к LLM для всех процессов (через Manager)"""
+
+    def __init__(self, manager, requests_per_sec):
+        self.interval = 1.0 / requests_per_sec if requests_per_sec > 0 else 0.0
+        self._lock = manager.Lock()
+        self._next_slot = manager.Value("d", 0.0)
+        self._issued = manager.Value("i", 0)
+
+    def acquire(self):
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next_slot.value)
+            self._next_slot.value = slot + self.interval
+            self._issued.value += 1
+        if slot > now:
+            time.sleep(slot - now)
+
+    @property
+    def issued(self):
+        return self._issued.value
+
+
+def build_shards(figis, start, end, window_days):
+    """[{"id", "figi", "start", "end"}] — окна [start, end) по window_days"""
+    shards = []
+    for figi in figis:
+        window_start = start
+        while window_start < end:
+            window_end = min(window_start + timedelta(days=window_days), end)
+            shards.append({
+                "id": f"{figi}_{window_start:%Y%m%d}_{window_end:%Y%m%d}",
+                "figi": figi,
+                "start": window_start.isoformat(),
+                "end": window_end.isoformat()
+            })
+            window_start = window_end
+    return shards
+
+
+def _init_worker():
+    # В воркерах общий app.log и консоль не нужны: у каждого шарда свой файл
+    logging.getLogger("deepckaitrade").handlers.clear()
+
+
+def run_shard(shard, rate_limiter, output_dir, config=Config):
+    """Выполняется в воркере: загрузка, прогноз по окну, валидация, симуляция"""
+    shard_log = logging.FileHandler(os.path.join(output_dir, "shards", f"{shard['id']}.log"), encoding="utf-8")
+    shard_log.setFormatter(logging.Formatter('%(asctime)s | %(levelname)s | %(message)s'))
+    logger.addHandler(shard_log)
+    started = time.time()
+    try:
+        start = datetime.fromisoformat(shard["start"])
+        end = datetime.fromisoformat(shard["end"])
+        load_end = min(end + timedelta(days=LOOKAHEAD_MARGIN_DAYS), datetime.utcnow().replace(tzinfo=pytz.utc))
+        df, features = load_history_with_features(config, shard["figi"], start - timedelta(days=WARMUP_DAYS),
+                                                  load_end)
+
+        times = pd.DatetimeIndex(df["time"])
+        start_idx = max(50, int(times.searchsorted(pd.Timestamp(start))))
+        end_idx = int(times.searchsorted(pd.Timestamp(end)))
+
+        validator = PredictionValidator(lookahead_candles=6)
+        results, successful = evaluate_history(df, DeepSeekClient(config), validator, config, start_idx=start_idx,
+                                               end_idx=end_idx, rate_limiter=rate_limiter, features=features)
+        counts = validator.accuracy_counts(results)
+
+        simulator = PortfolioSimulator(config.INITIAL_BALANCE)
+        simulation = simulator.run(df.iloc[:end_idx + validator.lookahead_candles],
+                                   build_signals([(r["index"], r["prediction"]) for r in results]))
+        simulation["analytics"] = compute_analytics(simulator.trades, simulator.equity_history,
+                                                    simulator.initial_balance)
+        save_columnar(os.path.join(output_dir, "shards", f"{shard['id']}.npz"), simulator.trades,
+                      simulator.equity_history, simulator.equity_times)
+
+        report = {
+            "shard": shard,
+            "candles": int(max(0, end_idx - start_idx)),
+            "successful_predictions": successful,
+            "counts": counts,
+            "metrics": validator.metrics_from_counts(counts),
+            "simulation": simulation,
+            "elapsed_sec": round(time.time() - started, 1)
+        }
+        with open(os.path.join(output_dir, "shards", f"{shard['id']}.json"), "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        return report
+    finally:
+        logger.removeHandler(shard_log)
+        shard_log.close()
+
+
+def merge_reports(reports):
+    """Точное слияние: суммируем счётчики и PnL, проценты считаем заново"""
+    merged_counts = PredictionValidator.merge_counts(r["counts"] for r in reports)
+    by_figi = {}
+    for r in reports:
+        by_figi.setdefault(r["shard"]["figi"], []).append(r)
+    return {
+        "shards": len(reports),
+        "candles": sum(r["candles"] for r in reports),
+        "successful_predictions": sum(r["successful_predictions"] for r in reports),
+        "counts": merged_counts,
+        "metrics": PredictionValidator.metrics_from_counts(merged_counts),
+        "simulation": {
+            "total_trades": sum(r["simulation"]["total_trades"] for r in reports),
+            "total_pnl": round(sum(r["simulation"]["final_equity"] - r["simulation"]["initial_balance"]
+                                   for r in reports), 2),
+            "total_commission": round(sum(r["simulation"]["total_commission"] for r in reports), 2)
+        },
+        "by_instrument": {
+            figi: PredictionValidator.metrics_from_counts(PredictionValidator.merge_counts(r["counts"] for r in rs))
+            for figi, rs in by_figi.items()
+        }
+    }
+
+
+def run_sharded(figis, start, end, window_days=7, workers=None, llm_rps=2.0, output_dir=None, config=None):
+    config = config or Config.freeze()  # снимок уходит в воркеры вместе с шардом, .env там не перечитывается
+    output_dir = output_dir or os.path.join(config.ACCURACY_RESULTS_DIR,
+                                            f"sharded_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    os.makedirs(os.path.join(output_dir, "shards"), exist_ok=True)
+    shards = build_shards(figis, start, end, window_days)
+    workers = workers or min(len(shards), os.cpu_count() or 1)
+    logger.info(f"[Shards] {len(shards)} шардов | воркеров: {workers} | LLM: {llm_rps} запр/с | {output_dir}")
+
+    reports, failed = [], []
+    started = time.time()
+    with Manager() as manager:
+        limiter = SharedRateLimiter(manager, llm_rps)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            pending = {pool.submit(run_shard, shard, limiter, output_dir, config): shard for shard in shards}
+            while pending:
+                done, _ = wait(pending, timeout=30, return_when=FIRST_COMPLETED)
+                for future in done:
+                    shard = pending.pop(future)
+                    try:
+                        report = future.result()
+                        reports.append(report)
+                        logger.info(f"[Shards] {len(reports) + len(failed)}/{len(shards)} {shard['id']}: "
+                                    f"{report['metrics']['total_predictions']} прогнозов, "
+                                    f"точность {report['metrics']['accuracy_rate']:.1f}% ({report['elapsed_sec']}s)")
+                    except Exception as e:
+                        failed.append({"shard": shard, "error": str(e)})
+                        logger.error(f"[Shards] {shard['id']} упал: {e}")
+                if not done:
+                    logger.info(f"[Shards] прогресс: {len(reports)}/{len(shards)} шардов, "
+                                f"{limiter.issued} запросов к LLM, {time.time() - started:.0f}s")
+
+    final_report = {
+        "metadata": {
+            "instruments": list(figis),
+            "start_date": start.isoformat(),
+            "end_date": end.isoformat(),
+            "window_days": window_days,
+            "workers": workers,
+            "llm_rps": llm_rps,
+            "elapsed_sec": round(time.time() - started, 1),
+            "failed_shards": failed
+        },
+        **merge_reports(reports)
+    }
+    filename = os.path.join(output_dir, "report.json")
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(final_report, f, indent=2, ensure_ascii=False)
+    logger.info(f"[Shards] Итог: {final_report['metrics']['total_predictions']} прогнозов | "
+                f"точность {final_report['metrics']['accuracy_rate']:.1f}% | {filename}")
+    return final_report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Шардированный бэктест точности")
+    parser.add_argument("--figis", nargs="+", default=[Config.INSTRUMENT_FIGI])
+    parser.add_argument("--start", default=Config.BACKTEST_START)
+    parser.add_argument("--end", default=Config.BACKTEST_END)
+    parser.add_argument("--window-days", type=int, default=7)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--llm-rps", type=float, default=2.0, help="Общий лимит запросов к LLM в секунду")
+    parser.add_argument("--output-dir", default=None)
+    args = parser.parse_args(argv)
+
+    start = datetime.strptime(args.start, "%Y-%m-%d").replace(tzinfo=pytz.utc)
+    end = datetime.strptime(args.end, "%Y-%m-%d").replace(tzinfo=pytz.utc)
+    run_sharded(args.figis, start, end, args.window_days, args.workers, args.llm_rps, args.output_dir,
+                Config.freeze())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# benchmarks/import_budget.py
+"""Бюджет времени импорта точек входа (python -X importtime в чистом процессе).
+
+    python -m DEEPCKAITRADE.benchmarks.import_budget                        # все точки входа
+    python -m DEEPCKAITRADE.benchmarks.import_budget --entries live --top 15
+    python -m DEEPCKAITRADE.benchmarks.import_budget --budget live=900 --repeat 7
+
+Для каждой точки входа — медиана cumulative-времени импорта, самые дорогие пакеты (self-время)
+и запрещённые импорты: тяжёлые зависимости, которые этому режиму не нужны.
+Код выхода 1 при превышении бюджета или запрещённом импорте.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PACKAGE_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Точка входа -> (модуль, бюджет мс, запрещённые пакеты верхнего уровня)
+ENTRY_POINTS = {
+    "startup": ("DEEPCKAITRADE.main", 150, ("pandas", "numpy", "requests", "tinkoff", "grpc", "ta", "tenacity")),
+    "live": ("DEEPCKAITRADE.modules.data_loader", 1200, ("matplotlib", "cProfile")),
+    "backtest": ("DEEPCKAITRADE.backtest.accuracy_test", 1200, ("tinkoff", "grpc", "schedule")),
+    "ledger": ("DEEPCKAITRADE.modules.llm_ledger", 150, ("pandas", "numpy", "requests", "tinkoff", "ta")),
+    "results": ("DEEPCKAITRADE.backtest.results_index", 150, ("pandas", "numpy", "requests", "tinkoff", "ta")),
+}
+
+
+def parse_importtime(stderr):
+    """Строки 'import time: self | cumulative | name' -> [(self_us, cumulative_us, depth, name)]"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        rows.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return rows
+
+
+def measure(module, repeat):
+    """Медиана cumulative импорта модуля, стоимость пакетов по self-времени, список загруженных пакетов"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [PACKAGE_ROOT, env.get("PYTHONPATH")]))
+    totals, packages, loaded = [], {}, set()
+    with tempfile.TemporaryDirectory() as cwd:  # logs/ и data/ от импорта — не в рабочий каталог
+        for _ in range(repeat):
+            result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                    cwd=cwd, env=env, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"import {module} упал:\n{result.stderr[-2000:]}")
+            rows = parse_importtime(result.stderr)
+            target = [cumulative for _, cumulative, depth, name in rows if depth == 0 and name == module]
+            totals.append(target[-1] / 1000)
+            start = next(i for i, (_, _, depth, name) in enumerate(rows) if depth == 0 and name == "site") + 1
+            run_packages = {}
+            for self_us, _, _, name in rows[start:]:
+                top = name.split(".")[0]
+                run_packages[top] = run_packages.get(top, 0) + self_us / 1000
+                loaded.add(top)
+            for top, ms in run_packages.items():
+                packages.setdefault(top, []).append(ms)
+    return {
+        "median_ms": statistics.median(totals),
+        "min_ms": min(totals),
+        "packages": {top: statistics.median(values) for top, values in packages.items()},
+        "loaded": loaded,
+    }
+
+
+def check(entries, budgets, repeat, top):
+    report, failures = {}, []
+    for entry in entries:
+        module, default_budget, forbidden = ENTRY_POINTS[entry]
+        budget = budgets.get(entry, default_budget)
+        result = measure(module, repeat)
+        bad_imports = sorted(set(forbidden) & result["loaded"])
+        over = result["median_ms"] > budget
+        status = "OVER" if over else "ok"
+        print(f"\n{entry:9s} {module:42s} {result['median_ms']:8.1f} ms (min {result['min_ms']:.1f}) "
+              f"/ бюджет {budget} ms  {status}")
+        for name, ms in sorted(result["packages"].items(), key=lambda kv: -kv[1])[:top]:
+            print(f"    {name:28s} {ms:8.1f} ms")
+        if bad_imports:
+            print(f"    запрещённые импорты: {', '.join(bad_imports)}")
+        if over or bad_imports:
+            failures.append(entry)
+        report[entry] = {"module": module, "median_ms": round(result["median_ms"], 1), "budget_ms": budget,
+                         "forbidden_loaded": bad_imports,
+                         "top_packages": {k: round(v, 1) for k, v in
+                                          sorted(result["packages"].items(), key=lambda kv: -kv[1])[:top]}}
+    return report, failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бюджет времени импорта точек входа")
+    parser.add_argument("--entries", nargs="+", choices=sorted(ENTRY_POINTS), default=list(ENTRY_POINTS))
+    parser.add_argument("--budget", action="append", default=[], metavar="ENTRY=MS",
+                        help="Переопределить бюджет, можно несколько раз")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="Сколько самых дорогих пакетов показать")
+    parser.add_argument("--output", help="Путь для JSON с результатами")
+    args = parser.parse_args(argv)
+
+    budgets = {}
+    for item in args.budget:
+        entry, _, ms = item.partition("=")
+        budgets[entry] = float(ms)
+    report, failures = check(args.entries, budgets, args.repeat, args.top)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if failures:
+        print(f"\nБюджет нарушен: {', '.join(failures)}")
+        return 1
+    print("\nВсе точки входа в бюджете")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
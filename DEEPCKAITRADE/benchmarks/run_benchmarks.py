@@ -0,0 +1,377 @@
+# benchmarks/run_benchmarks.py
+"""Бенчмарки горячих путей на синтетических свечах.
+
+    python -m DEEPCKAITRADE.benchmarks.run_benchmarks                      # все кейсы, все размеры
+    python -m DEEPCKAITRADE.benchmarks.run_benchmarks --sizes 500 5000 --cases calculate_indicators
+    python -m DEEPCKAITRADE.benchmarks.run_benchmarks --save-baseline      # зафиксировать baseline
+    python -m DEEPCKAITRADE.benchmarks.run_benchmarks --tolerance 0.15     # сравнить с baseline
+
+Код выхода 1, если медиана хотя бы одного кейса хуже baseline больше чем на tolerance.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from ta.momentum import RSIIndicator
+from ta.volatility import AverageTrueRange
+
+from DEEPCKAITRADE.benchmarks.synthetic import generate_candles
+from DEEPCKAITRADE.config import Config
+
+DEFAULT_SIZES = [500, 5_000, 50_000, 500_000]
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+RESULTS_DIR = os.path.join(Config.DATA_DIR, "benchmarks")
+
+
+class StubLLM:
+    """Детерминированная замена DeepSeekClient: решение по тренду EMA, без сети"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_prediction(self, market_data):
+        self.calls += 1
+        md = market_data["market_data"]
+        price = md["price_current"]
+        indicators = md["indicators"]
+        atr = indicators.get("atr", {}).get("current", 0.0) or price * 0.002
+        trend = indicators.get("ema", {}).get("trend_direction")
+        action = {"bullish": "BUY", "bearish": "SELL"}.get(trend, "HOLD") if self.calls % 3 else "HOLD"
+        sign = 1 if action == "BUY" else -1
+        return {
+            "action": action,
+            "confidence": 60 + self.calls % 30,
+            "size": 1,
+            "entry_price": price,
+            "stop_loss": round(price - sign * 1.5 * atr, 2),
+            "take_profit": round(price + sign * 2.5 * atr, 2),
+            "risk_percent": 0.5,
+            "message": "stub"
+        }
+
+
+# === Кейсы: setup(df) -> (fn, ops) — fn вызывается repeat раз, ops — число операций внутри fn ===
+def case_calculate_indicators(df):
+    from DEEPCKAITRADE.modules.indicators import calculate_indicators
+    return (lambda: calculate_indicators(df)), 1
+
+
+def case_detect_divergence(df):
+    from DEEPCKAITRADE.modules.indicators import detect_divergence
+    rsi = RSIIndicator(close=df['close'], window=14).rsi()
+    return (lambda: detect_divergence(df, rsi)), 1
+
+
+def case_detect_patterns(df):
+    from DEEPCKAITRADE.modules.data_loader import detect_patterns
+    from DEEPCKAITRADE.modules.indicators import calculate_indicators
+    indicators = calculate_indicators(df)
+    return (lambda: detect_patterns(df, indicators)), 1
+
+
+def case_prediction_validator(df, n_predictions=1000):
+    from DEEPCKAITRADE.backtest.prediction_validator import PredictionValidator
+    df = df.copy()
+    df['atr'] = AverageTrueRange(high=df['high'], low=df['low'], close=df['close'], window=14).average_true_range()
+    validator = PredictionValidator(lookahead_candles=6)
+    llm = StubLLM()
+    idx = np.linspace(50, len(df) - 7, num=min(n_predictions, len(df) - 57), dtype=int)
+    preds = [llm.get_prediction(_stub_market_data(df, i)) for i in idx]
+
+    def run():
+        for i, p in zip(idx, preds):
+            validator.validate_prediction(p, int(i), df)
+
+    return run, len(idx)
+
+
+def case_simulator_execute_trade(df, n_trades=2000):
+    from DEEPCKAITRADE.backtest.portfolio_simulator import PortfolioSimulator
+    idx = np.linspace(0, len(df) - 1, num=min(n_trades, len(df)), dtype=int)
+    prices = df['close'].to_numpy()[idx]
+    times = df['time'].iloc[idx].tolist()
+
+    def run():
+        sim = PortfolioSimulator(Config.INITIAL_BALANCE)
+        for k, (price, ts) in enumerate(zip(prices, times)):
+            action = "BUY" if k % 2 == 0 else "SELL"
+            sim.execute_trade({"action": action, "size": 10, "stop_loss": price * 0.99,
+                               "take_profit": price * 1.02}, float(price), ts)
+
+    return run, len(idx)
+
+
+def case_simulator_run(df, n_signals=2000):
+    from DEEPCKAITRADE.backtest.portfolio_simulator import PortfolioSimulator, build_signals
+    rng = np.random.default_rng(0)
+    idx = np.sort(rng.choice(len(df) - 1, size=min(n_signals, len(df) - 1), replace=False))
+    close = df['close'].to_numpy()
+    entries = []
+    for i, action in zip(idx, rng.choice(["BUY", "SELL", "HOLD"], size=len(idx))):
+        sign = 1 if action == "BUY" else -1
+        entries.append((int(i), {"action": action, "size": 10, "confidence": 80,
+                                 "stop_loss": close[i] * (1 - sign * 0.004),
+                                 "take_profit": close[i] * (1 + sign * 0.006)}))
+    signals = build_signals(entries)
+
+    def run():
+        PortfolioSimulator(Config.INITIAL_BALANCE).run(df, signals)
+
+    return run, len(idx)
+
+
+def case_accuracy_loop(df, steps=100):
+    from DEEPCKAITRADE.backtest.accuracy_test import evaluate_history
+    from DEEPCKAITRADE.backtest.prediction_validator import PredictionValidator
+    df = df.copy()
+    df['atr'] = AverageTrueRange(high=df['high'], low=df['low'], close=df['close'], window=14).average_true_range()
+    validator = PredictionValidator(lookahead_candles=6)
+    start_idx = max(50, len(df) - validator.lookahead_candles - steps)
+    config = Config()
+
+    def run():
+        evaluate_history(df, StubLLM(), validator, config, start_idx=start_idx, rate_limit_sec=0)
+
+    return run, len(df) - validator.lookahead_candles - start_idx
+
+
+def case_accuracy_loop_features(df, steps=100):
+    from DEEPCKAITRADE.backtest.accuracy_test import evaluate_history
+    from DEEPCKAITRADE.backtest.prediction_validator import PredictionValidator
+    from DEEPCKAITRADE.modules.feature_store import compute_features, features_to_frame
+    features = compute_features(df)
+    frame = features_to_frame(features)
+    validator = PredictionValidator(lookahead_candles=6)
+    start_idx = max(50, len(df) - validator.lookahead_candles - steps)
+    config = Config()
+
+    def run():
+        evaluate_history(frame, StubLLM(), validator, config, start_idx=start_idx, rate_limit_sec=0,
+                         features=features)
+
+    return run, len(df) - validator.lookahead_candles - start_idx
+
+
+PAYLOAD_SPECS = {"symbol": "TEST", "asset_class": "equity", "tick_value": 0.01, "min_order_size": 1}
+PAYLOAD_PREDICTION = {"action": "BUY", "confidence": 82, "size": 10, "entry_price": 250.0, "stop_loss": 248.5,
+                      "take_profit": 253.0, "risk_percent": 0.6, "message": "bench"}
+
+
+def _payload_inputs(df):
+    from DEEPCKAITRADE.modules.indicators import calculate_indicators
+    from DEEPCKAITRADE.modules.patterns import scan_last
+    from DEEPCKAITRADE.modules.timeframes import MultiTimeframe
+    window = df.iloc[-600:]  # буфер live за HISTORY_DAYS
+    indicators = calculate_indicators(window)
+    return window, indicators, scan_last(window, indicators), MultiTimeframe(["15min", "1h"], 500).snapshot(window)
+
+
+def _request_body(user_content):
+    return json.dumps({"model": "deepseek-chat", "messages": [{"role": "user", "content": user_content}],
+                       "response_format": {"type": "json_object"}, "temperature": 0.1, "max_tokens": 600},
+                      ensure_ascii=False, separators=(',', ':')).encode("utf-8")
+
+
+def case_payload_legacy(df):
+    """Цикл до PayloadBuilder: скаляры через iloc, dict дампится для файла, промпта и записи прогноза"""
+    window, indicators, patterns, mtf = _payload_inputs(df)
+    config = Config
+
+    def run():
+        data = {
+            "timestamp": "2024-01-08T10:00:00+00:00Z",
+            "market_data": {
+                "price_current": float(window['close'].iloc[-1]),
+                "candle_current": {"open": float(window['open'].iloc[-1]), "high": float(window['high'].iloc[-1]),
+                                   "low": float(window['low'].iloc[-1]), "close": float(window['close'].iloc[-1])},
+                "volume_current": int(window['volume'].iloc[-1]),
+                "indicators": indicators,
+                "patterns": patterns
+            },
+            "risk_params": {"account_equity": 100000.0, "max_risk_per_trade_pct": config.RISK_PER_TRADE_PCT,
+                            "max_exposure_per_asset_pct": config.MAX_EXPOSURE_PCT,
+                            "min_risk_reward": config.MIN_RISK_REWARD,
+                            "volatility_threshold": config.VOLATILITY_THRESHOLD},
+            "instrument_specs": {**PAYLOAD_SPECS, "avg_daily_volume": int(window['volume'].rolling(100).mean().iloc[-1]),
+                                 "margin_requirement": 0},
+            "current_positions": {},
+            "cost_structure": {"commission_per_share": config.COMMISSION_PER_SHARE,
+                               "fixed_commission": config.FIXED_COMMISSION, "max_slippage": config.MAX_SLIPPAGE}
+        }
+        data["market_data"]["multi_timeframe"] = mtf
+        json.dump(data, io.StringIO(), indent=2, ensure_ascii=False)                     # market_data_*.json
+        _request_body(json.dumps(data, ensure_ascii=False, separators=(',', ':')))      # промпт
+        record = {"metadata": {"latency_sec": 1.0, "instrument": "TEST"}, "input_data": data,
+                  "prediction": PAYLOAD_PREDICTION}
+        json.dump(record, io.StringIO(), indent=2, ensure_ascii=False)                   # pred_*.json
+
+    return run, 1
+
+
+def case_payload_builder(df):
+    """Тот же цикл через PayloadBuilder: одна сериализация, байты общие для файла, промпта и записи"""
+    from DEEPCKAITRADE.backtest.prediction_handler import PredictionHandler
+    from DEEPCKAITRADE.modules.data_loader import estimate_avg_volume
+    from DEEPCKAITRADE.modules.payload import PayloadBuilder, payload_text
+    window, indicators, patterns, mtf = _payload_inputs(df)
+    builder = PayloadBuilder(Config)
+    handler = PredictionHandler()
+
+    def run():
+        payload = builder.build(window, "2024-01-08T10:00:00+00:00Z", indicators, patterns, 100000.0,
+                                PAYLOAD_SPECS, estimate_avg_volume(window), {}, mtf)
+        io.BytesIO().write(payload.encoded)                                              # market_data_*.json
+        _request_body(payload_text(payload))                                             # промпт
+        io.BytesIO().write(handler.encode_record(payload, PAYLOAD_PREDICTION, 1.0))     # pred_*.json
+
+    return run, 1
+
+
+def _stub_market_data(df, idx):
+    price = float(df['close'].iloc[idx])
+    atr = df['atr'].iloc[idx]
+    return {"market_data": {"price_current": price, "indicators": {
+        "atr": {"current": 0.0 if pd.isna(atr) else float(atr)},
+        "ema": {"trend_direction": "bullish" if idx % 2 else "bearish"}
+    }}}
+
+
+CASES = {
+    "calculate_indicators": case_calculate_indicators,
+    "detect_divergence": case_detect_divergence,
+    "detect_patterns": case_detect_patterns,
+    "prediction_validator": case_prediction_validator,
+    "simulator_execute_trade": case_simulator_execute_trade,
+    "simulator_run": case_simulator_run,
+    "accuracy_loop": case_accuracy_loop,
+    "accuracy_loop_features": case_accuracy_loop_features,
+    "payload_legacy": case_payload_legacy,
+    "payload_builder": case_payload_builder,
+}
+
+
+def run_case(name, df, repeat):
+    fn, ops = CASES[name](df)
+    fn()  # прогрев (импорты, кэши pandas)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    median = statistics.median(timings)
+    return {
+        "case": name,
+        "size": len(df),
+        "ops": ops,
+        "repeat": repeat,
+        "min_s": min(timings),
+        "median_s": median,
+        "per_op_us": median / max(ops, 1) * 1e6
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_suite(sizes, cases, repeat, seed):
+    results = []
+    for size in sizes:
+        df = generate_candles(size, seed=seed)
+        for name in cases:
+            # Полный цикл бэктеста копирует префикс на каждом шаге — на больших размерах меньше повторов
+            case_repeat = 1 if name == "accuracy_loop" and size > 50_000 else repeat
+            result = run_case(name, df, case_repeat)
+            results.append(result)
+            print(f"{name:26s} n={size:>7d}  median={result['median_s'] * 1e3:10.3f} ms  "
+                  f"per_op={result['per_op_us']:12.1f} us")
+    return {
+        "metadata": {
+            "created_at": datetime.utcnow().isoformat() + "Z",
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+            "seed": seed,
+        },
+        "results": results
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Возвращает список регрессий: медиана выросла больше чем в (1 + tolerance) раз"""
+    base = {(r["case"], r["size"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"\n{'case':26s} {'size':>7s} {'baseline ms':>12s} {'current ms':>12s} {'ratio':>7s}")
+    for r in report["results"]:
+        b = base.get((r["case"], r["size"]))
+        if b is None:
+            continue
+        ratio = r["median_s"] / b["median_s"] if b["median_s"] else float("inf")
+        flag = "  REGRESSION" if ratio > 1 + tolerance else ""
+        print(f"{r['case']:26s} {r['size']:>7d} {b['median_s'] * 1e3:12.3f} {r['median_s'] * 1e3:12.3f} "
+              f"{ratio:7.2f}{flag}")
+        if flag:
+            regressions.append({"case": r["case"], "size": r["size"], "ratio": round(ratio, 3)})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки горячих путей")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--cases", nargs="+", choices=sorted(CASES), default=list(CASES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Записать результат как baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--output", help="Путь для JSON с результатами")
+    args = parser.parse_args(argv)
+
+    report = run_suite(args.sizes, args.cases, args.repeat, args.seed)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = args.output or os.path.join(RESULTS_DIR, f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nРезультаты: {output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline сохранён: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("Baseline не найден — сравнение пропущено (запустите с --save-baseline)")
+        return 0
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(report, baseline, args.tolerance)
+    report["regressions"] = regressions
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    if regressions:
+        print(f"\nРегрессии: {len(regressions)}")
+        return 1
+    print("\nРегрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,77 @@
+# benchmarks/synthetic.py
+from bisect import bisect_left
+
+import numpy as np
+import pandas as pd
+
+# Режимы волатильности (σ доходности за 5 минут) и матрица переходов между ними
+REGIME_SIGMA = np.array([0.0006, 0.0015, 0.0040])
+REGIME_TRANSITIONS = np.array([
+    [0.995, 0.004, 0.001],
+    [0.006, 0.990, 0.004],
+    [0.004, 0.016, 0.980],
+])
+
+# Основная сессия MOEX в UTC: 07:00–15:50 → 106 свечей M5
+SESSION_START_MINUTE = 7 * 60
+SESSION_BARS = 106
+
+
+def session_times(n_candles, start="2024-01-08", missing_prob=0.0, rng=None):
+    """Времена свечей M5 только в торговые часы будних дней (+ случайные пропуски)"""
+    rng = rng or np.random.default_rng(0)
+    n_days = int(np.ceil(n_candles / SESSION_BARS * (1 + missing_prob) * 1.02)) + 1
+    days = pd.bdate_range(start=start, periods=n_days, tz="UTC")
+    offsets = pd.to_timedelta(SESSION_START_MINUTE + 5 * np.arange(SESSION_BARS), unit="min")
+    times = (days.values[:, None] + offsets.values[None, :]).ravel()
+    if missing_prob > 0:
+        times = times[rng.random(len(times)) >= missing_prob]
+    return pd.DatetimeIndex(times[:n_candles]).tz_localize("UTC")
+
+
+def generate_candles(n_candles, seed=42, start_price=250.0, missing_prob=0.002, gap_sigma=0.01):
+    """Детерминированный OHLCV с режимами волатильности, ночными гэпами и пропусками свечей.
+
+    Формат совпадает с DataFrame из get_all_candles: time (UTC), open, high, low, close, volume.
+    """
+    rng = np.random.default_rng(seed)
+    times = session_times(n_candles, missing_prob=missing_prob, rng=rng)
+    n = len(times)
+
+    # Марковская цепь режимов
+    cum = REGIME_TRANSITIONS.cumsum(axis=1).tolist()
+    last_regime = len(REGIME_SIGMA) - 1
+    regimes = [1] * n
+    state = 1
+    for i, x in enumerate(rng.random(n).tolist()):
+        if i:
+            state = min(bisect_left(cum[state], x), last_regime)
+            regimes[i] = state
+    sigma = REGIME_SIGMA[regimes]
+
+    # Доходности с тяжёлыми хвостами (Стьюдент, df=4) + гэп на открытии сессии
+    returns = sigma * rng.standard_t(4, size=n) / np.sqrt(2.0)
+    day = times.normalize()
+    new_day = np.r_[False, day[1:] != day[:-1]]
+    gaps = np.where(new_day, rng.normal(0.0, gap_sigma, size=n), 0.0)
+
+    close = start_price * np.exp(np.cumsum(returns + gaps))
+    open_ = np.empty(n)
+    open_[0] = start_price
+    open_[1:] = close[:-1] * np.exp(gaps[1:] + rng.normal(0.0, sigma[1:] * 0.2))
+
+    wick = np.abs(rng.normal(0.0, sigma, size=(2, n))) * close
+    high = np.maximum(open_, close) + wick[0]
+    low = np.minimum(open_, close) - wick[1]
+
+    base_volume = rng.lognormal(mean=9.0, sigma=0.5, size=n)
+    volume = (base_volume * (1 + 200 * np.abs(returns))).astype(np.int64)
+
+    return pd.DataFrame({
+        "time": times,
+        "open": np.round(open_, 2),
+        "high": np.round(high, 2),
+        "low": np.round(low, 2),
+        "close": np.round(close, 2),
+        "volume": volume,
+    })
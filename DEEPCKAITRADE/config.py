@@ -19,6 +19,8 @@ class Config:
     RAW_DATA_DIR = os.path.join(DATA_DIR, "raw")
     PREDICTIONS_DIR = os.path.join(DATA_DIR, "predictions")
     ACCURACY_RESULTS_DIR = os.path.join(DATA_DIR, "accuracy_results")
+    FEATURE_STORE_DIR = os.path.join(DATA_DIR, "features")
+    USE_FEATURE_STORE = os.getenv("USE_FEATURE_STORE", "1") == "1"
 
     # Параметры бэктеста
     backtest_start_str = os.getenv("BACKTEST_START")
@@ -34,6 +36,7 @@ class Config:
         BACKTEST_END = datetime.utcnow().strftime("%Y-%m-%d")
     INITIAL_BALANCE = float(os.getenv("INITIAL_BALANCE", "100000.00"))
     SIMULATION_STEP = "5min"
+    BARS_PER_YEAR = 252 * 106  # M5-свечей основной сессии MOEX в году (для Sharpe/Sortino)
 
     # Риск-параметры
     RISK_PER_TRADE_PCT = float(os.getenv("RISK_PER_TRADE_PCT", "1.0"))
@@ -45,6 +48,15 @@ class Config:
     TIMEZONE = pytz.timezone("Europe/Moscow")
     CANDLE_INTERVAL = "5min"
     HISTORY_DAYS = 2
+    # Старшие таймфреймы из буфера M5, через запятую: "15min,1h,1d" (пусто — выключено).
+    # Для 1h/1d нужно больше истории: индикаторы считаются от 50 баров
+    MTF_TIMEFRAMES = [tf.strip() for tf in os.getenv("MTF_TIMEFRAMES", "").split(",") if tf.strip()]
+    MTF_MAX_BARS = int(os.getenv("MTF_MAX_BARS", "500"))
+    # Календарь сессий для проверки пропусков (UTC, будни): основная сессия MOEX 10:00–18:50 МСК
+    SESSION_HOURS_UTC = os.getenv("SESSION_HOURS_UTC", "07:00-15:50")
+    CANDLES_FULL_REFRESH_SEC = int(os.getenv("CANDLES_FULL_REFRESH_SEC", "0"))  # 0 — полная загрузка только при старте
+    GAP_REFETCH_MAX = int(os.getenv("GAP_REFETCH_MAX", "3"))                     # интервалов-дыр за цикл live
+    GAP_REFETCH_MAX_BACKTEST = int(os.getenv("GAP_REFETCH_MAX_BACKTEST", "50"))
 
     # Комиссии и издержки
     COMMISSION_PER_SHARE = 0.004
@@ -57,10 +69,54 @@ class Config:
     DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
     DEEPSEEK_TIMEOUT = int(os.getenv("DEEPSEEK_TIMEOUT", "30"))
 
-    # Резервные параметры
+    # Пакетный инференс в бэктесте: K снимков в одном запросе (0 — по одному, как раньше).
+    # K подстраивается под LLM_BATCH_MAX_TOKENS и LLM_BATCH_LATENCY_SEC; LLM_BATCH_GAP — минимум свечей
+    # между снимками одного пакета, чтобы модель не видела будущее соседнего снимка (1 — подряд)
+    LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "0"))
+    LLM_BATCH_MAX = int(os.getenv("LLM_BATCH_MAX", "16"))
+    LLM_BATCH_MAX_TOKENS = int(os.getenv("LLM_BATCH_MAX_TOKENS", "8000"))
+    LLM_BATCH_LATENCY_SEC = float(os.getenv("LLM_BATCH_LATENCY_SEC", "20"))
+    LLM_BATCH_RETRIES = int(os.getenv("LLM_BATCH_RETRIES", "1"))
+    LLM_BATCH_GAP = int(os.getenv("LLM_BATCH_GAP", "60"))
+
+    # Ансамбль: "model[@url[#ENV_КЛЮЧА]]" через запятую (пусто — одна модель DEEPSEEK_MODEL).
+    # Решение — когда ENSEMBLE_QUORUM моделей согласны по action; ждём не дольше ENSEMBLE_DEADLINE_SEC.
+    # Должен быть меньше LLM_DEADLINE_SEC: иначе при FALLBACK_ENABLED ансамбль без кворума занимает поток
+    # GuardedPredictor дольше цикла (EnsemblePredictor всё равно урезает его до 0.8 * LLM_DEADLINE_SEC)
+    ENSEMBLE_MODELS = [m.strip() for m in os.getenv("ENSEMBLE_MODELS", "").split(",") if m.strip()]
+    ENSEMBLE_QUORUM = int(os.getenv("ENSEMBLE_QUORUM", "2"))
+    ENSEMBLE_DEADLINE_SEC = float(os.getenv("ENSEMBLE_DEADLINE_SEC", "12"))
+
+    # Резервные параметры: локальный прогноз, если LLM не ответила за LLM_DEADLINE_SEC
+    # или circuit breaker открыт (CIRCUIT_FAILURE_THRESHOLD ошибок подряд → пауза COOLDOWN_AFTER_FAILURE сек)
+    FALLBACK_ENABLED = os.getenv("FALLBACK_ENABLED", "1") == "1"
     FALLBACK_CONFIDENCE = 50
     MAX_API_RETRIES = 3
     COOLDOWN_AFTER_FAILURE = 60
+    LLM_DEADLINE_SEC = float(os.getenv("LLM_DEADLINE_SEC", "15"))
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3"))
+
+    # Исполнение сигналов (live/trade_executor.py): по умолчанию выключено, только алерт.
+    # EXECUTOR_BROKER: fake — локальная заглушка, tinkoff — реальные заявки
+    TRADING_ENABLED = os.getenv("TRADING_ENABLED", "0") == "1"
+    EXECUTOR_BROKER = os.getenv("EXECUTOR_BROKER", "fake")
+    TRADE_MIN_CONFIDENCE = int(os.getenv("TRADE_MIN_CONFIDENCE", "80"))
+
+    # Снимок состояния live для тёплого старта (пишется раз в SNAPSHOT_INTERVAL_SEC и при остановке)
+    SNAPSHOT_ENABLED = os.getenv("SNAPSHOT_ENABLED", "1") == "1"
+    SNAPSHOT_DIR = os.path.join(DATA_DIR, "snapshot")
+    SNAPSHOT_INTERVAL_SEC = int(os.getenv("SNAPSHOT_INTERVAL_SEC", "300"))
+
+    # Метрики (порт 0 — эндпоинт выключен, интервал 0 — без дампа)
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+    METRICS_DUMP_PATH = os.path.join(DATA_DIR, "metrics.json")
+    METRICS_DUMP_INTERVAL = int(os.getenv("METRICS_DUMP_INTERVAL", "60"))
+
+    # Журнал вызовов LLM
+    LLM_LEDGER_PATH = os.path.join(DATA_DIR, "llm_ledger.csv")
+
+    # Индекс прогонов бэктеста (SQLite): метаданные, метрики, ссылки на .json/.npz
+    RESULTS_INDEX_PATH = os.path.join(DATA_DIR, "results_index.sqlite")
 
     @classmethod
     def validate(cls):
@@ -72,5 +128,38 @@ class Config:
             raise ValueError("DEEPSEEK_API_KEY не указан в .env")
 
 
-# Автовалидация при импорте
-Config.validate()
\ No newline at end of file
+    @classmethod
+    def freeze(cls, validate=True):
+        """Неизменяемый снимок настроек: строится один раз в точке входа и передаётся явно"""
+        if validate:
+            cls.validate()
+        return FrozenConfig({name: getattr(cls, name) for name in dir(cls) if name.isupper()})
+
+
+class FrozenConfig:
+    """Снимок Config только для чтения (списки → кортежи); pickle-совместим для воркеров"""
+
+    def __init__(self, values):
+        values = {k: tuple(v) if isinstance(v, list) else v for k, v in values.items()}
+        object.__setattr__(self, "_values", values)
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"FrozenConfig только для чтения: {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"FrozenConfig только для чтения: {name}")
+
+    def __reduce__(self):
+        return FrozenConfig, (self._values,)
+
+    def validate(self):
+        Config.validate.__func__(self)
+
+    def replace(self, **overrides):
+        """Новый снимок с подменой части настроек (replay, тесты) — исходный не меняется"""
+        unknown = set(overrides) - set(self._values)
+        if unknown:
+            raise AttributeError(f"Нет таких настроек: {', '.join(sorted(unknown))}")
+        return FrozenConfig({**self._values, **overrides})
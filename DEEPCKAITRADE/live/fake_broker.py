@@ -0,0 +1,89 @@
+# live/fake_broker.py
+"""Локальная замена брокера для тестов и прогонов без реальных заявок.
+
+Интерфейс совпадает с TinkoffBroker из live/trade_executor.py: заявки по рынку исполняются сразу
+по последней цене или цене сигнала (± проскальзывание) и меняют позицию, стоп-заявки запоминаются
+и срабатывают только через trigger_stop, повтор order_id возвращает тот же ответ — как идемпотентность
+на стороне биржи.
+"""
+import threading
+import time
+import uuid
+
+
+class FakeBroker:
+    def __init__(self, instruments=None, last_prices=None, latency_sec=0.0, slippage=0.0, reject_figis=()):
+        self.instruments = instruments or {}
+        self.last_prices = dict(last_prices or {})
+        self.latency_sec = latency_sec
+        self.slippage = slippage
+        self.reject_figis = set(reject_figis)
+        self.orders = {}        # order_id -> ответ
+        self.stop_orders = {}   # stop_order_id -> заявка (status: active/filled/cancelled)
+        self.positions = {}     # figi -> лоты со знаком
+        self.calls = []         # (метод, order_id) — для проверок в тестах
+        self._lock = threading.Lock()
+
+    def get_instrument(self, figi):
+        self.calls.append(("get_instrument", figi))
+        meta = self.instruments.get(figi) or {"ticker": figi, "lot": 1, "tick": 0.01}
+        return {"figi": figi, "tradable": True, **meta}
+
+    def post_order(self, figi, lots, direction, order_id, price=None):
+        time.sleep(self.latency_sec)
+        with self._lock:
+            self.calls.append(("post_order", order_id))
+            if order_id in self.orders:
+                return self.orders[order_id]
+            if figi in self.reject_figis:
+                response = {"order_id": order_id, "status": "rejected", "lots_executed": 0, "price": 0.0}
+            else:
+                sign = 1 if direction == "BUY" else -1
+                price = (self.last_prices.get(figi, price) or 0.0) + sign * self.slippage
+                response = {"order_id": order_id, "status": "filled", "lots_executed": lots, "price": price}
+                self.positions[figi] = self.positions.get(figi, 0) + sign * lots
+            self.orders[order_id] = response
+            return response
+
+    def post_stop_order(self, figi, lots, direction, stop_price, kind, order_id):
+        time.sleep(self.latency_sec)
+        with self._lock:
+            self.calls.append(("post_stop_order", order_id))
+            for stop_id, order in self.stop_orders.items():
+                if order["order_id"] == order_id:
+                    return {"stop_order_id": stop_id}
+            stop_id = str(uuid.uuid4())
+            self.stop_orders[stop_id] = {"order_id": order_id, "figi": figi, "lots": lots, "direction": direction,
+                                         "stop_price": stop_price, "kind": kind, "status": "active"}
+            return {"stop_order_id": stop_id}
+
+    def cancel_stop_order(self, stop_order_id):
+        with self._lock:
+            self.calls.append(("cancel_stop_order", stop_order_id))
+            if self.stop_orders[stop_order_id]["status"] == "active":
+                self.stop_orders[stop_order_id]["status"] = "cancelled"
+
+    def trigger_stop(self, stop_order_id):
+        """Срабатывание стоп-заявки (цена дошла до уровня): исполняется по рынку и меняет позицию"""
+        with self._lock:
+            order = self.stop_orders[stop_order_id]
+            if order["status"] != "active":
+                return
+            order["status"] = "filled"
+            sign = 1 if order["direction"] == "BUY" else -1
+            self.positions[order["figi"]] = self.positions.get(order["figi"], 0) + sign * order["lots"]
+
+    def active_stop_orders(self, figi):
+        with self._lock:
+            return {stop_id for stop_id, order in self.stop_orders.items()
+                    if order["figi"] == figi and order["status"] == "active"}
+
+    def get_position(self, figi):
+        return self.positions.get(figi, 0)
+
+    def get_open_orders(self, figi):
+        return []  # рыночные заявки исполняются сразу
+
+    def get_order_state(self, order_id):
+        self.calls.append(("get_order_state", order_id))
+        return self.orders[order_id]
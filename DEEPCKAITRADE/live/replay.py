@@ -0,0 +1,319 @@
+# live/replay.py
+"""Ускоренный прогон live-цикла на записанных или синтетических свечах, без сети.
+
+    python -m DEEPCKAITRADE.live.replay                              # синтетика, максимально быстро
+    python -m DEEPCKAITRADE.live.replay --candles data/sber_m5.csv --speed 60
+    python -m DEEPCKAITRADE.live.replay --bars 5000 --max-cycles 2000 --llm-latency 0.5 --snapshot
+
+Работает настоящий код data_loader: кэш свечей, проверка целостности, индикаторы, старшие таймфреймы,
+GuardedPredictor, запись market_data/прогнозов и снимка. Подменяются только клиент Tinkoff (ReplayClient),
+часы (VirtualClock) и LLM (ReplayLLM: правила fallback + заданная задержка).
+
+Виртуальное время идёт с шагом цикла (CYCLE_INTERVAL_SEC); --speed N — в N раз быстрее реального,
+0 — без пауз. Вне торговых часов часы перескакивают к следующей свече (--no-skip-idle — честные 20 с).
+Прогон идёт на своём снимке настроек (Config.freeze().replace): выходные файлы — в workdir,
+торговля всегда выключена (TRADING_ENABLED=False), какие бы настройки ни были в .env; класс Config не меняется.
+Отчёт: циклы/с, ускорение относительно реального времени (без пропущенных часов), p50/p95/p99 по стадиям,
+счётчики, вызовы API.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from DEEPCKAITRADE.benchmarks.synthetic import generate_candles
+from DEEPCKAITRADE.config import Config
+from DEEPCKAITRADE.modules import data_loader
+from DEEPCKAITRADE.modules.fallback_predictor import fallback_prediction
+from DEEPCKAITRADE.utils.logger import logger
+from DEEPCKAITRADE.utils.metrics import metrics
+
+BAR = pd.Timedelta("5min")
+
+
+def _money(value):
+    units = int(np.floor(value))
+    return SimpleNamespace(units=units, nano=int(round((value - units) * 1e9)))
+
+
+class VirtualClock:
+    """Часы для data_loader.configure_runtime: время двигает только прогон"""
+
+    def __init__(self, start):
+        self._now = start
+
+    def now(self):
+        return self._now
+
+    def set(self, moment):
+        self._now = moment
+
+
+class ReplayClient:
+    """Локальная замена tinkoff.invest.Client для вызовов, которые делает live-цикл.
+
+    Свеча видна, если она началась до текущего виртуального времени (последняя — формирующаяся,
+    как у биржи, но уже с итоговыми значениями). Портфель — только деньги, без позиций.
+    """
+
+    def __init__(self, candles, clock, balance=None, ticker="REPLAY", lot=1, tick=0.01):
+        self._times = pd.DatetimeIndex(candles['time']).as_unit("ns").asi8
+        self._ohlcv = candles[['open', 'high', 'low', 'close', 'volume']].to_numpy()
+        self.clock = clock
+        self.balance = Config.INITIAL_BALANCE if balance is None else balance
+        self.calls = Counter()
+        self.instruments = SimpleNamespace(get_by_figi=self._get_by_figi)
+        self.operations = SimpleNamespace(get_portfolio=self._get_portfolio)
+        self.market_data = SimpleNamespace(get_last_prices=self._get_last_prices)
+        self._instrument = SimpleNamespace(ticker=ticker, lot=lot, min_price_increment=tick, type=None,
+                                           api_trade_available_flag=True)
+
+    # Client(token) и with Client(...) as client — как у настоящего
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def _visible_end(self, to=None):
+        now_ns = pd.Timestamp(self.clock.now()).value
+        end_ns = now_ns if to is None else min(now_ns, pd.Timestamp(to).value)
+        return int(np.searchsorted(self._times, end_ns, side="left"))
+
+    def get_all_candles(self, figi, from_, to, interval=None):
+        self.calls["get_all_candles"] += 1
+        start = int(np.searchsorted(self._times, pd.Timestamp(from_).value, side="left"))
+        end = self._visible_end(to)
+        for i in range(start, end):
+            o, h, l, c, v = self._ohlcv[i]
+            yield SimpleNamespace(time=pd.Timestamp(self._times[i], tz="UTC").to_pydatetime(),
+                                  open=_money(o), high=_money(h), low=_money(l), close=_money(c), volume=int(v))
+
+    def last_price(self):
+        end = self._visible_end()
+        return float(self._ohlcv[end - 1][3]) if end else 0.0
+
+    def _get_last_prices(self, figi):
+        self.calls["get_last_prices"] += 1
+        return SimpleNamespace(last_prices=[SimpleNamespace(figi=f, price=_money(self.last_price())) for f in figi])
+
+    def _get_portfolio(self, account_id):
+        self.calls["get_portfolio"] += 1
+        return SimpleNamespace(positions=[], money=[_money(self.balance)], total_amount_shares=_money(self.balance))
+
+    def _get_by_figi(self, figi):
+        self.calls["get_by_figi"] += 1
+        return SimpleNamespace(instrument=self._instrument)
+
+    def next_candle_after(self, moment):
+        """Время первой свечи позже moment или None"""
+        i = int(np.searchsorted(self._times, pd.Timestamp(moment).value, side="right"))
+        return pd.Timestamp(self._times[i], tz="UTC").to_pydatetime() if i < len(self._times) else None
+
+
+class ReplayLLM:
+    """Замена DeepSeekClient: прогноз по правилам промпта (fallback_prediction) после latency_sec"""
+
+    def __init__(self, latency_sec=0.0, config=Config):
+        self.latency_sec = latency_sec
+        self.config = config
+        self.conversation_history = []
+        self.max_history_messages = 0
+        self.calls = 0
+
+    def get_prediction(self, market_data_json):
+        self.calls += 1
+        if self.latency_sec:
+            time.sleep(self.latency_sec)
+        return {**fallback_prediction(market_data_json, self.config), "source": "replay"}
+
+    def prompt_hash(self):
+        return "replay"
+
+    def restore_history(self, history, prompt_hash):
+        return False
+
+
+def load_candles(path):
+    """CSV/Parquet с колонками time, open, high, low, close, volume (time — UTC)"""
+    df = pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path)
+    df['time'] = pd.to_datetime(df['time'], utc=True)
+    return df.sort_values('time').reset_index(drop=True)[['time', 'open', 'high', 'low', 'close', 'volume']]
+
+
+def replay_config(workdir, config=None):
+    """Снимок настроек прогона: market_data, прогнозы и снимок — в workdir, чтобы не смешивать с live.
+    Заявки не отправляются: TRADING_ENABLED из .env (и EXECUTOR_BROKER=tinkoff) в прогоне не действуют"""
+    config = config or Config.freeze(validate=False)
+    return config.replace(DATA_DIR=workdir, PREDICTIONS_DIR=os.path.join(workdir, "predictions"),
+                          SNAPSHOT_DIR=os.path.join(workdir, "snapshot"), TRADING_ENABLED=False)
+
+
+@contextmanager
+def _use_config(config):
+    """data_loader.fetch_and_predict/save_state без аргументов берут снимок из data_loader._config"""
+    saved = data_loader._config
+    data_loader._config = config
+    try:
+        yield
+    finally:
+        data_loader._config = saved
+
+
+def _stage_stats(samples):
+    stats = {}
+    for name, values in sorted(samples.items()):
+        ms = np.asarray(values) * 1000
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        stats[name] = {"count": len(ms), "mean_ms": round(float(ms.mean()), 3), "p50_ms": round(float(p50), 3),
+                       "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3),
+                       "max_ms": round(float(ms.max()), 3)}
+    return stats
+
+
+def run_replay(candles, speed=0.0, max_cycles=None, llm_latency=0.0, snapshot=False, skip_idle=True,
+               interval_sec=None, workdir=None, config=None):
+    """Прогоняет fetch_and_predict по виртуальному расписанию, возвращает отчёт.
+    config — снимок Config.freeze() (по умолчанию — из .env без валидации)"""
+    interval_sec = interval_sec or data_loader.CYCLE_INTERVAL_SEC
+    config = config or Config.freeze(validate=False)
+    config = replay_config(workdir or os.path.join(config.DATA_DIR, "replay"), config)
+    first = pd.Timestamp(candles['time'].iloc[0]).to_pydatetime()
+    end = pd.Timestamp(candles['time'].iloc[-1]).to_pydatetime() + BAR
+    # Старт — когда за спиной полные HISTORY_DAYS, как у live-процесса в середине истории
+    start = max(first + timedelta(days=config.HISTORY_DAYS), first + BAR)
+    if start >= end:
+        raise ValueError(f"Мало свечей для прогона: нужно больше {config.HISTORY_DAYS} дн. истории")
+
+    clock = VirtualClock(start)
+    client = ReplayClient(candles, clock, balance=config.INITIAL_BALANCE)
+    llm = ReplayLLM(llm_latency, config)
+    # Расписание как в run_scheduler: первый цикл сразу, снимок — раз в SNAPSHOT_INTERVAL_SEC
+    jobs = [{"name": "cycle", "fn": data_loader.fetch_and_predict, "every": interval_sec, "due": start}]
+    if snapshot:
+        jobs.append({"name": "snapshot", "fn": data_loader.save_state, "every": config.SNAPSHOT_INTERVAL_SEC,
+                     "due": start + timedelta(seconds=config.SNAPSHOT_INTERVAL_SEC)})
+
+    metrics.reset()
+    metrics.keep_samples()
+    data_loader.configure_runtime(client_factory=client, clock=clock, llm_client=llm)
+    cycles = skipped_sec = 0
+    wall_start = time.perf_counter()
+    try:
+        with _use_config(config):
+            while max_cycles is None or cycles < max_cycles:
+                job = min(jobs, key=lambda j: j["due"])
+                if job["due"] >= end:
+                    break
+                if speed > 0:
+                    lag = (job["due"] - start).total_seconds() / speed - (time.perf_counter() - wall_start)
+                    if lag > 0:
+                        time.sleep(lag)
+                clock.set(max(job["due"], clock.now()))  # просроченная задача идёт сейчас, время не откатывается
+                job["fn"]()
+                job["due"] = clock.now() + timedelta(seconds=job["every"])  # как schedule: от момента запуска
+                if job["name"] != "cycle":
+                    continue
+                cycles += 1
+                # Вне сессии новых свечей нет: переносим следующий цикл на открытие. Внутри сессии следующая
+                # свеча не дальше BAR — циклы по формирующейся свече (попадания в кэш) не пропускаются
+                upcoming = client.next_candle_after(clock.now())
+                if skip_idle and upcoming is not None and upcoming > clock.now() + BAR:
+                    skip = upcoming - job["due"]
+                    skipped_sec += skip.total_seconds()
+                    for other in jobs:  # пропущенное время не существует и для остальных задач
+                        other["due"] += skip
+            if snapshot:
+                data_loader.save_state()
+    finally:
+        data_loader.configure_runtime()
+        wall_sec = time.perf_counter() - wall_start
+
+    virtual_sec = (clock.now() - start).total_seconds()
+    active_sec = virtual_sec - skipped_sec  # перескоки через нерабочие часы — не заслуга прогона
+    snapshot_data = metrics.snapshot()
+    report = {
+        "metadata": {
+            "created_at": datetime.utcnow().isoformat() + "Z",
+            "candles": len(candles),
+            "virtual_start": start.isoformat(),
+            "virtual_end": clock.now().isoformat(),
+            "interval_sec": interval_sec,
+            "speed": speed,
+            "llm_latency_sec": llm_latency,
+            "skip_idle": skip_idle,
+            "snapshot": snapshot,
+        },
+        "cycles": cycles,
+        "wall_sec": round(wall_sec, 3),
+        "virtual_sec": virtual_sec,
+        "idle_skipped_sec": skipped_sec,
+        "cycles_per_sec": round(cycles / wall_sec, 2) if wall_sec else 0.0,
+        "active_virtual_sec": active_sec,
+        "speedup": round(active_sec / wall_sec, 1) if wall_sec else 0.0,
+        "stages": _stage_stats(metrics.samples),
+        "counters": snapshot_data["counters"],
+        "client_calls": dict(client.calls),
+        "llm_calls": llm.calls,
+    }
+    metrics.keep_samples(False)
+    return report
+
+
+def print_report(report):
+    print(f"\nЦиклов: {report['cycles']} за {report['wall_sec']:.2f} s | {report['cycles_per_sec']:.1f} циклов/с | "
+          f"ускорение x{report['speedup']:.0f} (виртуально {report['active_virtual_sec'] / 3600:.1f} ч "
+          f"+ {report['idle_skipped_sec'] / 3600:.1f} ч пропущено)")
+    print(f"\n{'stage':22s} {'count':>7s} {'mean ms':>9s} {'p50 ms':>9s} {'p95 ms':>9s} {'p99 ms':>9s} {'max ms':>9s}")
+    for name, s in report["stages"].items():
+        print(f"{name:22s} {s['count']:>7d} {s['mean_ms']:9.3f} {s['p50_ms']:9.3f} {s['p95_ms']:9.3f} "
+              f"{s['p99_ms']:9.3f} {s['max_ms']:9.3f}")
+    print(f"\nВызовы API: {report['client_calls']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ускоренный replay live-цикла без сети")
+    parser.add_argument("--candles", help="CSV/Parquet с M5-свечами; без него — синтетика")
+    parser.add_argument("--bars", type=int, default=3000, help="Число синтетических свечей")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--speed", type=float, default=0.0, help="Во сколько раз быстрее реального (0 — без пауз)")
+    parser.add_argument("--max-cycles", type=int, default=None)
+    parser.add_argument("--interval", type=int, default=None, help="Шаг цикла, сек (по умолчанию как в live)")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Задержка ответа LLM-заглушки, сек")
+    parser.add_argument("--snapshot", action="store_true", help="Писать снимок состояния по расписанию")
+    parser.add_argument("--no-skip-idle", action="store_true", help="Не перескакивать нерабочие часы")
+    parser.add_argument("--workdir", default=None, help="Куда писать market_data/прогнозы прогона")
+    parser.add_argument("--output", help="Путь для JSON с отчётом")
+    parser.add_argument("--verbose", action="store_true", help="Лог каждого цикла (по умолчанию только WARNING+)")
+    args = parser.parse_args(argv)
+
+    if not args.verbose:
+        logger.setLevel(logging.WARNING)
+    candles = load_candles(args.candles) if args.candles else generate_candles(args.bars, seed=args.seed)
+    report = run_replay(candles, speed=args.speed, max_cycles=args.max_cycles, llm_latency=args.llm_latency,
+                        snapshot=args.snapshot, skip_idle=not args.no_skip_idle, interval_sec=args.interval,
+                        workdir=args.workdir)
+    print_report(report)
+
+    output = args.output or os.path.join(Config.DATA_DIR, "replay",
+                                         f"replay_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Отчёт: {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,124 @@
+# live/snapshot.py
+"""Снимок состояния live-движка для тёплого старта.
+
+    {SNAPSHOT_DIR}/manifest.json   — версия, figi, время, число свечей, хэш исходников классов из state.pkl
+    {SNAPSHOT_DIR}/candles/*.npy   — буфер M5 по колонкам (читается через memory-map)
+    {SNAPSHOT_DIR}/state.pkl       — swing-индекс, пропуски, старшие таймфреймы, инструмент, история диалога
+
+Запись: tmp-каталог, прошлый снимок переименовывается в .old, tmp — на его место, и только потом
+.old удаляется. Прерванная запись не портит прошлый снимок; если процесс упал между двумя
+переименованиями, load_snapshot возвращает .old на место.
+"""
+import glob
+import hashlib
+import importlib
+import json
+import os
+import pickle
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from DEEPCKAITRADE.utils.logger import logger
+
+SNAPSHOT_VERSION = 1
+CANDLE_COLUMNS = ("open", "high", "low", "close", "volume")
+
+
+def state_version(modules):
+    """Хэш исходников модулей, чьи объекты лежат в state.pkl (как feature_version у хранилища признаков):
+    изменился SwingIndex/GapIndex/MultiTimeframe — старый pickle не подходит, хоть и загрузится"""
+    digest = hashlib.sha1()
+    for name in sorted(modules):
+        digest.update(name.encode())
+        with open(importlib.import_module(name).__file__, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+class _ModuleRecordingPickler(pickle.Pickler):
+    """Запоминает модули проекта всех объектов в pickle, включая вложенные (PriceLevels внутри SwingIndex)"""
+
+    def __init__(self, file):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.modules = set()
+
+    def persistent_id(self, obj):
+        module = type(obj).__module__
+        if module.startswith("DEEPCKAITRADE."):
+            self.modules.add(module)
+        return None
+
+
+def save_snapshot(path, figi, candles, state):
+    """candles — DataFrame буфера, state — словарь picklable-объектов"""
+    started = time.perf_counter()
+    tmp = f"{path}.tmp{os.getpid()}"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(os.path.join(tmp, "candles"))
+    np.save(os.path.join(tmp, "candles", "time.npy"), pd.DatetimeIndex(candles['time']).as_unit("ns").asi8)
+    for name in CANDLE_COLUMNS:
+        np.save(os.path.join(tmp, "candles", f"{name}.npy"), candles[name].to_numpy())
+    with open(os.path.join(tmp, "state.pkl"), "wb") as f:
+        pickler = _ModuleRecordingPickler(f)
+        pickler.dump(state)
+    modules = sorted(pickler.modules)
+    with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"version": SNAPSHOT_VERSION, "figi": figi, "saved_at": time.time(), "rows": len(candles),
+                   "state_modules": modules, "state_version": state_version(modules),
+                   "last_candle_ns": int(pd.Timestamp(candles['time'].iloc[-1]).value) if len(candles) else None},
+                  f, indent=2)
+    old = f"{path}.old{os.getpid()}"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old)  # до удаления: без снимка на диске не остаёмся ни на момент
+    os.replace(tmp, path)
+    shutil.rmtree(old, ignore_errors=True)
+    logger.info(f"[Snapshot] Сохранено: {len(candles)} свечей за {(time.perf_counter() - started) * 1000:.0f} мс")
+
+
+def _recover(path):
+    """Запись прервалась между переименованиями: снимка нет, но есть отложенный .old — возвращаем его"""
+    if os.path.exists(path):
+        return
+    old = sorted(glob.glob(f"{glob.escape(path)}.old*"), key=os.path.getmtime)
+    if old:
+        os.replace(old[-1], path)
+        logger.warning(f"[Snapshot] Восстановлен прошлый снимок из {old[-1]}")
+
+
+def load_snapshot(path, figi, max_age_sec, now=None):
+    """(candles, state, manifest) или None, если снимка нет, он чужой, устарел или не читается.
+
+    now — unix-время, от которого считается возраст последней свечи (по умолчанию time.time())
+    """
+    _recover(path)
+    manifest_path = os.path.join(path, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest["version"] != SNAPSHOT_VERSION or manifest["figi"] != figi or not manifest["rows"]:
+            logger.info("[Snapshot] Снимок от другой версии/инструмента — холодный старт")
+            return None
+        if manifest.get("state_version") != state_version(manifest.get("state_modules", ())):
+            logger.info("[Snapshot] Код классов состояния изменился после записи снимка — холодный старт")
+            return None
+        age = (time.time() if now is None else now) - manifest["last_candle_ns"] / 1e9
+        if age > max_age_sec:
+            logger.info(f"[Snapshot] Снимок устарел ({age / 3600:.1f} ч) — холодный старт")
+            return None
+        columns = {name: np.load(os.path.join(path, "candles", f"{name}.npy"), mmap_mode="r")
+                   for name in ("time",) + CANDLE_COLUMNS}
+        # DataFrame копирует колонки из mmap: дальше буфер меняется, файл снимка — нет
+        candles = pd.DataFrame({name: np.array(columns[name]) for name in CANDLE_COLUMNS})
+        candles.insert(0, 'time', pd.to_datetime(np.array(columns["time"]), utc=True))
+        with open(os.path.join(path, "state.pkl"), "rb") as f:
+            state = pickle.load(f)
+        return candles, state, manifest
+    except Exception as e:
+        logger.warning(f"[Snapshot] Не удалось прочитать снимок: {e} — холодный старт")
+        return None
@@ -0,0 +1,373 @@
+# live/trade_executor.py
+"""Исполнение сигналов: BUY/SELL прогноз → заявка по рынку + стоп-лосс/тейк-профит.
+
+Горячий путь (submit) не ходит в сеть: метаданные инструмента (лот, шаг цены) закэшированы
+и проверены заранее, заявка уходит в фоновый поток. Ключ идемпотентности (order_id) выводится
+из сигнала и времени его свечи, поэтому повтор того же прогноза в следующих циклах не создаёт
+вторую заявку; новая свеча с тем же направлением при открытой позиции тоже пропускается.
+
+Встречный сигнал разворачивает позицию: к объёму сигнала добавляется противоположная позиция
+у брокера, SL/TP ставятся на чистую позицию после исполнения (на нулевую — не ставятся).
+
+SL и TP — пара one-cancels-other: исполнение одной ноги (poll_fills) снимает другую, закрытие
+или разворот позиции снимает обе. Каждая нога отслеживается отдельно, не выставленная — дозаявляется.
+"""
+import math
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from tinkoff.invest import (
+    Client, OrderDirection, OrderExecutionReportStatus, OrderType, Quotation,
+    StopOrderDirection, StopOrderExpirationType, StopOrderType
+)
+
+from DEEPCKAITRADE.config import Config
+from DEEPCKAITRADE.utils.logger import logger
+from DEEPCKAITRADE.utils.metrics import metrics
+
+ORDER_NAMESPACE = uuid.UUID("6f1d3c1e-4b7a-4a51-9a55-0d5c2b8e7f10")
+EXIT_DIRECTION = {"BUY": "SELL", "SELL": "BUY"}
+FINAL_STATUSES = ("filled", "rejected", "cancelled", "error")
+EXIT_KINDS = ("stop_loss", "take_profit")
+
+
+def cast_money(money):
+    return money.units + money.nano / 1e9
+
+
+def to_quotation(price):
+    units = int(math.floor(price))
+    return Quotation(units=units, nano=int(round((price - units) * 1e9)))
+
+
+def round_to_tick(price, tick, up):
+    """До шага цены: вверх или вниз (без ошибок float на кратных значениях)"""
+    steps = price / tick
+    steps = math.ceil(steps - 1e-9) if up else math.floor(steps + 1e-9)
+    return round(steps * tick, 9)
+
+
+class TinkoffBroker:
+    """Заявки через Tinkoff Invest API; один gRPC-канал на всё время работы"""
+
+    _STATUS = {
+        OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL: "filled",
+        OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL: "partially_filled",
+        OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_NEW: "new",
+        OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_REJECTED: "rejected",
+        OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED: "cancelled",
+    }
+
+    def __init__(self, token, account_id):
+        self._client_cm = Client(token)
+        self.client = self._client_cm.__enter__()
+        self.account_id = account_id
+
+    def close(self):
+        self._client_cm.__exit__(None, None, None)
+
+    def get_instrument(self, figi):
+        instrument = self.client.instruments.get_by_figi(figi=figi).instrument
+        return {
+            "figi": figi,
+            "ticker": instrument.ticker,
+            "lot": int(instrument.lot),
+            "tick": cast_money(instrument.min_price_increment),
+            "tradable": bool(instrument.api_trade_available_flag)
+        }
+
+    def _report(self, response):
+        return {
+            "order_id": response.order_id,
+            "status": self._STATUS.get(response.execution_report_status, "new"),
+            "lots_executed": int(response.lots_executed),
+            "price": cast_money(response.executed_order_price)
+        }
+
+    def post_order(self, figi, lots, direction, order_id, price=None):
+        response = self.client.orders.post_order(
+            figi=figi,
+            quantity=lots,
+            direction=OrderDirection.ORDER_DIRECTION_BUY if direction == "BUY" else OrderDirection.ORDER_DIRECTION_SELL,
+            account_id=self.account_id,
+            order_type=OrderType.ORDER_TYPE_MARKET,
+            order_id=order_id
+        )
+        return self._report(response)
+
+    def post_stop_order(self, figi, lots, direction, stop_price, kind, order_id):
+        response = self.client.stop_orders.post_stop_order(
+            figi=figi,
+            quantity=lots,
+            price=to_quotation(stop_price),
+            stop_price=to_quotation(stop_price),
+            direction=StopOrderDirection.STOP_ORDER_DIRECTION_BUY if direction == "BUY"
+            else StopOrderDirection.STOP_ORDER_DIRECTION_SELL,
+            account_id=self.account_id,
+            expiration_type=StopOrderExpirationType.STOP_ORDER_EXPIRATION_TYPE_GOOD_TILL_CANCEL,
+            stop_order_type=StopOrderType.STOP_ORDER_TYPE_STOP_LOSS if kind == "stop_loss"
+            else StopOrderType.STOP_ORDER_TYPE_TAKE_PROFIT,
+            order_id=order_id  # ключ идемпотентности: повтор после сбоя не создаёт вторую ногу
+        )
+        return {"stop_order_id": response.stop_order_id}
+
+    def cancel_stop_order(self, stop_order_id):
+        self.client.stop_orders.cancel_stop_order(account_id=self.account_id, stop_order_id=stop_order_id)
+
+    def active_stop_orders(self, figi):
+        """id стоп-заявок, ещё ждущих срабатывания"""
+        response = self.client.stop_orders.get_stop_orders(account_id=self.account_id)
+        return {order.stop_order_id for order in response.stop_orders if order.figi == figi}
+
+    def get_position(self, figi):
+        """Позиция в лотах: > 0 — long, < 0 — short, 0 — нет"""
+        for position in self.client.operations.get_portfolio(account_id=self.account_id).positions:
+            if position.figi == figi:
+                return int(position.quantity_lots.units)
+        return 0
+
+    def get_open_orders(self, figi):
+        """Направления активных (не исполненных) заявок по инструменту"""
+        return [("BUY" if order.direction == OrderDirection.ORDER_DIRECTION_BUY else "SELL")
+                for order in self.client.orders.get_orders(account_id=self.account_id).orders if order.figi == figi]
+
+    def get_order_state(self, order_id):
+        return self._report(self.client.orders.get_order_state(account_id=self.account_id, order_id=order_id))
+
+
+class TradeExecutor:
+    def __init__(self, broker, figi=None, config=Config):
+        self.broker = broker
+        self.figi = figi or config.INSTRUMENT_FIGI
+        self._instruments = {}
+        self._orders = {}    # client_order_id -> состояние заявки
+        self._order_locks = {}  # client_order_id -> Lock: отчёт и выставление ног из пула и из poll_fills
+        self._futures = {}
+        self.fills = []
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="orders")
+
+    def instrument(self, figi=None):
+        """Лот и шаг цены из кэша; первый запрос — при старте, не на горячем пути"""
+        figi = figi or self.figi
+        meta = self._instruments.get(figi)
+        if meta is None:
+            meta = self.broker.get_instrument(figi)
+            if meta["lot"] < 1 or meta["tick"] <= 0:
+                raise ValueError(f"Некорректные параметры инструмента {figi}: {meta}")
+            if not meta["tradable"]:
+                raise ValueError(f"Инструмент {figi} недоступен для торговли через API")
+            self._instruments[figi] = meta
+        return meta
+
+    def prepare(self, prediction, market_data, figi=None, signal_time=None):
+        """План заявок по прогнозу; ValueError, если сигнал нельзя исполнить как есть.
+        signal_time — время свечи сигнала (ключ идемпотентности); без него — timestamp market_data"""
+        figi = figi or self.figi
+        action = prediction["action"]
+        if action not in EXIT_DIRECTION:
+            raise ValueError(f"Нечего исполнять: {action}")
+        meta = self.instrument(figi)
+        lots = int(prediction["size"]) // meta["lot"]
+        if lots < 1:
+            raise ValueError(f"Размер {prediction['size']} меньше лота {meta['lot']}")
+
+        side = 1 if action == "BUY" else -1
+        entry, stop_loss, take_profit = prediction["entry_price"], prediction["stop_loss"], prediction["take_profit"]
+        if side * (entry - stop_loss) <= 0 or side * (take_profit - entry) <= 0:
+            raise ValueError(f"SL/TP не по ту сторону от входа: {stop_loss} / {entry} / {take_profit}")
+        signal_time = signal_time.isoformat() if hasattr(signal_time, "isoformat") else \
+            (signal_time or market_data["timestamp"])
+        # BUY: SL дальше от входа (вниз), TP ближе (вниз); SELL — наоборот
+        return {
+            "client_order_id": str(uuid.uuid5(ORDER_NAMESPACE, f"{figi}|{signal_time}|{action}")),
+            "figi": figi,
+            "direction": action,
+            "exit_direction": EXIT_DIRECTION[action],
+            "lots": lots,
+            "entry_price": entry,
+            "stop_loss": round_to_tick(stop_loss, meta["tick"], up=side < 0),
+            "take_profit": round_to_tick(take_profit, meta["tick"], up=side < 0),
+        }
+
+    def _is_open(self, state):
+        """Заявка ещё держит позицию: исполнена (или исполняется) и позиция не закрыта"""
+        if state["status"] in ("pending", "new", "partially_filled"):
+            return True
+        return self._open_lots(state) > 0 and not state.get("closed")
+
+    @staticmethod
+    def _open_lots(state):
+        """Наша позиция после исполнения: исполненный объём минус закрытая им встречная позиция"""
+        return state["lots_executed"] - state.get("close_lots", 0)
+
+    def submit(self, prediction, market_data, figi=None, signal_time=None):
+        """Горячий путь: проверка + постановка в очередь. Возвращает состояние заявки или None"""
+        signal_at = time.perf_counter()
+        try:
+            plan = self.prepare(prediction, market_data, figi, signal_time)
+        except ValueError as e:
+            metrics.inc("orders_invalid")
+            logger.warning(f"[Executor] Сигнал не исполнен: {e}")
+            return None
+        with self._lock:
+            state = self._orders.get(plan["client_order_id"])
+            if state is not None:
+                metrics.inc("orders_duplicate")
+                return state
+            # Позиция в ту же сторону уже открыта нами — не наращиваем её каждым циклом
+            for other in self._orders.values():
+                if other["figi"] == plan["figi"] and other["direction"] == plan["direction"] and self._is_open(other):
+                    metrics.inc("orders_skipped_open")
+                    return other
+            state = self._orders[plan["client_order_id"]] = {**plan, "status": "pending", "lots_executed": 0,
+                                                             "exits": {}}
+            self._order_locks[plan["client_order_id"]] = threading.Lock()
+            self._futures[plan["client_order_id"]] = self._pool.submit(self._execute, state, signal_at)
+        metrics.observe("signal_to_submit", time.perf_counter() - signal_at)
+        return state
+
+    def _execute(self, state, signal_at):
+        try:
+            # Проверка на стороне брокера (в фоне, не на горячем пути): позиция или заявка в ту же
+            # сторону, открытые не этим процессом (рестарт, ручная торговля)
+            sign = 1 if state["direction"] == "BUY" else -1
+            position = self.broker.get_position(state["figi"])
+            if sign * position > 0 or state["direction"] in self.broker.get_open_orders(state["figi"]):
+                state["status"] = "skipped"
+                metrics.inc("orders_skipped_open")
+                logger.info(f"[Executor] {state['direction']} {state['figi']} пропущен: позиция/заявка в ту же "
+                            f"сторону уже открыта (позиция {position})")
+                return
+            # Разворот: встречная позиция закрывается той же заявкой, её защитные ноги больше не нужны
+            state["close_lots"] = max(0, -sign * position)
+            self._cancel_opposite(state)
+            with metrics.stage("order_send"):
+                report = self.broker.post_order(state["figi"], state["lots"] + state["close_lots"],
+                                                state["direction"], state["client_order_id"],
+                                                price=state["entry_price"])
+            latency = time.perf_counter() - signal_at
+            metrics.observe("signal_to_order", latency)
+            self._apply_report(state, report)
+            logger.info(f"[Executor] {state['direction']} {state['lots'] + state['close_lots']} лот(ов) "
+                        f"{state['figi']}: {state['status']} "
+                        f"@ {state.get('fill_price', 0):.2f} | {latency * 1000:.1f} мс",
+                        extra={"stage": "order", "figi": state["figi"], "latency": round(latency, 4)})
+        except Exception as e:
+            state["status"] = "error"
+            state["error"] = str(e)
+            metrics.inc("orders_failed")
+            logger.error(f"[Executor] Ошибка заявки {state['client_order_id']}: {e}")
+
+    def _apply_report(self, state, report):
+        # Отчёт приходит и из пула (_execute), и из poll_fills: проверка ног и их выставление — под одной блокировкой
+        with self._order_locks[state["client_order_id"]]:
+            new_lots = report["lots_executed"] - state["lots_executed"]
+            state.update(broker_order_id=report["order_id"], status=report["status"],
+                         lots_executed=report["lots_executed"], fill_price=report["price"])
+            if new_lots > 0:
+                self.fills.append({"client_order_id": state["client_order_id"], "lots": new_lots,
+                                   "price": report["price"], "ts": time.time()})
+                metrics.inc("orders_filled_lots", new_lots)
+            if report["status"] == "rejected":
+                metrics.inc("orders_rejected")
+            # Защитные заявки — когда объём позиции окончательный; на чистую позицию после разворота.
+            # Исполнилось не больше встречной позиции — нашей позиции нет, ноги открыли бы новую
+            if state["status"] in FINAL_STATUSES and state["lots_executed"] > 0:
+                if self._open_lots(state) > 0:
+                    self._place_exits(state)
+                else:
+                    state["closed"] = True
+
+    def _place_exits(self, state):
+        """Выставляет ещё не выставленные ноги; вызывается под блокировкой заявки.
+        Ключ ноги постоянный — повтор после ошибки не создаёт дубль у брокера"""
+        if state.get("closed"):
+            return
+        for kind in EXIT_KINDS:
+            leg = state["exits"].setdefault(kind, {"status": "pending", "stop_order_id": None})
+            if leg["status"] not in ("pending", "error"):
+                continue
+            try:
+                response = self.broker.post_stop_order(state["figi"], self._open_lots(state), state["exit_direction"],
+                                                       state[kind], kind, f"{state['client_order_id']}:{kind}")
+                leg.update(status="active", stop_order_id=response["stop_order_id"])
+                leg.pop("error", None)
+            except Exception as e:
+                leg.update(status="error", error=str(e))
+                metrics.inc("exit_orders_failed")
+                logger.error(f"[Executor] {kind} для {state['client_order_id']} не выставлен (повтор в poll_fills): {e}")
+
+    def _cancel_legs(self, state, reason):
+        """Снимает активные ноги заявки; вызывается под блокировкой заявки"""
+        for kind, leg in state["exits"].items():
+            if leg["status"] != "active":
+                if leg["status"] in ("pending", "error"):
+                    leg["status"] = "cancelled"
+                continue
+            try:
+                self.broker.cancel_stop_order(leg["stop_order_id"])
+                leg["status"] = "cancelled"
+                metrics.inc("exit_orders_cancelled")
+                logger.info(f"[Executor] {kind} {state['client_order_id']} снят: {reason}")
+            except Exception as e:
+                logger.error(f"[Executor] Не удалось снять {kind} {state['client_order_id']}: {e}")
+        state["closed"] = all(leg["status"] != "active" for leg in state["exits"].values())
+
+    def _cancel_opposite(self, state):
+        for other in list(self._orders.values()):
+            if other is state or other["figi"] != state["figi"] or other["direction"] == state["direction"]:
+                continue
+            if other["exits"] and not other.get("closed"):
+                with self._order_locks[other["client_order_id"]]:
+                    self._cancel_legs(other, "разворот позиции")
+
+    def _sync_exits(self, figi, states):
+        """OCO: нога, пропавшая из активных без нашей отмены, сработала — снимаем вторую.
+        Позиция закрыта или развёрнута — снимаем обе"""
+        active = self.broker.active_stop_orders(figi)
+        position = self.broker.get_position(figi)
+        for state in states:
+            with self._order_locks[state["client_order_id"]]:
+                if state.get("closed"):
+                    continue
+                for kind, leg in state["exits"].items():
+                    if leg["status"] == "active" and leg["stop_order_id"] not in active:
+                        leg["status"] = "filled"
+                        metrics.inc("exit_orders_filled")
+                        logger.info(f"[Executor] {kind} {state['client_order_id']} исполнен")
+                sign = 1 if state["direction"] == "BUY" else -1
+                if any(leg["status"] == "filled" for leg in state["exits"].values()):
+                    self._cancel_legs(state, "исполнена другая нога")
+                elif sign * position <= 0:
+                    self._cancel_legs(state, f"позиция закрыта или развёрнута ({position})")
+                else:
+                    self._place_exits(state)  # дозаявка ноги, не выставленной из-за ошибки
+
+    def poll_fills(self):
+        """Дозапрашивает состояние незавершённых заявок (частичное исполнение, очередь биржи)
+        и сверяет защитные ноги исполненных"""
+        by_figi = {}
+        for state in list(self._orders.values()):
+            if state["status"] in ("new", "partially_filled"):
+                try:
+                    self._apply_report(state, self.broker.get_order_state(state["broker_order_id"]))
+                except Exception as e:
+                    logger.error(f"[Executor] Состояние {state['client_order_id']}: {e}")
+            if state["exits"] and not state.get("closed"):
+                by_figi.setdefault(state["figi"], []).append(state)
+        for figi, states in by_figi.items():
+            try:
+                self._sync_exits(figi, states)
+            except Exception as e:
+                logger.error(f"[Executor] Сверка стоп-заявок {figi}: {e}")
+
+    def wait(self, timeout=None):
+        wait(list(self._futures.values()), timeout=timeout)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+        if hasattr(self.broker, "close"):
+            self.broker.close()
@@ -1,30 +1,37 @@
-from config import Config
-from utils.logger import setup_logger, logger
+"""Точка входа: python -m DEEPCKAITRADE.main (режим — MODE из .env: LIVE или BACKTEST).
 
-setup_logger()  # Инициализация логгера
+Здесь импортируются только config и logger; pandas, tinkoff, requests и прочее тяжёлое
+подгружается вместе с модулем выбранного режима.
+"""
+from DEEPCKAITRADE.config import Config
+from DEEPCKAITRADE.utils.logger import logger
 
 
-def run_live_mode():
+def run_live_mode(config):
     """Запуск live-режима с таймером"""
-    from modules.data_loader import run_scheduler
+    from DEEPCKAITRADE.modules.data_loader import run_scheduler
     logger.info("LIVE-РЕЖИМ: Загрузка данных каждые 20 секунд...")
-    run_scheduler()
+    run_scheduler(config)
 
 
-def run_backtest_mode():
+def run_backtest_mode(config):
     """Запуск тестирования точности на исторических данных"""
-    from backtest.accuracy_test import run_accuracy_test
+    from DEEPCKAITRADE.backtest.accuracy_test import run_accuracy_test
     logger.info("BACKTEST РЕЖИМ: Тестирование точности DeepSeek...")
-    run_accuracy_test()
+    run_accuracy_test(config)
 
 
-if __name__ == "__main__":
-    config = Config()
+def main():
+    config = Config.freeze()  # валидация .env один раз, дальше снимок передаётся явно
 
     if config.MODE == "LIVE":
-        run_live_mode()
+        run_live_mode(config)
     elif config.MODE == "BACKTEST":
-        run_backtest_mode()
+        run_backtest_mode(config)
     else:
         logger.error(f"Неизвестный режим: {config.MODE}")
-        logger.error("Допустимые значения: LIVE, BACKTEST")
\ No newline at end of file
+        logger.error("Допустимые значения: LIVE, BACKTEST")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,97 @@
 import os
+import hashlib
 import json
 import time
 import requests
 from DEEPCKAITRADE.config import Config
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 from DEEPCKAITRADE.utils.logger import logger
+from DEEPCKAITRADE.utils.metrics import metrics
+from DEEPCKAITRADE.modules.llm_ledger import LLMLedger, extract_cache_tokens
+from DEEPCKAITRADE.modules.payload import encode_batch, payload_text
+
+# Пакетный режим (бэктест): поверх системного промпта — формат массива
+BATCH_INSTRUCTION = (
+    "ПАКЕТНЫЙ РЕЖИМ. Вход: {\"batch\": [{\"id\": 0, ...снимок рынка...}, ...]} — независимые снимки, "
+    "каждый оценивай отдельно по всем правилам, не используя остальные снимки. "
+    "Выход: {\"predictions\": [{\"id\": 0, ...поля прогноза...}, ...]} — ровно по одному прогнозу "
+    "на каждый id, в формате из раздела «ФОРМАТ ВЫВОДА»."
+)
+BATCH_TOKENS_PER_ITEM = 300  # запас completion на один прогноз до первой оценки по факту
+
+
+def validate_prediction(prediction):
+    """Формат ответа модели (общий для DeepSeekClient и ансамбля); ValueError — ответ не годится"""
+    required = ["action", "confidence", "size", "entry_price", "stop_loss", "take_profit", "risk_percent",
+                "message"]
+    for field in required:
+        if field not in prediction:
+            raise ValueError(f"Missing field in prediction: {field}")
+    if not isinstance(prediction["confidence"], (int, float)) or not 0 <= prediction["confidence"] <= 95:
+        raise ValueError(f"Invalid confidence: {prediction.get('confidence', 'N/A')}")
+    if prediction["action"] not in ["BUY", "SELL", "HOLD"]:
+        raise ValueError(f"Invalid action: {prediction.get('action', 'N/A')}")
+
+
+class BatchSizer:
+    """Адаптивный размер пакета K: +1 после удачного запроса, уменьшение при обрезке ответа/ошибке
+    или превышении бюджета задержки; сверху — max_tokens / (completion-токенов на прогноз).
+    Снизу — 2: при K=1 get_predictions шлёт всё по одному и размер уже не смог бы вырасти"""
+
+    def __init__(self, initial, maximum, max_tokens, latency_budget_sec):
+        self.maximum = max(1, maximum)
+        self.minimum = min(2, self.maximum)
+        self.size = max(self.minimum, min(initial, self.maximum))
+        self.max_tokens = max_tokens
+        self.latency_budget_sec = latency_budget_sec
+        self.tokens_per_item = None
+
+    @classmethod
+    def from_config(cls, config, initial=None):
+        return cls(initial or config.LLM_BATCH_SIZE, config.LLM_BATCH_MAX, config.LLM_BATCH_MAX_TOKENS,
+                   config.LLM_BATCH_LATENCY_SEC)
+
+    def completion_budget(self, k):
+        per_item = self.tokens_per_item * 1.3 if self.tokens_per_item else BATCH_TOKENS_PER_ITEM
+        return int(min(self.max_tokens, per_item * k + 100))
+
+    def update(self, k, completion_tokens, latency):
+        if completion_tokens:
+            per_item = completion_tokens / k
+            self.tokens_per_item = per_item if self.tokens_per_item is None \
+                else 0.7 * self.tokens_per_item + 0.3 * per_item
+        limit = self.maximum
+        if self.tokens_per_item:
+            limit = min(limit, int((self.max_tokens - 100) / (self.tokens_per_item * 1.3)))
+        if latency > self.latency_budget_sec:
+            target = int(k * self.latency_budget_sec / latency)
+        else:
+            target = self.size + 1
+        self.size = max(self.minimum, min(limit, target))
+        metrics.set_gauge("llm_batch_size", self.size)
+
+    def shrink(self, k):
+        self.size = max(self.minimum, k // 2)
+        metrics.set_gauge("llm_batch_size", self.size)
 
 
 class DeepSeekClient:
     _instance = None
 
-    def __new__(cls):
+    def __new__(cls, config=None):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
             cls._instance._initialized = False
         return cls._instance
 
-    def __init__(self):
+    def __init__(self, config=None):
+        """config — снимок Config.freeze(); синглтон перенастраивается, если передан другой снимок"""
         if self._initialized:
+            if config is not None and config is not self.config:
+                self._configure(config)
             return
 
-        self.config = Config()
-        self.headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {self.config.DEEPSEEK_API_KEY}"
-        }
-        self.timeout = int(self.config.DEEPSEEK_TIMEOUT)
+        self._configure(config or Config)
 
         # Системный промпт загружается и отправляется ТОЛЬКО ОДИН РАЗ при первом запуске
         # Дальше - только JSON в user messages, без повторения промпта
@@ -36,6 +102,16 @@ class DeepSeekClient:
         logger.info(f"[DeepSeek] Клиент инициализирован. Модель: {self.config.DEEPSEEK_MODEL}")
         self._initialized = True
 
+    def _configure(self, config):
+        """Всё, что зависит от настроек; история диалога при смене снимка сохраняется"""
+        self.config = config
+        self.headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {config.DEEPSEEK_API_KEY}"
+        }
+        self.timeout = int(config.DEEPSEEK_TIMEOUT)
+        self.ledger = LLMLedger(config.LLM_LEDGER_PATH)
+
     def _load_system_prompt(self):
         prompt_path = os.path.join(os.path.dirname(__file__), "../system_prompt.txt")
         if os.path.exists(prompt_path):
@@ -47,19 +123,32 @@ class DeepSeekClient:
         # Вставь полный системный промпт сюда, если нужно
         """.strip()
 
+    def _ensure_system_prompt(self):
+        # === SYSTEM PROMPT — ТОЛЬКО ОДИН РАЗ ===
+        if not self.system_prompt_sent:
+            system_content = self._load_system_prompt()
+            self.system_prompt = {"role": "system", "content": system_content}  # сохраняем отдельно
+            self.system_prompt_sent = True
+            logger.info("[DeepSeek] Системный промпт загружен (отправляется каждый раз, но кэшируется моделью)")
+
+    def _count_usage(self, usage):
+        metrics.inc("llm_requests")
+        metrics.inc("llm_prompt_tokens", usage.get("prompt_tokens") or 0)
+        metrics.inc("llm_completion_tokens", usage.get("completion_tokens") or 0)
+
     @retry(
         stop=stop_after_attempt(3),
         wait=wait_exponential(multiplier=1, min=3, max=15),
-        retry=retry_if_exception_type(requests.exceptions.RequestException)
+        retry=retry_if_exception_type(requests.exceptions.RequestException),
+        before_sleep=lambda retry_state: metrics.inc("llm_retry")
     )
     def get_prediction(self, market_data_json):
+        attempt = self.get_prediction.statistics.get("attempt_number", 1)
+        recent_history = []
+        body = b""
+        start = time.time()
         try:
-            # === SYSTEM PROMPT — ТОЛЬКО ОДИН РАЗ ===
-            if not self.system_prompt_sent:
-                system_content = self._load_system_prompt()
-                self.system_prompt = {"role": "system", "content": system_content}  # сохраняем отдельно
-                self.system_prompt_sent = True
-                logger.info("[DeepSeek] Системный промпт загружен (отправляется каждый раз, но кэшируется моделью)")
+            self._ensure_system_prompt()
 
             # === ОСТАВЛЯЕМ ТОЛЬКО ПОСЛЕДНИЕ 3 СООБЩЕНИЯ (user + assistant) ===
             # Это ~1500–2000 токенов максимум — идеально!
@@ -69,7 +158,7 @@ class DeepSeekClient:
             messages_to_send = [self.system_prompt] + recent_history
 
             # Добавляем текущее сообщение
-            user_content = json.dumps(market_data_json, ensure_ascii=False, separators=(',', ':'))  # ультра-компактный JSON
+            user_content = payload_text(market_data_json)  # ультра-компактный JSON (готовый у MarketPayload)
             messages_to_send.append({"role": "user", "content": user_content})
 
             payload = {
@@ -84,11 +173,13 @@ class DeepSeekClient:
             logger.info(f"[DeepSeek → SEND] Отправлено сообщений: {len(messages_to_send)} | "
                         f"Текущий JSON: ~{len(user_content)//4} токенов")
 
+            # Сериализуем сами: размер тела идёт в журнал, requests не делает второй dumps
+            body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode("utf-8")
             start = time.time()
             response = requests.post(
                 self.config.DEEPSEEK_API_URL,
                 headers=self.headers,
-                json=payload,
+                data=body,
                 timeout=self.timeout
             )
             latency = time.time() - start
@@ -96,9 +187,12 @@ class DeepSeekClient:
             response.raise_for_status()
             data = response.json()
             usage = data.get("usage", {})
+            cache_hit, cache_miss = extract_cache_tokens(usage)
+            self._count_usage(usage)
             logger.info(f"[DeepSeek ← RECV] {latency:.2f}s | "
                         f"Prompt: {usage.get('prompt_tokens', '?')} | "
-                        f"Completion: {usage.get('completion_tokens', '?')} токенов")
+                        f"Completion: {usage.get('completion_tokens', '?')} токенов",
+                        extra={"stage": "llm", "latency": round(latency, 4)})
 
             content = data["choices"][0]["message"]["content"]
             prediction = json.loads(content)
@@ -110,15 +204,137 @@ class DeepSeekClient:
             ])
 
             logger.info(f"[DeepSeek] {prediction['action']} | conf={prediction['confidence']}% | {latency:.2f}s")
-            self._validate_prediction(prediction)
+            with metrics.stage("validation"):
+                self._validate_prediction(prediction)
+
+            self.ledger.record(
+                model=self.config.DEEPSEEK_MODEL, status="ok", attempt=attempt,
+                latency_ms=round(latency * 1000, 1),
+                prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"),
+                cache_hit_tokens=cache_hit, cache_miss_tokens=cache_miss,
+                history_messages=len(recent_history), payload_bytes=len(body),
+                action=prediction["action"], confidence=prediction["confidence"]
+            )
             return prediction
 
         except Exception as e:
+            self.ledger.record(
+                model=self.config.DEEPSEEK_MODEL, status=type(e).__name__, attempt=attempt,
+                latency_ms=round((time.time() - start) * 1000, 1),
+                history_messages=len(recent_history), payload_bytes=len(body)
+            )
             logger.error(f"[DeepSeek ERROR] {str(e)}")
             if 'response' in locals():
                 logger.error(f"Ответ сервера: {response.text[:1000]}")
             raise
 
+    def get_predictions(self, snapshots, sizer):
+        """Пакетный режим: список снимков → список прогнозов в том же порядке (None — не удалось).
+
+        Снимки уходят пакетами по sizer.size; повторно запрашиваются только не прошедшие
+        _validate_prediction, остаток после LLM_BATCH_RETRIES — обычным get_prediction по одному.
+        """
+        results = [None] * len(snapshots)
+        pending = list(range(len(snapshots)))
+        for attempt in range(1, self.config.LLM_BATCH_RETRIES + 2):
+            failed = []
+            while pending:
+                chunk, pending = pending[:sizer.size], pending[sizer.size:]
+                if len(chunk) == 1:
+                    failed.extend(chunk)  # пакет из одного — дешевле обычным запросом ниже
+                    continue
+                try:
+                    items = self._request_batch([snapshots[i] for i in chunk], sizer, attempt)
+                except Exception as e:
+                    logger.error(f"[DeepSeek BATCH] K={len(chunk)}: {e}")
+                    failed.extend(chunk)
+                    continue
+                for i, item in zip(chunk, items):
+                    if isinstance(item, Exception):
+                        failed.append(i)
+                    else:
+                        results[i] = item
+            pending = sorted(failed)
+            if not pending:
+                break
+            metrics.inc("llm_batch_item_retry", len(pending))
+        for i in pending:
+            try:
+                results[i] = self.get_prediction(snapshots[i])
+            except Exception as e:
+                logger.error(f"[DeepSeek BATCH] Снимок {i} не получил прогноз: {e}")
+        return results
+
+    def _request_batch(self, snapshots, sizer, attempt=1):
+        """Один запрос на K снимков; для каждого — прогноз или исключение валидации"""
+        self._ensure_system_prompt()
+        k = len(snapshots)
+        body = b""
+        start = time.time()
+        try:
+            user_content = encode_batch(snapshots).decode("utf-8")
+            payload = {
+                "model": self.config.DEEPSEEK_MODEL,
+                "messages": [self.system_prompt, {"role": "system", "content": BATCH_INSTRUCTION},
+                             {"role": "user", "content": user_content}],
+                "response_format": {"type": "json_object"},
+                "temperature": 0.1,
+                "max_tokens": sizer.completion_budget(k)
+            }
+            body = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode("utf-8")
+            start = time.time()
+            response = requests.post(self.config.DEEPSEEK_API_URL, headers=self.headers, data=body,
+                                     timeout=self.timeout)
+            latency = time.time() - start
+            response.raise_for_status()
+            data = response.json()
+            usage = data.get("usage", {})
+            cache_hit, cache_miss = extract_cache_tokens(usage)
+            self._count_usage(usage)
+            choice = data["choices"][0]
+            if choice.get("finish_reason") == "length":
+                raise ValueError(f"Ответ обрезан по max_tokens={payload['max_tokens']}")
+            parsed = json.loads(choice["message"]["content"])
+            raw = parsed.get("predictions", []) if isinstance(parsed, dict) else parsed
+        except Exception as e:
+            sizer.shrink(k)
+            self.ledger.record(
+                model=self.config.DEEPSEEK_MODEL, status=type(e).__name__, attempt=attempt,
+                latency_ms=round((time.time() - start) * 1000, 1), payload_bytes=len(body), batch_size=k
+            )
+            raise
+
+        # id из ответа, если модель его вернула; иначе — по позиции
+        by_id = {}
+        for position, item in enumerate(raw if isinstance(raw, list) else []):
+            if isinstance(item, dict):
+                key = item.pop("id", position)
+                by_id.setdefault(int(key) if str(key).isdigit() else key, item)
+        items = []
+        for i in range(k):
+            prediction = by_id.get(i)
+            try:
+                if prediction is None:
+                    raise ValueError(f"Нет прогноза для id={i}")
+                with metrics.stage("validation"):
+                    self._validate_prediction(prediction)
+                items.append(prediction)
+            except (ValueError, TypeError) as e:
+                metrics.inc("llm_batch_item_invalid")
+                items.append(e)
+
+        sizer.update(k, usage.get("completion_tokens"), latency)
+        valid = sum(1 for item in items if not isinstance(item, Exception))
+        logger.info(f"[DeepSeek ← BATCH] K={k} | валидных {valid} | {latency:.2f}s | "
+                    f"Prompt: {usage.get('prompt_tokens', '?')} | Completion: {usage.get('completion_tokens', '?')}",
+                    extra={"stage": "llm", "latency": round(latency, 4)})
+        self.ledger.record(
+            model=self.config.DEEPSEEK_MODEL, status="ok", attempt=attempt, latency_ms=round(latency * 1000, 1),
+            prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"),
+            cache_hit_tokens=cache_hit, cache_miss_tokens=cache_miss, payload_bytes=len(body), batch_size=k
+        )
+        return items
+
     def _estimate_tokens(self, messages):
         """Грубая оценка количества токенов (для логов)"""
         total = 0
@@ -127,15 +343,18 @@ class DeepSeekClient:
         return int(total)
 
     def _validate_prediction(self, prediction):
-        required = ["action", "confidence", "size", "entry_price", "stop_loss", "take_profit", "risk_percent",
-                    "message"]
-        for field in required:
-            if field not in prediction:
-                raise ValueError(f"Missing field in prediction: {field}")
-        if not isinstance(prediction["confidence"], (int, float)) or not 0 <= prediction["confidence"] <= 95:
-            raise ValueError(f"Invalid confidence: {prediction.get('confidence', 'N/A')}")
-        if prediction["action"] not in ["BUY", "SELL", "HOLD"]:
-            raise ValueError(f"Invalid action: {prediction.get('action', 'N/A')}")
+        validate_prediction(prediction)
+
+    def prompt_hash(self):
+        return hashlib.sha1(self._load_system_prompt().encode("utf-8")).hexdigest()[:12]
+
+    def restore_history(self, history, prompt_hash):
+        """Тёплый старт: история из снимка — только если системный промпт не менялся"""
+        if prompt_hash != self.prompt_hash():
+            logger.info("[DeepSeek] Системный промпт изменился — история из снимка отброшена")
+            return False
+        self.conversation_history = list(history)
+        return True
 
     def reset_conversation(self):
         self.conversation_history = []
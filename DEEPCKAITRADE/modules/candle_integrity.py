@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+
+from DEEPCKAITRADE.utils.logger import logger
+from DEEPCKAITRADE.utils.metrics import metrics
+
+BAR_NS = pd.Timedelta("5min").value
+
+
+def _minutes(hhmm):
+    hours, minutes = hhmm.strip().split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def parse_sessions(value):
+    """'07:00-15:50,16:05-20:50' -> [(420, 950), (965, 1250)] — минуты от полуночи UTC, [start, end)"""
+    sessions = []
+    for window in (value or "").split(","):
+        if not window.strip():
+            continue
+        start, end = window.split("-")
+        sessions.append((_minutes(start), _minutes(end)))
+    return sessions
+
+
+def expected_times(start_ns, end_ns, sessions):
+    """Начала M5-свечей по календарю (будни × торговые окна) в [start_ns, end_ns], int64 нс"""
+    days = pd.bdate_range(pd.Timestamp(start_ns, tz="UTC").normalize(), pd.Timestamp(end_ns, tz="UTC").normalize())
+    offsets = np.concatenate([np.arange(s, e, 5) for s, e in sessions]) * 60 * 10 ** 9
+    grid = (days.as_unit("ns").asi8[:, None] + offsets[None, :]).ravel()
+    return grid[(grid >= start_ns) & (grid <= end_ns)]
+
+
+def group_runs(missing_ns):
+    """Подряд идущие пропуски -> [(start_ns, end_ns), ...], end — начало последней пропущенной свечи"""
+    if not len(missing_ns):
+        return []
+    breaks = np.flatnonzero(np.diff(missing_ns) != BAR_NS) + 1
+    starts = np.r_[0, breaks]
+    ends = np.r_[breaks, len(missing_ns)] - 1
+    return [(int(missing_ns[s]), int(missing_ns[e])) for s, e in zip(starts, ends)]
+
+
+def check_candles(df, sessions):
+    """Векторная проверка: порядок, дубликаты (остаётся последняя версия свечи), пропуски по календарю.
+
+    Возвращает (очищенный df, отчёт). Отчёт: rows, out_of_order, duplicates, missing_bars, off_calendar, gaps.
+    """
+    report = {"rows": len(df), "out_of_order": 0, "duplicates": 0, "missing_bars": 0, "off_calendar": 0, "gaps": []}
+    if df.empty:
+        return df, report
+    times = pd.DatetimeIndex(df['time']).as_unit("ns").asi8
+    report["out_of_order"] = int((np.diff(times) < 0).sum())
+    if report["out_of_order"]:
+        df = df.iloc[np.argsort(times, kind="stable")]
+        times = np.sort(times, kind="stable")
+    dup = np.r_[times[1:] == times[:-1], False]  # у дубликата оставляем последнюю строку — самую свежую
+    report["duplicates"] = int(dup.sum())
+    if report["duplicates"]:
+        df, times = df.iloc[~dup], times[~dup]
+
+    expected = expected_times(times[0], times[-1], sessions)
+    missing = np.setdiff1d(expected, times, assume_unique=True)
+    report["missing_bars"] = int(len(missing))
+    report["off_calendar"] = int(len(np.setdiff1d(times, expected, assume_unique=True)))
+    report["gaps"] = group_runs(missing)
+    return df.reset_index(drop=True), report
+
+
+class GapIndex:
+    """Известные пропуски одного инструмента: что уже дозапрашивали и что оказалось пустым (нет сделок/праздник)"""
+
+    def __init__(self):
+        self._gaps = {}  # (start_ns, end_ns) -> "pending" | "empty"
+
+    def update(self, gaps):
+        """Синхронизирует индекс с отчётом check_candles: закрытые и ушедшие из окна пропуски удаляются"""
+        current = set(gaps)
+        self._gaps = {key: status for key, status in self._gaps.items() if key in current}
+        for key in current:
+            self._gaps.setdefault(key, "pending")
+
+    def pending(self, limit):
+        return sorted(key for key, status in self._gaps.items() if status == "pending")[-limit:] if limit > 0 else []
+
+    def mark_empty(self, key):
+        self._gaps[key] = "empty"
+
+    def stats(self):
+        pending = [key for key, status in self._gaps.items() if status == "pending"]
+        return {
+            "intervals": len(self._gaps),
+            "pending_intervals": len(pending),
+            "pending_bars": sum((end - start) // BAR_NS + 1 for start, end in pending)
+        }
+
+
+def refetch_gaps(df, gap_index, fetch_range, sessions, limit):
+    """Дозапрос только пропущенных интервалов. fetch_range(start, end) -> DataFrame свечей [start, end)"""
+    targets = gap_index.pending(limit)
+    if not targets:
+        return df
+    parts = [df]
+    for start_ns, end_ns in targets:
+        start, end = pd.Timestamp(start_ns, tz="UTC"), pd.Timestamp(end_ns + BAR_NS, tz="UTC")
+        metrics.inc("gap_refetch")
+        fetched = fetch_range(start.to_pydatetime(), end.to_pydatetime())
+        if fetched.empty:
+            gap_index.mark_empty((start_ns, end_ns))  # биржа подтвердила: свечей нет
+            metrics.inc("gap_refetch_empty")
+            continue
+        metrics.inc("gap_refetch_filled_bars", len(fetched))
+        parts.append(fetched)
+    if len(parts) == 1:
+        return df
+    df, report = check_candles(pd.concat(parts, ignore_index=True), sessions)
+    gap_index.update(report["gaps"])
+    logger.info(f"[Gaps] Дозапрошено интервалов: {len(targets)}, осталось пропусков: {report['missing_bars']}")
+    return df
+
+
+def export_report(report, gap_index=None):
+    metrics.inc("candles_duplicates", report["duplicates"])
+    metrics.inc("candles_out_of_order", report["out_of_order"])
+    metrics.set_gauge("candles_missing_bars", report["missing_bars"])
+    metrics.set_gauge("candles_gap_intervals", len(report["gaps"]))
+    metrics.set_gauge("candles_off_calendar", report["off_calendar"])
+    if gap_index is not None:
+        metrics.set_gauge("candles_gap_pending_bars", gap_index.stats()["pending_bars"])
@@ -0,0 +1,31 @@
+"""Загрузка M5-свечей из Tinkoff в DataFrame — общая для live и бэктеста.
+
+Отдельно от data_loader, чтобы бэктест не тянул live-зависимости (schedule, исполнение, снимки).
+"""
+import pandas as pd
+
+
+def cast_money(money):
+    return money.units + money.nano / 1e9
+
+
+def candles_to_frame(candles):
+    return pd.DataFrame([{
+        'time': c.time,
+        'open': cast_money(c.open),
+        'high': cast_money(c.high),
+        'low': cast_money(c.low),
+        'close': cast_money(c.close),
+        'volume': c.volume
+    } for c in candles], columns=['time', 'open', 'high', 'low', 'close', 'volume'])
+
+
+def fetch_candles(client, figi, from_, to):
+    """M5-свечи [from_, to) одним DataFrame"""
+    from tinkoff.invest import CandleInterval
+    return candles_to_frame(client.get_all_candles(
+        figi=figi,
+        from_=from_,
+        to=to,
+        interval=CandleInterval.CANDLE_INTERVAL_5_MIN
+    ))
@@ -1,143 +1,181 @@
 import os
-import json
+import signal
+import sys
 import time
 import schedule
 from datetime import datetime, timedelta
 import pandas as pd
 import pytz
-from tinkoff.invest import Client, CandleInterval
+from tinkoff.invest import Client
 from tinkoff.invest.exceptions import RequestError
 
 from DEEPCKAITRADE.config import Config
 from DEEPCKAITRADE.modules.indicators import calculate_indicators
+from DEEPCKAITRADE.modules.patterns import scan_last
+from DEEPCKAITRADE.modules.swing_index import SwingIndex
+from DEEPCKAITRADE.modules.timeframes import MultiTimeframe
+from DEEPCKAITRADE.modules.candle_integrity import GapIndex, check_candles, export_report, parse_sessions, refetch_gaps
 from DEEPCKAITRADE.modules.portfolio_tracker import get_current_positions
 from DEEPCKAITRADE.modules.api_client import DeepSeekClient
+from DEEPCKAITRADE.modules.payload import PayloadBuilder
+from DEEPCKAITRADE.modules.candle_source import cast_money, candles_to_frame, fetch_candles  # noqa: F401 (реэкспорт)
+from DEEPCKAITRADE.modules.fallback_predictor import GuardedPredictor
 from DEEPCKAITRADE.backtest.prediction_handler import PredictionHandler
+from DEEPCKAITRADE.live.snapshot import load_snapshot, save_snapshot
 from DEEPCKAITRADE.utils.logger import logger
+from DEEPCKAITRADE.utils.metrics import metrics
+from DEEPCKAITRADE.utils.profiling import profiler
 
 # Глобальный кэш для свечей (один на процесс)
 _candles_cache = None
 _last_update = None
+_swing_index = SwingIndex()  # swing-точки и зоны S/R, дополняется по новым свечам
+_gap_index = GapIndex()      # пропуски свечей: какие уже дозапрашивали
+_multi_timeframe = None       # старшие таймфреймы, строятся по снимку настроек (_get_multi_timeframe)
+_mtf_config = None           # снимок, по которому построен _multi_timeframe
+_guarded_predictor = None    # дедлайн + circuit breaker вокруг DeepSeek, создаётся при первом цикле
+_trade_executor = None       # при TRADING_ENABLED, создаётся при первом сигнале
+_instrument_specs = None     # тикер, лот, шаг цены — статичны, запрашиваются один раз (и попадают в снимок)
+_config = Config             # снимок настроек (Config.freeze()), задаётся в run_scheduler
+_payload_builder = None      # статичные секции market_data, закодированные один раз
 
+# Точки подмены для live/replay.py: клиент Tinkoff, часы и LLM (по умолчанию — настоящие)
+_client_factory = Client
+_clock = None                # объект с now() -> aware datetime UTC; None — системное время
+_llm_client = None           # None — DeepSeekClient() (или ансамбль при ENSEMBLE_MODELS)
+CYCLE_INTERVAL_SEC = 20
 
-def cast_money(money):
-    return money.units + money.nano / 1e9
 
+def configure_runtime(client_factory=Client, clock=None, llm_client=None):
+    """Подменяет источники данных и времени (replay, тесты); без аргументов — возврат к боевым"""
+    global _client_factory, _clock, _llm_client
+    _client_factory, _clock, _llm_client = client_factory, clock, llm_client
 
-def fetch_market_data():
+
+def _utcnow():
+    return _clock.now() if _clock is not None else datetime.utcnow().replace(tzinfo=pytz.utc)
+
+
+def _get_llm_client():
+    global _llm_client
+    if _llm_client is None and _config.ENSEMBLE_MODELS:
+        from DEEPCKAITRADE.modules.ensemble import EnsemblePredictor
+        _llm_client = EnsemblePredictor(_config)
+    return _llm_client if _llm_client is not None else DeepSeekClient(_config)
+
+
+def _get_multi_timeframe(config):
+    """MultiTimeframe по MTF_TIMEFRAMES снимка (None — выключено); пересобирается при смене снимка"""
+    global _multi_timeframe, _mtf_config
+    if _mtf_config is not config:
+        _multi_timeframe = MultiTimeframe(config.MTF_TIMEFRAMES, config.MTF_MAX_BARS) if config.MTF_TIMEFRAMES \
+            else None
+        _mtf_config = config
+    return _multi_timeframe
+
+
+def _get_payload_builder(config):
+    global _payload_builder
+    if _payload_builder is None or _payload_builder.config is not config:
+        _payload_builder = PayloadBuilder(config)
+    return _payload_builder
+
+
+def fetch_market_data(config=None):
     """Получает данные с биржи и формирует JSON для промпта. С кэшированием."""
-    global _candles_cache, _last_update
-    config = Config()
+    global _candles_cache, _last_update, _instrument_specs
+    config = config or _config
     os.makedirs(config.DATA_DIR, exist_ok=True)
 
     try:
-        with Client(config.TINKOFF_TOKEN) as client:
-            now = datetime.utcnow().replace(tzinfo=pytz.utc)
-
-            # Кэширование: полный запрос раз в 60 сек, иначе - только новые свечи
-            if _candles_cache is None or (now - _last_update).total_seconds() > 60:
+        with _client_factory(config.TINKOFF_TOKEN) as client:
+            now = _utcnow()
+
+            # Полная загрузка — при старте (или раз в CANDLES_FULL_REFRESH_SEC), дальше только новые свечи и дыры
+            full_refresh = _candles_cache is None or (
+                config.CANDLES_FULL_REFRESH_SEC > 0
+                and (now - _last_update).total_seconds() > config.CANDLES_FULL_REFRESH_SEC)
+            if full_refresh:
+                metrics.inc("candles_cache_miss")
                 from_time = now - timedelta(days=config.HISTORY_DAYS)
-                candles = client.get_all_candles(
-                    figi=config.INSTRUMENT_FIGI,
-                    from_=from_time,
-                    to=now,
-                    interval=CandleInterval.CANDLE_INTERVAL_5_MIN
-                )
-                _candles_cache = pd.DataFrame([{
-                    'time': c.time,
-                    'open': cast_money(c.open),
-                    'high': cast_money(c.high),
-                    'low': cast_money(c.low),
-                    'close': cast_money(c.close),
-                    'volume': c.volume
-                } for c in candles])
+                with metrics.stage("candles"):
+                    _candles_cache = fetch_candles(client, config.INSTRUMENT_FIGI, from_time, now)
                 _last_update = now
                 logger.info(f"[Data] Полный кэш обновлён: {len(_candles_cache)} свечей")
             else:
-                # Только новые
+                # Только новые (с последней свечой кэша — она могла ещё формироваться)
+                metrics.inc("candles_cache_hit")
                 last_time = _candles_cache['time'].max()
-                new_candles = client.get_all_candles(
-                    figi=config.INSTRUMENT_FIGI,
-                    from_=last_time,
-                    to=now,
-                    interval=CandleInterval.CANDLE_INTERVAL_5_MIN
-                )
-                if new_candles:
-                    new_df = pd.DataFrame([{
-                        'time': c.time,
-                        'open': cast_money(c.open),
-                        'high': cast_money(c.high),
-                        'low': cast_money(c.low),
-                        'close': cast_money(c.close),
-                        'volume': c.volume
-                    } for c in new_candles])
-                    _candles_cache = pd.concat([_candles_cache, new_df]).drop_duplicates('time').sort_values('time')
+                with metrics.stage("candles"):
+                    new_df = fetch_candles(client, config.INSTRUMENT_FIGI, last_time, now)
+                if not new_df.empty:
+                    _candles_cache = pd.concat([_candles_cache, new_df], ignore_index=True)
                     logger.info(f"[Data] Добавлено {len(new_df)} новых свечей")
 
+            # Целостность: порядок, дубликаты (побеждает свежая версия), пропуски по календарю сессий
+            with metrics.stage("integrity"):
+                if not _candles_cache.empty:
+                    horizon = now - timedelta(days=config.HISTORY_DAYS)
+                    _candles_cache = _candles_cache[_candles_cache['time'] >= horizon]
+                sessions = parse_sessions(config.SESSION_HOURS_UTC)
+                _candles_cache, report = check_candles(_candles_cache, sessions)
+                _gap_index.update(report["gaps"])
+                _candles_cache = refetch_gaps(
+                    _candles_cache, _gap_index,
+                    lambda start, end: fetch_candles(client, config.INSTRUMENT_FIGI, start, end),
+                    sessions, config.GAP_REFETCH_MAX)
+                export_report(report, _gap_index)
+
             df = _candles_cache.copy()
             if df.empty:
                 raise ValueError("No candle data received")
 
             # Расчёт индикаторов
-            indicators = calculate_indicators(df)
-
-            # Текущие позиции
-            positions = get_current_positions(client, config.ACCOUNT_ID, config.INSTRUMENT_FIGI)
+            with metrics.stage("indicators"):
+                indicators = calculate_indicators(df, _swing_index)
+                patterns = detect_patterns(df, indicators, _swing_index)
+
+            # Старшие таймфреймы — из того же буфера, без дополнительных запросов
+            multi_timeframe = None
+            aggregator = _get_multi_timeframe(config)
+            if aggregator is not None:
+                with metrics.stage("multi_timeframe"):
+                    multi_timeframe = aggregator.snapshot(df)
+
+            # Текущие позиции и equity
+            with metrics.stage("portfolio"):
+                positions = get_current_positions(client, config.ACCOUNT_ID, config.INSTRUMENT_FIGI)
+                current_equity = get_account_equity(client, config.ACCOUNT_ID)
 
             # Спецификации инструмента
-            instrument = client.instruments.get_by_figi(figi=config.INSTRUMENT_FIGI).instrument
-
-            # Текущий equity
-            current_equity = get_account_equity(client, config.ACCOUNT_ID)
-
-            # Формирование JSON
-            data = {
-                "timestamp": now.isoformat() + "Z",
-                "market_data": {
-                    "price_current": float(df['close'].iloc[-1]),
-                    "candle_current": {
-                        "open": float(df['open'].iloc[-1]),
-                        "high": float(df['high'].iloc[-1]),
-                        "low": float(df['low'].iloc[-1]),
-                        "close": float(df['close'].iloc[-1])
-                    },
-                    "volume_current": int(df['volume'].iloc[-1]),
-                    "indicators": indicators,
-                    "patterns": detect_patterns(df, indicators)
-                },
-                "risk_params": {
-                    "account_equity": float(current_equity),
-                    "max_risk_per_trade_pct": config.RISK_PER_TRADE_PCT,
-                    "max_exposure_per_asset_pct": config.MAX_EXPOSURE_PCT,
-                    "min_risk_reward": config.MIN_RISK_REWARD,
-                    "volatility_threshold": config.VOLATILITY_THRESHOLD
-                },
-                "instrument_specs": {
+            if _instrument_specs is None:
+                with metrics.stage("instrument"):
+                    instrument = client.instruments.get_by_figi(figi=config.INSTRUMENT_FIGI).instrument
+                _instrument_specs = {
                     "symbol": instrument.ticker,
                     "asset_class": map_asset_type(instrument),
                     "tick_value": float(instrument.min_price_increment),
-                    "min_order_size": int(instrument.lot),
-                    "avg_daily_volume": estimate_avg_volume(df),
-                    "margin_requirement": 0
-                },
-                "current_positions": positions,  # Теперь словарь с ключом
-                "cost_structure": {
-                    "commission_per_share": config.COMMISSION_PER_SHARE,
-                    "fixed_commission": config.FIXED_COMMISSION,
-                    "max_slippage": config.MAX_SLIPPAGE
+                    "min_order_size": int(instrument.lot)
                 }
-            }
 
-            # Сохранение
-            timestamp = datetime.now(config.TIMEZONE).strftime("%Y%m%d_%H%M%S")
+            # Формирование JSON: один проход по последней свече, сериализация — один раз на цикл
+            with metrics.stage("payload"):
+                data = _get_payload_builder(config).build(
+                    df, now.isoformat() + "Z", indicators, patterns, current_equity, _instrument_specs,
+                    estimate_avg_volume(df), positions, multi_timeframe)
+
+            # Сохранение — те же байты, что уйдут в промпт
+            timestamp = now.astimezone(config.TIMEZONE).strftime("%Y%m%d_%H%M%S")
             filename = f"{config.DATA_DIR}/market_data_{timestamp}.json"
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            with metrics.stage("persist_market_data"):
+                with open(filename, 'wb') as f:
+                    f.write(data.encoded)
 
             logger.info(f"[Data] Сохранено: {filename}")
             return data  # Возвращаем dict, не файл
 
     except RequestError as e:
+        metrics.inc("tinkoff_error")
         logger.error(f"[Tinkoff API] {e.details}")
         return None
     except Exception as e:
@@ -145,32 +183,79 @@ def fetch_market_data():
         return None
 
 
-def fetch_and_predict():
-    """Основной workflow"""
+def fetch_and_predict(config=None):
+    """Основной workflow (каждый N-й цикл профилируется при PROFILE_EVERY_N > 0)"""
+    with profiler.maybe("live_cycle"):
+        _fetch_and_predict(config or _config)
+
+
+def _get_guarded_predictor(deepseek_client, config):
+    global _guarded_predictor
+    if _guarded_predictor is None:
+        _guarded_predictor = GuardedPredictor(deepseek_client, config)
+    return _guarded_predictor
+
+
+def _get_trade_executor(config):
+    global _trade_executor
+    if _trade_executor is None:
+        # Модули исполнения нужны только при TRADING_ENABLED — импорт при первом сигнале
+        from DEEPCKAITRADE.live.trade_executor import TinkoffBroker, TradeExecutor
+        if config.EXECUTOR_BROKER == "tinkoff":
+            broker = TinkoffBroker(config.TINKOFF_TOKEN, config.ACCOUNT_ID)
+        else:
+            from DEEPCKAITRADE.live.fake_broker import FakeBroker
+            broker = FakeBroker()
+        _trade_executor = TradeExecutor(broker, config.INSTRUMENT_FIGI)
+        _trade_executor.instrument()  # лот/шаг цены — заранее, не на горячем пути
+        logger.info(f"[Executor] Исполнение включено, брокер: {config.EXECUTOR_BROKER}")
+    return _trade_executor
+
+
+def _fetch_and_predict(config):
     start_time = time.time()
-    deepseek_client = DeepSeekClient()  # Синглтон - один на все вызовы
-    prediction_handler = PredictionHandler()
+    deepseek_client = _get_llm_client()  # Синглтон - один на все вызовы
+    prediction_handler = PredictionHandler(config)
 
-    market_data = fetch_market_data()
+    if _trade_executor is not None:
+        _trade_executor.poll_fills()
+
+    with metrics.stage("market_data"):
+        market_data = fetch_market_data(config)
     if not market_data:
-        logger.error("[Workflow] Не удалось загрузить данные. Пропуск.")
+        metrics.inc("cycle_skipped")
+        logger.error("[Workflow] Не удалось загрузить данные. Пропуск.",
+                     extra={"stage": "market_data", "figi": config.INSTRUMENT_FIGI})
         return
 
     try:
         api_start = time.time()
-        prediction = deepseek_client.get_prediction(market_data)
+        with metrics.stage("llm"):
+            if config.FALLBACK_ENABLED:
+                prediction, source = _get_guarded_predictor(deepseek_client, config).predict(market_data)
+            else:
+                prediction, source = deepseek_client.get_prediction(market_data), "llm"
         api_latency = time.time() - api_start
 
-        prediction_handler.save_prediction(market_data, prediction, api_latency)
+        with metrics.stage("persist_prediction"):
+            prediction_handler.save_prediction(market_data, prediction, api_latency)
 
         total_time = time.time() - start_time
+        metrics.observe("cycle", total_time)
+        metrics.inc("cycle_completed")
         logger.info(
-            f"[Workflow] Цикл: {total_time:.2f}s | API: {api_latency:.2f}s | Action: {prediction['action']} ({prediction['confidence']}%)")
+            f"[Workflow] Цикл: {total_time:.2f}s | API: {api_latency:.2f}s | Action: {prediction['action']} ({prediction['confidence']}%) | {source}",
+            extra={"stage": "cycle", "figi": config.INSTRUMENT_FIGI, "latency": round(total_time, 4)})
 
-        if prediction["action"] in ["BUY", "SELL"] and prediction["confidence"] >= 80:
+        if prediction["action"] in ["BUY", "SELL"] and prediction["confidence"] >= config.TRADE_MIN_CONFIDENCE:
             send_trade_alert(prediction, market_data)
+            if config.TRADING_ENABLED:
+                # Ключ заявки — от свечи сигнала: повтор сигнала в следующих 20-секундных циклах той же
+                # свечи не отправляет новую заявку
+                _get_trade_executor(config).submit(prediction, market_data, signal_time=_candles_cache['time'].iloc[-1])
 
     except Exception as e:
+        metrics.inc("cycle_failed")
         logger.error(f"[Workflow] Error: {str(e)}")
 
 
@@ -186,14 +271,81 @@ def send_trade_alert(prediction, market_data):
     logger.info(f"[Alert] {message}")
 
 
-def run_scheduler():
-    schedule.every(20).seconds.do(fetch_and_predict)
-    logger.info("Система запущена. Цикл: 20 секунд.")
-    logger.info(f"Инструмент: {Config().INSTRUMENT_FIGI}")
+def save_state():
+    """Снимок для тёплого старта: буфер свечей, состояние индикаторов, инструмент, история диалога"""
+    if _candles_cache is None or _candles_cache.empty:
+        return
+    deepseek_client = _get_llm_client()
+    state = {
+        "swing_index": _swing_index,
+        "gap_index": _gap_index,
+        "multi_timeframe": _multi_timeframe,
+        "instrument_specs": _instrument_specs,
+        "conversation_history": deepseek_client.conversation_history[-deepseek_client.max_history_messages:],
+        "prompt_hash": deepseek_client.prompt_hash()
+    }
+    try:
+        with metrics.stage("snapshot"):
+            save_snapshot(_config.SNAPSHOT_DIR, _config.INSTRUMENT_FIGI, _candles_cache, state)
+    except Exception as e:
+        logger.error(f"[Snapshot] Ошибка записи: {e}")
+
+
+def restore_state():
+    """Тёплый старт: после загрузки снимка первый цикл дозапрашивает только новые свечи"""
+    global _candles_cache, _last_update, _swing_index, _gap_index, _multi_timeframe, _instrument_specs
+    multi_timeframe = _get_multi_timeframe(_config)
+    loaded = load_snapshot(_config.SNAPSHOT_DIR, _config.INSTRUMENT_FIGI, _config.HISTORY_DAYS * 86400,
+                           _utcnow().timestamp())
+    if loaded is None:
+        return False
+    candles, state, manifest = loaded
+    _candles_cache = candles
+    _last_update = datetime.fromtimestamp(manifest["saved_at"], tz=pytz.utc)
+    _swing_index = state["swing_index"]
+    _gap_index = state["gap_index"]
+    _instrument_specs = state["instrument_specs"]
+    saved_mtf = state["multi_timeframe"]
+    if saved_mtf is not None and multi_timeframe is not None \
+            and [agg.timeframe for agg in saved_mtf.aggregators] == list(_config.MTF_TIMEFRAMES):
+        _multi_timeframe = saved_mtf
+    _get_llm_client().restore_history(state["conversation_history"], state["prompt_hash"])
+    logger.info(f"[Snapshot] Тёплый старт: {len(candles)} свечей, "
+                f"{len(state['conversation_history'])} сообщений истории")
+    return True
+
+
+def run_scheduler(config=None):
+    """config — снимок Config.freeze() из точки входа; без него строится здесь (с валидацией .env)"""
+    global _config
+    if config is None:
+        config = Config.freeze()  # с валидацией .env
+    else:
+        config.validate()
+    _config = config
+    metrics.start_http_server(config.METRICS_PORT)
+    metrics.start_json_dump(config.METRICS_DUMP_PATH, config.METRICS_DUMP_INTERVAL)
+
+    if config.SNAPSHOT_ENABLED:
+        restore_state()
+        schedule.every(config.SNAPSHOT_INTERVAL_SEC).seconds.do(save_state)
+        # SIGTERM → SystemExit, чтобы finally ниже успел записать снимок
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    schedule.every(CYCLE_INTERVAL_SEC).seconds.do(fetch_and_predict)
+    logger.info(f"Система запущена. Цикл: {CYCLE_INTERVAL_SEC} секунд.")
+    logger.info(f"Инструмент: {config.INSTRUMENT_FIGI}")
 
-    while True:
-        schedule.run_pending()
-        time.sleep(0.5)
+    try:
+        fetch_and_predict()  # первый прогноз сразу, а не через 20 секунд
+        while True:
+            schedule.run_pending()
+            time.sleep(0.5)
+    finally:
+        if config.SNAPSHOT_ENABLED:
+            save_state()
+        if _trade_executor is not None:
+            _trade_executor.shutdown()
 
 
 # Вспомогательные функции (без изменений, но с логами)
@@ -204,7 +356,7 @@ def get_account_equity(client, account_id):
         return total_value
     except Exception as e:
         logger.error(f"[Equity] Error: {str(e)}")
-        return Config().INITIAL_BALANCE  # Fallback
+        return _config.INITIAL_BALANCE  # Fallback
 
 
 def map_asset_type(instrument):
@@ -221,26 +373,12 @@ def map_asset_type(instrument):
 def estimate_avg_volume(df):
     if len(df) < 100:
         return 1000000
-    return int(df['volume'].rolling(100).mean().iloc[-1])
-
-
-def detect_patterns(df, indicators):
-    patterns = {"candlestick": [], "support_resistance": [], "price_action": []}
-
-    # Bullish engulfing (пример)
-    if len(df) >= 2 and (
-            df['close'].iloc[-1] > df['open'].iloc[-1] and
-            df['open'].iloc[-2] > df['close'].iloc[-2] and
-            df['open'].iloc[-1] < df['close'].iloc[-2] and
-            df['close'].iloc[-1] > df['open'].iloc[-2]
-    ):
-        patterns["candlestick"].append("bullish_engulfing")
+    return int(df['volume'].to_numpy()[-100:].mean())  # = rolling(100).mean() последней свечи
 
-    # Resistance test
-    if abs(indicators["bollinger"]["upper"] - df['high'].iloc[-1]) < 0.1:
-        patterns["support_resistance"].append(f"resistance_{indicators['bollinger']['upper']:.2f}_tested")
 
-    return patterns
+def detect_patterns(df, indicators, swing_index=None):
+    """Свечные, price action и S/R паттерны последней свечи (см. modules/patterns.py)"""
+    return scan_last(df, indicators, swing_index)
 
 
 if __name__ == "__main__":
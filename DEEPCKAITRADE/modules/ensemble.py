@@ -0,0 +1,223 @@
+"""Ансамбль моделей: один и тот же payload параллельно уходит в несколько моделей/эндпоинтов,
+решение — как только ENSEMBLE_QUORUM ответов согласны по action.
+
+Время цикла ограничено кворумным по скорости ответом, а не суммой задержек. Запросы, которые ещё
+не начались, отменяются; уже отправленные дорабатывают в фоне (requests нельзя прервать), их ответ
+в решение не идёт, но учитывается в статистике согласия модели.
+
+Модели — Config.ENSEMBLE_MODELS, элемент "model[@url[#ENV_КЛЮЧА]]":
+    ENSEMBLE_MODELS=deepseek-chat,deepseek-reasoner,gpt-4o-mini@https://api.openai.com/v1/chat/completions#OPENAI_API_KEY
+"""
+import json
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+from DEEPCKAITRADE.config import Config
+from DEEPCKAITRADE.modules.api_client import DeepSeekClient, validate_prediction
+from DEEPCKAITRADE.modules.llm_ledger import LLMLedger, extract_cache_tokens
+from DEEPCKAITRADE.modules.payload import payload_text
+from DEEPCKAITRADE.utils.logger import logger
+from DEEPCKAITRADE.utils.metrics import metrics
+
+LATENCY_WINDOW = 500  # последних ответов на модель для перцентилей
+
+
+def parse_member(spec, config=Config):
+    """'model[@url[#ENV_KEY]]' -> {"model", "url", "api_key"}; без url/ключа — как у DeepSeek"""
+    spec, _, key_env = spec.partition("#")
+    model, _, url = spec.partition("@")
+    return {
+        "model": model.strip(),
+        "url": url.strip() or config.DEEPSEEK_API_URL,
+        "api_key": os.getenv(key_env.strip()) if key_env.strip() else config.DEEPSEEK_API_KEY
+    }
+
+
+def merge_predictions(predictions):
+    """Согласные прогнозы → один: медианы цен и риска, минимальный размер, средняя уверенность"""
+    first = predictions[0]
+    models = "+".join(p["_model"] for p in predictions)
+    return {
+        "action": first["action"],
+        "confidence": round(statistics.mean(p["confidence"] for p in predictions)),
+        "size": min(int(p["size"]) for p in predictions),
+        "entry_price": statistics.median(p["entry_price"] for p in predictions),
+        "stop_loss": statistics.median(p["stop_loss"] for p in predictions),
+        "take_profit": statistics.median(p["take_profit"] for p in predictions),
+        "risk_percent": statistics.median(p["risk_percent"] for p in predictions),
+        "message": f"[ensemble {models}] {first['message']}",
+        "source": "ensemble"
+    }
+
+
+class EnsemblePredictor:
+    """Тот же интерфейс, что у DeepSeekClient (get_prediction) — подставляется в live и бэктест"""
+
+    def __init__(self, config=Config):
+        self.config = config
+        self.members = [parse_member(spec, config) for spec in config.ENSEMBLE_MODELS]
+        if not self.members:
+            raise ValueError("ENSEMBLE_MODELS пуст")
+        self.quorum = max(1, min(config.ENSEMBLE_QUORUM, len(self.members)))
+        self.deadline_sec = config.ENSEMBLE_DEADLINE_SEC
+        if config.FALLBACK_ENABLED and self.deadline_sec >= config.LLM_DEADLINE_SEC:
+            # GuardedPredictor бросит вызов по LLM_DEADLINE_SEC, а его единственный поток останется занят
+            # до нашего дедлайна — следующий цикл получил бы fallback "busy"
+            self.deadline_sec = 0.8 * config.LLM_DEADLINE_SEC
+            logger.warning(f"[Ensemble] ENSEMBLE_DEADLINE_SEC={config.ENSEMBLE_DEADLINE_SEC} не меньше "
+                           f"LLM_DEADLINE_SEC={config.LLM_DEADLINE_SEC} — ждём {self.deadline_sec:.1f} с")
+        self.ledger = LLMLedger(config.LLM_LEDGER_PATH)
+        # Запас потоков: опоздавшие запросы прошлого цикла не должны задерживать следующий
+        self._executor = ThreadPoolExecutor(max_workers=2 * len(self.members), thread_name_prefix="ensemble")
+        self._lock = threading.Lock()
+        self._stats = {m["model"]: {"calls": 0, "ok": 0, "errors": 0, "late": 0, "cancelled": 0,
+                                    "agree": 0, "compared": 0, "latency": deque(maxlen=LATENCY_WINDOW)}
+                       for m in self.members}
+        # Интерфейс истории для снимка live (ансамбль работает без истории диалога)
+        self.conversation_history = []
+        self.max_history_messages = 0
+        logger.info(f"[Ensemble] Модели: {', '.join(m['model'] for m in self.members)} | кворум {self.quorum}")
+
+    def prompt_hash(self):
+        return DeepSeekClient(self.config).prompt_hash()
+
+    def restore_history(self, history, prompt_hash):
+        return False
+
+    def _body_suffix(self, market_data_json):
+        """Общая часть тела запроса — сериализуется один раз на цикл, к ней дописывается только model"""
+        client = DeepSeekClient(self.config)
+        client._ensure_system_prompt()
+        user_content = payload_text(market_data_json)
+        payload = {
+            "messages": [client.system_prompt, {"role": "user", "content": user_content}],
+            "response_format": {"type": "json_object"},
+            "temperature": 0.1,
+            "max_tokens": 600
+        }
+        return json.dumps(payload, ensure_ascii=False, separators=(',', ':'))[1:].encode("utf-8")
+
+    def _call(self, member, suffix):
+        body = b'{"model":' + json.dumps(member["model"]).encode("utf-8") + b',' + suffix
+        start = time.time()
+        try:
+            response = requests.post(member["url"], data=body, timeout=self.deadline_sec, headers={
+                "Content-Type": "application/json", "Authorization": f"Bearer {member['api_key']}"})
+            latency = time.time() - start
+            response.raise_for_status()
+            data = response.json()
+            prediction = json.loads(data["choices"][0]["message"]["content"])
+            validate_prediction(prediction)
+        except Exception as e:
+            self.ledger.record(model=member["model"], status=type(e).__name__, attempt=1,
+                               latency_ms=round((time.time() - start) * 1000, 1), payload_bytes=len(body))
+            raise
+        usage = data.get("usage", {})
+        cache_hit, cache_miss = extract_cache_tokens(usage)
+        metrics.observe(f"ensemble_{member['model']}", latency)
+        self.ledger.record(
+            model=member["model"], status="ok", attempt=1, latency_ms=round(latency * 1000, 1),
+            prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"),
+            cache_hit_tokens=cache_hit, cache_miss_tokens=cache_miss, payload_bytes=len(body),
+            action=prediction["action"], confidence=prediction["confidence"]
+        )
+        return {**prediction, "_model": member["model"], "_latency": latency}
+
+    def _record(self, model, prediction=None, decision=None, late=False):
+        with self._lock:
+            s = self._stats[model]
+            if prediction is None:
+                s["errors"] += 1
+                return
+            s["ok"] += 1
+            s["late"] += late
+            s["latency"].append(prediction["_latency"])
+            if decision is not None:
+                s["compared"] += 1
+                s["agree"] += prediction["action"] == decision
+                metrics.set_gauge(f"ensemble_agreement_{model}", round(s["agree"] / s["compared"] * 100, 1))
+
+    def get_prediction(self, market_data_json):
+        started = time.perf_counter()
+        suffix = self._body_suffix(market_data_json)
+        futures = {}
+        for member in self.members:
+            futures[self._executor.submit(self._call, member, suffix)] = member["model"]
+            with self._lock:
+                self._stats[member["model"]]["calls"] += 1
+
+        votes = {}
+        answers = []
+        decision = None
+        pending = set(futures)
+        deadline = time.monotonic() + self.deadline_sec
+        while pending and decision is None:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break  # дедлайн ансамбля
+            for future in done:
+                try:
+                    prediction = future.result()
+                except Exception as e:
+                    logger.warning(f"[Ensemble] {futures[future]}: {e}")
+                    self._record(futures[future])
+                    continue
+                answers.append(prediction)
+                votes.setdefault(prediction["action"], []).append(prediction)
+                if decision is None and len(votes[prediction["action"]]) >= self.quorum:
+                    decision = prediction["action"]
+
+        # Опоздавшие: не ждём, но их ответ пойдёт в статистику согласия
+        final_action = decision or "HOLD"
+        for future in pending:
+            model = futures[future]
+            if future.cancel():
+                with self._lock:
+                    self._stats[model]["cancelled"] += 1
+                metrics.inc("ensemble_cancelled")
+            else:
+                future.add_done_callback(lambda f, m=model: self._record(
+                    m, None if f.exception() else f.result(), final_action, late=True))
+        for prediction in answers:
+            self._record(prediction["_model"], prediction, final_action)
+
+        wall = time.perf_counter() - started
+        metrics.observe("ensemble", wall)
+        if not answers:
+            metrics.inc("ensemble_failed")
+            raise RuntimeError("Ни одна модель ансамбля не ответила")
+        summary = ", ".join(f"{p['_model']}={p['action']}({p['_latency']:.2f}s)" for p in answers)
+        if decision is None:
+            metrics.inc("ensemble_no_quorum")
+            logger.info(f"[Ensemble] Нет кворума {self.quorum}: {summary} | {wall:.2f}s")
+            return {"action": "HOLD", "confidence": 0, "size": 0, "entry_price": 0.0, "stop_loss": 0.0,
+                    "take_profit": 0.0, "risk_percent": 0.0, "source": "ensemble",
+                    "message": f"[ensemble] HOLD: нет кворума ({summary})"}
+
+        metrics.inc("ensemble_quorum")
+        merged = merge_predictions(votes[decision][:self.quorum])
+        validate_prediction(merged)
+        logger.info(f"[Ensemble] {decision} кворумом {self.quorum}/{len(self.members)}: {summary} | {wall:.2f}s",
+                    extra={"stage": "llm", "latency": round(wall, 4)})
+        return merged
+
+    def stats(self):
+        """По модели: ответы, ошибки, опоздания, задержка p50/p90 и % согласия с итоговым решением"""
+        out = {}
+        with self._lock:
+            for model, s in self._stats.items():
+                latencies = sorted(s["latency"])
+                out[model] = {
+                    "calls": s["calls"], "ok": s["ok"], "errors": s["errors"], "late": s["late"],
+                    "cancelled": s["cancelled"],
+                    "latency_p50_ms": round(latencies[len(latencies) // 2] * 1000, 1) if latencies else None,
+                    "latency_p90_ms": round(latencies[int(len(latencies) * 0.9)] * 1000, 1) if latencies else None,
+                    "agreement_pct": round(s["agree"] / s["compared"] * 100, 1) if s["compared"] else None
+                }
+        return out
@@ -0,0 +1,226 @@
+"""Локальный прогноз по правилам системного промпта — когда LLM не успела или недоступна.
+
+Тот же формат, что проверяет DeepSeekClient._validate_prediction; confidence не выше
+Config.FALLBACK_CONFIDENCE, поэтому такой сигнал никогда не проходит порог алерта/сделки сам по себе.
+"""
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from DEEPCKAITRADE.config import Config
+from DEEPCKAITRADE.utils.logger import logger
+from DEEPCKAITRADE.utils.metrics import metrics
+
+
+def _hold(reason):
+    return {
+        "action": "HOLD", "confidence": 0, "size": 0, "entry_price": 0.0, "stop_loss": 0.0, "take_profit": 0.0,
+        "risk_percent": 0.0, "message": f"[fallback] HOLD: {reason}", "source": "fallback"
+    }
+
+
+def _direction_score(ind, patterns, side):
+    """Голоса за направление side (+1 BUY / -1 SELL) по семантическим признакам"""
+    bull = side > 0
+    trend = "bullish" if bull else "bearish"
+    rising = "rising" if bull else "falling"
+    score = 0
+    if ind["ema"]["trend_direction"] == trend:
+        score += 1
+    if ind["rsi"]["trend"] == rising and ind["obv"]["trend"] == rising:
+        score += 1
+    if ind["rsi"]["divergence"] == trend or ind["obv"]["divergence"] == trend:
+        score += 1
+    if ind["stochastic"]["crossover"].startswith(trend):
+        score += 1
+    if ind["rsi"]["oversold" if bull else "overbought"] == "true":
+        score += 1
+    if ind["rsi"]["overbought" if bull else "oversold"] == "true":
+        score -= 1
+    zone = "resistance" if bull else "support"  # цена упирается в зону против сделки
+    if any(s.startswith(zone) for s in patterns.get("support_resistance", [])):
+        score -= 1
+    return score
+
+
+def fallback_prediction(market_data_json, config=Config):
+    """Детерминированный прогноз за микросекунды: фильтры, SL/TP и размер — по формулам промпта"""
+    md = market_data_json["market_data"]
+    ind = md.get("indicators") or {}
+    if not ind:
+        return _hold("нет индикаторов")
+    risk, specs, costs = market_data_json["risk_params"], market_data_json["instrument_specs"], \
+        market_data_json["cost_structure"]
+    price = md["price_current"]
+    atr, atr_ma20 = ind["atr"]["current"], ind["atr"]["ma20"]
+
+    # 1. Предварительные фильтры
+    if not (atr > 0 and math.isfinite(atr_ma20)) or atr > risk["volatility_threshold"] * atr_ma20:
+        return _hold(f"волатильность ATR/ATR_MA20={atr}/{atr_ma20}")
+    if specs["avg_daily_volume"] and md["volume_current"] < 0.3 * specs["avg_daily_volume"]:
+        return _hold(f"низкий объём {md['volume_current']}")
+    position = next(iter((market_data_json.get("current_positions") or {}).values()), None)
+    if position and position.get("position_value_pct", 0) > risk["max_exposure_per_asset_pct"]:
+        return _hold(f"экспозиция {position['position_value_pct']}% > {risk['max_exposure_per_asset_pct']}%")
+
+    patterns = md.get("patterns") or {}
+    buy, sell = _direction_score(ind, patterns, 1), _direction_score(ind, patterns, -1)
+    side = 1 if buy >= 3 and buy > sell else -1 if sell >= 3 and sell > buy else 0
+    if not side:
+        return _hold(f"нет перевеса сигналов (BUY={buy}, SELL={sell})")
+    if position and position.get("direction") == ("short" if side > 0 else "long"):
+        return _hold("открыта противоположная позиция")
+
+    # 2. SL/TP
+    slippage, vwap = costs["max_slippage"], ind["vwap"]
+    candle = md["candle_current"]
+    offset = atr * ind["atr"]["multiplier"]
+    if side > 0:
+        stop_loss = min(candle["low"], vwap - offset) - slippage
+    else:
+        stop_loss = max(candle["high"], vwap + offset) + slippage
+    stop_distance = abs(price - stop_loss)
+    if stop_distance <= 0:
+        return _hold("не удалось рассчитать SL")
+    take_profit = price + side * stop_distance * risk["min_risk_reward"]
+
+    # 3. Размер позиции
+    equity = risk["account_equity"]
+    risk_per_share = stop_distance + costs["commission_per_share"] + slippage / 2
+    max_exposure = math.floor(equity * risk["max_exposure_per_asset_pct"] / 100 / price)
+    size = min(math.floor(equity * risk["max_risk_per_trade_pct"] / 100 / risk_per_share), max_exposure)
+    if size < specs["min_order_size"]:
+        return _hold(f"размер {size} меньше минимального лота")
+
+    score = max(buy, sell)
+    confidence = min(config.FALLBACK_CONFIDENCE, 20 + 6 * score)
+    action = "BUY" if side > 0 else "SELL"
+    return {
+        "action": action,
+        "confidence": confidence,
+        "size": int(size),
+        "entry_price": round(price, 4),
+        "stop_loss": round(stop_loss, 4),
+        "take_profit": round(take_profit, 4),
+        "risk_percent": round(size * risk_per_share / equity * 100, 2),
+        "message": f"[fallback] {action}: голосов {score} (BUY={buy}, SELL={sell}), ATR/ATR_MA20={atr}/{atr_ma20}, "
+                   f"RRR={risk['min_risk_reward']}",
+        "source": "fallback"
+    }
+
+
+class CircuitBreaker:
+    """closed → (failure_threshold ошибок подряд) → open на cooldown секунд → half-open: одна пробная попытка"""
+
+    def __init__(self, failure_threshold=3, cooldown_sec=60):
+        self.failure_threshold = failure_threshold
+        self.cooldown_sec = cooldown_sec
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "open" if time.monotonic() - self.opened_at < self.cooldown_sec else "half_open"
+
+    def allow(self):
+        return self.state != "open"
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+        metrics.set_gauge("llm_circuit_open", 0)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()  # half-open проба тоже упала — снова открываем
+                metrics.set_gauge("llm_circuit_open", 1)
+                logger.warning(f"[Fallback] Circuit open: {self.failures} ошибок LLM подряд, "
+                               f"пауза {self.cooldown_sec}s")
+
+
+class GuardedPredictor:
+    """LLM с дедлайном и circuit breaker; при промахе — fallback_prediction.
+
+    predict() возвращает (prediction, source), source: "llm" или "fallback:<причина>".
+    Вызов LLM идёт в отдельном потоке: по дедлайну цикл не ждёт, опоздавший ответ отбрасывается —
+    вместе с его репликами в conversation_history клиента (иначе следующий промпт видит ответ,
+    на который бот не действовал).
+    """
+
+    def __init__(self, client, config=Config):
+        self.client = client
+        self.config = config
+        self.deadline_sec = config.LLM_DEADLINE_SEC
+        self.breaker = CircuitBreaker(config.CIRCUIT_FAILURE_THRESHOLD, config.COOLDOWN_AFTER_FAILURE)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="llm")
+        self._inflight = None
+        self._call_lock = threading.Lock()
+
+    def _fallback(self, market_data_json, reason):
+        start = time.perf_counter()
+        prediction = fallback_prediction(market_data_json, self.config)
+        metrics.observe("fallback", time.perf_counter() - start)
+        metrics.inc("fallback_used")
+        metrics.inc(f"fallback_{reason}")
+        logger.warning(f"[Fallback] {reason}: {prediction['action']} ({prediction['confidence']}%)",
+                       extra={"stage": "fallback"})
+        return prediction, f"fallback:{reason}"
+
+    def _on_done(self, future):
+        # Опоздавший ответ тоже считается: успех закрывает breaker, ошибка — копит счётчик
+        if future.cancelled():
+            return
+        if future.exception() is None:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+
+    def _run(self, market_data_json, call):
+        """Вызов в потоке LLM; история брошенного по дедлайну вызова откатывается"""
+        try:
+            return self.client.get_prediction(market_data_json)
+        finally:
+            with self._call_lock:
+                call["finished"] = True
+                if call["abandoned"]:
+                    self._drop_history(call)
+
+    def _abandon(self, call):
+        with self._call_lock:
+            call["abandoned"] = True
+            if call["finished"]:  # ответ пришёл между таймаутом и этой строкой
+                self._drop_history(call)
+
+    def _drop_history(self, call):
+        if call["history"] is not None and len(call["history"]) > call["mark"]:
+            del call["history"][call["mark"]:]
+            metrics.inc("llm_history_dropped")
+
+    def predict(self, market_data_json):
+        if not self.breaker.allow():
+            return self._fallback(market_data_json, "circuit_open")
+        if self._inflight is not None and not self._inflight.done():
+            return self._fallback(market_data_json, "busy")  # прошлый запрос ещё висит — очередь не копим
+
+        history = getattr(self.client, "conversation_history", None)
+        call = {"history": history, "mark": len(history) if history is not None else 0,
+                "finished": False, "abandoned": False}
+        future = self._executor.submit(self._run, market_data_json, call)
+        future.add_done_callback(self._on_done)
+        self._inflight = future
+        try:
+            return future.result(timeout=self.deadline_sec), "llm"
+        except FutureTimeout:
+            self._abandon(call)
+            metrics.inc("llm_deadline_missed")
+            return self._fallback(market_data_json, "deadline")
+        except Exception as e:
+            logger.error(f"[Fallback] LLM недоступна: {e}")
+            return self._fallback(market_data_json, "error")
@@ -0,0 +1,219 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import ta
+from ta.trend import EMAIndicator
+from ta.momentum import RSIIndicator, StochasticOscillator
+from ta.volatility import AverageTrueRange, BollingerBands
+from ta.volume import OnBalanceVolumeIndicator
+
+from DEEPCKAITRADE.config import Config
+from DEEPCKAITRADE.modules import indicators as indicators_module
+from DEEPCKAITRADE.modules.indicators import determine_bb_position
+from DEEPCKAITRADE.modules.swing_index import SwingIndex
+from DEEPCKAITRADE.utils.logger import logger
+
+# Параметры индикаторов — входят в версию хранилища
+FEATURE_PARAMS = {
+    "ema_fast": 9, "ema_slow": 21, "rsi": 14, "stoch": 14, "stoch_smooth": 3,
+    "atr": 14, "atr_ma": 20, "bb": 20, "bb_dev": 2, "vwap_window": 288, "min_candles": 50
+}
+CANDLE_COLUMNS = ("open", "high", "low", "close", "volume")
+FEATURE_COLUMNS = CANDLE_COLUMNS + (
+    "ema_fast", "ema_slow", "rsi", "stoch_k", "stoch_d", "atr", "atr_ma20",
+    "bb_upper", "bb_lower", "bb_wband", "vwap", "obv"
+)
+
+
+def feature_version():
+    """Хэш параметров + исходников расчёта: любое изменение кода или параметров инвалидирует кэш"""
+    digest = hashlib.sha1(json.dumps(FEATURE_PARAMS, sort_keys=True).encode())
+    digest.update(ta.__version__.encode() if hasattr(ta, "__version__") else b"")
+    for path in (indicators_module.__file__, __file__):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def compute_features(df):
+    """Все индикаторы по всей истории за один проход (все они причинные: значение в i зависит только от [0, i])"""
+    p = FEATURE_PARAMS
+    close, high, low, volume = df['close'], df['high'], df['low'], df['volume']
+    stoch = StochasticOscillator(high=high, low=low, close=close, window=p["stoch"], smooth_window=p["stoch_smooth"])
+    atr = AverageTrueRange(high=high, low=low, close=close, window=p["atr"]).average_true_range()
+    bb = BollingerBands(close=close, window=p["bb"], window_dev=p["bb_dev"])
+
+    # VWAP по последним vwap_window свечам (как calculate_vwap на tail(288))
+    typical_volume = (high + low + close) / 3 * volume
+    tpv_sum = typical_volume.rolling(p["vwap_window"], min_periods=1).sum()
+    vol_sum = volume.rolling(p["vwap_window"], min_periods=1).sum()
+    vwap = np.where(vol_sum.to_numpy() == 0, close.to_numpy(), (tpv_sum / vol_sum.where(vol_sum != 0)).to_numpy())
+
+    columns = {
+        "ema_fast": EMAIndicator(close=close, window=p["ema_fast"]).ema_indicator(),
+        "ema_slow": EMAIndicator(close=close, window=p["ema_slow"]).ema_indicator(),
+        "rsi": RSIIndicator(close=close, window=p["rsi"]).rsi(),
+        "stoch_k": stoch.stoch(),
+        "stoch_d": stoch.stoch_signal(),
+        "atr": atr,
+        "atr_ma20": atr.rolling(p["atr_ma"]).mean(),
+        "bb_upper": bb.bollinger_hband(),
+        "bb_lower": bb.bollinger_lband(),
+        "bb_wband": bb.bollinger_wband(),
+        "vwap": vwap,
+        "obv": OnBalanceVolumeIndicator(close=close, volume=volume).on_balance_volume(),
+    }
+    # Свечи — как есть (float64 / int64): цены попадают в промпт, валидатор и симулятор и должны совпадать
+    # с live до последнего знака; float32 дал бы 257.9800109863281 и испортил объёмы > 2**24.
+    # Сжимаются только производные индикаторы — их округляют до 1–2 знаков
+    features = {name: np.asarray(df[name], dtype=np.float64) for name in CANDLE_COLUMNS[:-1]}
+    features["volume"] = np.asarray(df['volume'], dtype=np.int64)
+    features.update({name: np.asarray(values, dtype=np.float32) for name, values in columns.items()})
+    features["time"] = pd.DatetimeIndex(df['time']).as_unit("ns").asi8
+    return features
+
+
+def sync_features(swing_index, features, idx):
+    """Догоняет SwingIndex до свечи idx-1: текущая свеча в индекс не подаётся, как и в live"""
+    swing_index = swing_index if swing_index is not None else SwingIndex()
+    return swing_index.sync(features["time"], features["high"], features["low"],
+                            {"rsi": features["rsi"], "obv": features["obv"]}, features["atr"], upto=idx - 1)
+
+
+def indicators_at(features, idx, swing_index=None):
+    """Словарь индикаторов в формате calculate_indicators для свечи idx — без пересчёта истории"""
+    if idx + 1 < FEATURE_PARAMS["min_candles"]:
+        return {}
+    f, i = features, idx
+    swings = sync_features(swing_index, features, idx)
+    ema_fast, ema_slow, rsi, k, d, obv = f["ema_fast"], f["ema_slow"], f["rsi"], f["stoch_k"], f["stoch_d"], f["obv"]
+
+    if k[i - 1] <= d[i - 1] and k[i] > d[i]:
+        crossover_type = "bullish_k_above_d"
+    elif k[i - 1] >= d[i - 1] and k[i] < d[i]:
+        crossover_type = "bearish_k_below_d"
+    else:
+        crossover_type = "none"
+    crossover = (ema_fast[i - 1] <= ema_slow[i - 1]) and (ema_fast[i] > ema_slow[i])
+    rsi_now = float(rsi[i])
+
+    return {
+        "ema": {
+            "fast": round(float(ema_fast[i]), 2),
+            "slow": round(float(ema_slow[i]), 2),
+            "trend_direction": "bullish" if ema_fast[i] > ema_slow[i] else "bearish",
+            "crossover_active": str(bool(crossover)).lower()
+        },
+        "rsi": {
+            "current": round(rsi_now, 1),
+            "trend": "rising" if rsi[i] > rsi[i - 2] else "falling",
+            "divergence": swings.divergence("rsi"),
+            "overbought": str(rsi_now > 70).lower(),
+            "oversold": str(rsi_now < 30).lower()
+        },
+        "stochastic": {
+            "k": round(float(k[i]), 1),
+            "d": round(float(d[i]), 1),
+            "overbought": str(bool(k[i] > 80)).lower(),
+            "oversold": str(bool(k[i] < 20)).lower(),
+            "crossover": crossover_type
+        },
+        "bollinger": {
+            "upper": round(float(f["bb_upper"][i]), 2),
+            "lower": round(float(f["bb_lower"][i]), 2),
+            "bandwidth": round(float(f["bb_wband"][i]), 2),
+            "price_position": determine_bb_position(f["close"][i], f["bb_upper"][i], f["bb_lower"][i])
+        },
+        "atr": {
+            "current": round(float(f["atr"][i]), 2),
+            "ma20": round(float(f["atr_ma20"][i]), 2),
+            "multiplier": 1.2
+        },
+        "vwap": round(float(f["vwap"][i]), 2),
+        "obv": {
+            "trend": "rising" if obv[i] > obv[i - 2] else "falling",
+            "divergence": swings.divergence("obv")
+        }
+    }
+
+
+def features_to_frame(features):
+    """Свечи + ATR как DataFrame для валидатора/паттернов (цены float64, объём int64 — без потерь)"""
+    df = pd.DataFrame({name: np.asarray(features[name]) for name in CANDLE_COLUMNS})
+    df['atr'] = np.asarray(features["atr"], dtype=np.float64)
+    df.insert(0, 'time', pd.to_datetime(np.asarray(features["time"]), utc=True))
+    return df
+
+
+class FeatureStore:
+    """Колоночное хранилище признаков: {root}/{figi}/{interval}/{version}/{start_ns}_{end_ns}/{column}.npy"""
+
+    def __init__(self, root=None):
+        self.root = root or Config.FEATURE_STORE_DIR
+        self.version = feature_version()
+
+    def _series_dir(self, figi, interval):
+        return os.path.join(self.root, figi, interval)
+
+    def _find_segment(self, figi, interval, start_ns, end_ns):
+        version_dir = os.path.join(self._series_dir(figi, interval), self.version)
+        if not os.path.isdir(version_dir):
+            return None
+        for name in os.listdir(version_dir):
+            if ".tmp" in name:
+                continue  # каталог, который сейчас пишет другой процесс (шард) — до os.replace он не сегмент
+            manifest_path = os.path.join(version_dir, name, "manifest.json")
+            if not os.path.exists(manifest_path):
+                continue  # сегмент ещё пишется или запись прервалась
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest["start_ns"] <= start_ns and manifest["end_ns"] >= end_ns:
+                return os.path.join(version_dir, name)
+        return None
+
+    def load(self, figi, interval, start, end):
+        """Признаки за [start, end) через memory-map или None, если в кэше нет такого диапазона"""
+        start_ns, end_ns = pd.Timestamp(start).value, pd.Timestamp(end).value
+        segment = self._find_segment(figi, interval, start_ns, end_ns)
+        if segment is None:
+            return None
+        times = np.load(os.path.join(segment, "time.npy"), mmap_mode="r")
+        lo, hi = np.searchsorted(times, [start_ns, end_ns])
+        return {name: np.load(os.path.join(segment, f"{name}.npy"), mmap_mode="r")[lo:hi]
+                for name in FEATURE_COLUMNS + ("time",)}
+
+    def save(self, figi, interval, start, end, features):
+        series_dir = self._series_dir(figi, interval)
+        # Старые версии больше не совпадут с кодом — удаляем
+        if os.path.isdir(series_dir):
+            for name in os.listdir(series_dir):
+                if name != self.version:
+                    shutil.rmtree(os.path.join(series_dir, name), ignore_errors=True)
+        start_ns, end_ns = pd.Timestamp(start).value, pd.Timestamp(end).value
+        segment = os.path.join(series_dir, self.version, f"{start_ns}_{end_ns}")
+        tmp = f"{segment}.tmp{os.getpid()}"
+        os.makedirs(tmp, exist_ok=True)
+        for name, values in features.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(values))
+        with open(os.path.join(tmp, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "params": FEATURE_PARAMS, "figi": figi, "interval": interval,
+                       "start_ns": start_ns, "end_ns": end_ns, "rows": int(len(features["time"]))}, f, indent=2)
+        shutil.rmtree(segment, ignore_errors=True)
+        os.replace(tmp, segment)
+        return segment
+
+    def load_or_build(self, figi, interval, start, end, fetch_candles):
+        """fetch_candles(start, end) -> DataFrame свечей; вызывается только при промахе кэша"""
+        features = self.load(figi, interval, start, end)
+        if features is not None:
+            logger.info(f"[Features] Кэш {figi}/{interval} v{self.version}: {len(features['time'])} свечей")
+            return features
+        df = fetch_candles(start, end)
+        features = compute_features(df)
+        segment = self.save(figi, interval, start, end, features)
+        logger.info(f"[Features] Рассчитано и сохранено {len(df)} свечей → {segment}")
+        return self.load(figi, interval, start, end)
@@ -4,10 +4,12 @@ from ta.trend import EMAIndicator
 from ta.momentum import RSIIndicator, StochasticOscillator
 from ta.volatility import AverageTrueRange, BollingerBands
 from ta.volume import OnBalanceVolumeIndicator
+from DEEPCKAITRADE.modules.swing_index import sync_frame
 from DEEPCKAITRADE.utils.logger import logger
 
 
-def calculate_indicators(df):
+def calculate_indicators(df, swing_index=None):
+    """swing_index — постоянный SwingIndex (live/бэктест): дивергенции берутся из него инкрементально"""
     if len(df) < 50:
         logger.warning("[Indicators] Недостаточно данных для расчёта")
         return {}
@@ -22,7 +24,6 @@ def calculate_indicators(df):
         # RSI
         rsi = RSIIndicator(close=df['close'], window=14).rsi()
         rsi_trend = "rising" if rsi.iloc[-1] > rsi.iloc[-3] else "falling"
-        divergence = detect_divergence(df, rsi)
 
         # Stochastic
         stoch = StochasticOscillator(high=df['high'], low=df['low'], close=df['close'], window=14, smooth_window=3)
@@ -47,7 +48,11 @@ def calculate_indicators(df):
         # OBV
         obv = OnBalanceVolumeIndicator(close=df['close'], volume=df['volume']).on_balance_volume()
         obv_trend = "rising" if obv.iloc[-1] > obv.iloc[-3] else "falling"
-        obv_divergence = detect_obv_divergence(df, obv)
+
+        # Дивергенции — по двум последним swing-точкам индекса, без сканирования окон
+        swings = sync_frame(swing_index, df, {"rsi": rsi, "obv": obv}, atr)
+        divergence = swings.divergence("rsi")
+        obv_divergence = swings.divergence("obv")
 
         return {
             "ema": {
@@ -92,29 +97,9 @@ def calculate_indicators(df):
         return {}
 
 
-# Улучшенные функции дивергенций (более точные)
-def detect_divergence(df, indicator, lookback=10):
-    if len(df) < lookback * 2:
-        return "none"
-
-    # Находим swing lows/highs (упрощённо, но лучше оригинала)
-    price_lows = df['low'].rolling(window=5, center=True).min()
-    ind_lows = indicator.rolling(window=5, center=True).min()
-
-    recent_price_low = df['low'].iloc[-lookback:].min()
-    recent_ind_low = indicator.iloc[-lookback:].min()
-
-    prev_price_low = df['low'].iloc[-lookback * 2:-lookback].min()
-    prev_ind_low = indicator.iloc[-lookback * 2:-lookback].min()
-
-    # Bullish divergence
-    if recent_price_low < prev_price_low and recent_ind_low > prev_ind_low:
-        return "bullish"
-    # Bearish
-    if df['high'].iloc[-lookback:].max() > df['high'].iloc[
-        -lookback * 2:-lookback].max() and recent_ind_low < prev_ind_low:
-        return "bearish"
-    return "none"
+# Дивергенции по swing-точкам (modules/swing_index.py)
+def detect_divergence(df, indicator):
+    return sync_frame(None, df, {"value": indicator}).divergence("value")
 
 
 # Остальные функции без изменений (detect_stochastic_crossover, determine_bb_position, calculate_vwap, detect_obv_divergence)
@@ -153,18 +138,6 @@ def calculate_vwap(df):
     return float(vwap.iloc[-1]) if not cum_vol.iloc[-1] == 0 else float(df_session['close'].iloc[-1])
 
 
-def detect_obv_divergence(df, obv, lookback=10):
+def detect_obv_divergence(df, obv):
     # Аналогично RSI
-    if len(df) < lookback * 2:
-        return "none"
-    recent_price_low = df['low'].iloc[-lookback:].min()
-    prev_price_low = df['low'].iloc[-lookback * 2:-lookback].min()
-    recent_obv_low = obv.iloc[-lookback:].min()
-    prev_obv_low = obv.iloc[-lookback * 2:-lookback].min()
-
-    if recent_price_low < prev_price_low and recent_obv_low > prev_obv_low:
-        return "bullish"
-    if df['high'].iloc[-lookback:].max() > df['high'].iloc[
-        -lookback * 2:-lookback].max() and recent_obv_low < prev_obv_low:
-        return "bearish"
-    return "none"
\ No newline at end of file
+    return detect_divergence(df, obv)
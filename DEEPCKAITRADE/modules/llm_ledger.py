@@ -0,0 +1,166 @@
+import argparse
+import csv
+import os
+import statistics
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from DEEPCKAITRADE.config import Config
+from DEEPCKAITRADE.utils.logger import logger
+
+# Порядок колонок фиксирован — файл дописывается строками, заголовок один раз
+LEDGER_FIELDS = [
+    "ts", "model", "status", "attempt", "latency_ms",
+    "prompt_tokens", "completion_tokens", "cache_hit_tokens", "cache_miss_tokens",
+    "history_messages", "payload_bytes", "action", "confidence", "batch_size"
+]
+
+
+def extract_cache_tokens(usage):
+    """Кэш-токены провайдера: DeepSeek (prompt_cache_*) или OpenAI-совместимый формат"""
+    hit = usage.get("prompt_cache_hit_tokens")
+    miss = usage.get("prompt_cache_miss_tokens")
+    if hit is None:
+        details = usage.get("prompt_tokens_details") or {}
+        hit = details.get("cached_tokens")
+        if hit is not None and usage.get("prompt_tokens") is not None:
+            miss = usage["prompt_tokens"] - hit
+    return hit, miss
+
+
+class LLMLedger:
+    """Построчный CSV-журнал вызовов LLM (одна строка на попытку)"""
+
+    def __init__(self, path=None):
+        self.path = path or Config.LLM_LEDGER_PATH
+        self._lock = threading.Lock()
+
+    def record(self, **fields):
+        row = {name: fields.get(name, "") for name in LEDGER_FIELDS}
+        if not row["ts"]:
+            row["ts"] = round(time.time(), 3)
+        row = {k: ("" if v is None else v) for k, v in row.items()}
+        try:
+            with self._lock:
+                is_new = not os.path.exists(self.path)
+                if is_new:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a", newline="", encoding="utf-8") as f:
+                    writer = csv.DictWriter(f, fieldnames=LEDGER_FIELDS)
+                    if is_new:
+                        writer.writeheader()
+                    writer.writerow(row)
+        except OSError as e:
+            logger.error(f"[Ledger] Ошибка записи: {e}")
+
+
+def load_ledger(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def _num(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def _per_decision(pairs):
+    """[(токены запроса, решений в запросе), ...] → токенов на решение"""
+    decisions = sum(n for _, n in pairs)
+    return sum(v for v, _ in pairs) / decisions if decisions else None
+
+
+def summarize(rows):
+    """Сводка по набору строк журнала"""
+    ok = [r for r in rows if r["status"] == "ok"]
+    # Пакетный запрос (batch_size > 1) — несколько решений; токены считаем на решение, не на запрос
+    sizes = [int(_num(r.get("batch_size")) or 1) for r in ok]
+    latencies = [v for v in (_num(r["latency_ms"]) for r in ok) if v is not None]
+    prompt = [(v, n) for v, n in zip((_num(r["prompt_tokens"]) for r in ok), sizes) if v is not None]
+    completion = [(v, n) for v, n in zip((_num(r["completion_tokens"]) for r in ok), sizes) if v is not None]
+    hits = [v for v in (_num(r["cache_hit_tokens"]) for r in ok) if v is not None]
+    hit_prompt = [_num(r["prompt_tokens"]) or 0 for r in ok if _num(r["cache_hit_tokens"]) is not None]
+    payload = [v for v in (_num(r["payload_bytes"]) for r in ok) if v is not None]
+    retries = sum(1 for r in rows if (_num(r["attempt"]) or 1) > 1)
+
+    return {
+        "calls": len(rows),
+        "decisions": sum(sizes),
+        "errors": len(rows) - len(ok),
+        "retries": retries,
+        "latency_p50_ms": _percentile(latencies, 50),
+        "latency_p90_ms": _percentile(latencies, 90),
+        "latency_p99_ms": _percentile(latencies, 99),
+        "prompt_tokens_per_decision": _per_decision(prompt),
+        "completion_tokens_per_decision": _per_decision(completion),
+        "payload_kb_avg": statistics.mean(payload) / 1024 if payload else None,
+        "cache_hit_ratio": (sum(hits) / sum(hit_prompt)) if hits and sum(hit_prompt) else None
+    }
+
+
+def bucketize(rows, bucket="hour"):
+    fmt = {"hour": "%Y-%m-%d %H:00", "day": "%Y-%m-%d"}[bucket]
+    buckets = OrderedDict()
+    for r in sorted(rows, key=lambda r: _num(r["ts"]) or 0):
+        key = datetime.fromtimestamp(_num(r["ts"]) or 0, tz=timezone.utc).strftime(fmt)
+        buckets.setdefault(key, []).append(r)
+    return buckets
+
+
+def _fmt(value, digits=1):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.{digits}f}"
+    return str(value)
+
+
+def print_report(rows, bucket="hour"):
+    total = summarize(rows)
+    print("=" * 60)
+    print("LLM LEDGER")
+    for key, value in total.items():
+        print(f"{key:32s} {_fmt(value, 3 if key == 'cache_hit_ratio' else 1)}")
+    print("=" * 60)
+    header = f"{'bucket':18s} {'calls':>6s} {'p50ms':>8s} {'p90ms':>8s} {'prompt':>8s} {'compl':>7s} {'cache%':>7s}"
+    print(header)
+    for key, bucket_rows in bucketize(rows, bucket).items():
+        s = summarize(bucket_rows)
+        ratio = s["cache_hit_ratio"] * 100 if s["cache_hit_ratio"] is not None else None
+        print(f"{key:18s} {s['calls']:>6d} {_fmt(s['latency_p50_ms']):>8s} {_fmt(s['latency_p90_ms']):>8s} "
+              f"{_fmt(s['prompt_tokens_per_decision'], 0):>8s} {_fmt(s['completion_tokens_per_decision'], 0):>7s} "
+              f"{_fmt(ratio):>7s}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Отчёт по журналу вызовов LLM")
+    parser.add_argument("--path", default=Config.LLM_LEDGER_PATH)
+    parser.add_argument("--bucket", choices=["hour", "day"], default="hour")
+    parser.add_argument("--since", help="YYYY-MM-DD (UTC)")
+    parser.add_argument("--model", help="Фильтр по модели")
+    args = parser.parse_args(argv)
+
+    rows = load_ledger(args.path)
+    if args.since:
+        since = datetime.strptime(args.since, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()
+        rows = [r for r in rows if (_num(r["ts"]) or 0) >= since]
+    if args.model:
+        rows = [r for r in rows if r["model"] == args.model]
+    print_report(rows, args.bucket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+CANDLESTICK_PATTERNS = (
+    "doji", "dragonfly_doji", "gravestone_doji",
+    "hammer", "hanging_man", "inverted_hammer", "shooting_star",
+    "bullish_engulfing", "bearish_engulfing", "bullish_harami", "bearish_harami",
+    "piercing_line", "dark_cloud_cover", "morning_star", "evening_star",
+    "three_white_soldiers", "three_black_crows", "bullish_marubozu", "bearish_marubozu",
+    "tweezer_bottom", "tweezer_top",
+)
+PRICE_ACTION_PATTERNS = (
+    "inside_bar", "outside_bar", "gap_up", "gap_down",
+    "higher_high_higher_low", "lower_high_lower_low", "breakout_high_20", "breakdown_low_20",
+)
+BREAKOUT_WINDOW = 20
+TREND_LOOKBACK = 5
+# Сколько свечей нужно, чтобы маски на последней свече были такими же, как на всей истории
+PATTERN_LOOKBACK = BREAKOUT_WINDOW + TREND_LOOKBACK + 2
+
+
+def _shift(values, k):
+    out = np.full(len(values), np.nan)
+    if k < len(values):
+        out[k:] = values[:len(values) - k]
+    return out
+
+
+def _rolling_prev(values, window, func):
+    """func по предыдущим window значениям (без текущего), NaN в начале"""
+    out = np.full(len(values), np.nan)
+    if len(values) > window:
+        out[window:] = func(sliding_window_view(values, window)[:-1], axis=1)
+    return out
+
+
+def scan_patterns(open_, high, low, close):
+    """Все паттерны как булевы маски по всей серии: {name: np.ndarray[bool]}"""
+    o, h, l, c = (np.asarray(a, dtype=np.float64) for a in (open_, high, low, close))
+    with np.errstate(invalid="ignore"):
+        body = np.abs(c - o)
+        rng = np.where(h > l, h - l, np.nan)
+        upper = h - np.maximum(o, c)
+        lower = np.minimum(o, c) - l
+        bull, bear = c > o, c < o
+
+        o1, h1, l1, c1 = _shift(o, 1), _shift(h, 1), _shift(l, 1), _shift(c, 1)
+        o2, c2 = _shift(o, 2), _shift(c, 2)
+        body1, body2 = np.abs(c1 - o1), np.abs(c2 - o2)
+        rng2 = _shift(rng, 2)
+        bull1, bear1 = c1 > o1, c1 < o1
+        bull2, bear2 = c2 > o2, c2 < o2
+        mid1, mid2 = (o1 + c1) / 2, (o2 + c2) / 2
+
+        # Контекст тренда: закрытие предыдущей свечи против закрытия TREND_LOOKBACK свечей назад
+        prior_up = c1 > _shift(c, TREND_LOOKBACK + 1)
+        prior_down = c1 < _shift(c, TREND_LOOKBACK + 1)
+
+        doji = body <= 0.1 * rng
+        long_lower = (lower >= 2 * body) & (upper <= 0.25 * rng) & (body > 0)
+        long_upper = (upper >= 2 * body) & (lower <= 0.25 * rng) & (body > 0)
+        marubozu = body >= 0.9 * rng
+        tweezer_tol = 0.1 * np.fmax(rng, _shift(rng, 1))
+
+        masks = {
+            "doji": doji,
+            "dragonfly_doji": doji & (upper <= 0.1 * rng) & (lower >= 0.6 * rng),
+            "gravestone_doji": doji & (lower <= 0.1 * rng) & (upper >= 0.6 * rng),
+            "hammer": long_lower & prior_down,
+            "hanging_man": long_lower & prior_up,
+            "inverted_hammer": long_upper & prior_down,
+            "shooting_star": long_upper & prior_up,
+            "bullish_engulfing": bull & bear1 & (o < c1) & (c > o1),
+            "bearish_engulfing": bear & bull1 & (o > c1) & (c < o1),
+            "bullish_harami": bull & bear1 & (o > c1) & (c < o1),
+            "bearish_harami": bear & bull1 & (o < c1) & (c > o1),
+            "piercing_line": bull & bear1 & (o < c1) & (c > mid1) & (c < o1),
+            "dark_cloud_cover": bear & bull1 & (o > c1) & (c < mid1) & (c > o1),
+            "morning_star": bear2 & (body2 >= 0.6 * rng2) & (body1 <= 0.3 * body2) & bull & (c > mid2),
+            "evening_star": bull2 & (body2 >= 0.6 * rng2) & (body1 <= 0.3 * body2) & bear & (c < mid2),
+            "three_white_soldiers": bull & bull1 & bull2 & (c > c1) & (c1 > c2)
+                                    & (o >= o1) & (o <= c1) & (o1 >= o2) & (o1 <= c2),
+            "three_black_crows": bear & bear1 & bear2 & (c < c1) & (c1 < c2)
+                                 & (o <= o1) & (o >= c1) & (o1 <= o2) & (o1 >= c2),
+            "bullish_marubozu": marubozu & bull,
+            "bearish_marubozu": marubozu & bear,
+            "tweezer_bottom": bear1 & bull & (np.abs(l - l1) <= tweezer_tol) & prior_down,
+            "tweezer_top": bull1 & bear & (np.abs(h - h1) <= tweezer_tol) & prior_up,
+
+            "inside_bar": (h < h1) & (l > l1),
+            "outside_bar": (h > h1) & (l < l1),
+            "gap_up": l > h1,
+            "gap_down": h < l1,
+            "higher_high_higher_low": (h > h1) & (l > l1),
+            "lower_high_lower_low": (h < h1) & (l < l1),
+            "breakout_high_20": c > _rolling_prev(h, BREAKOUT_WINDOW, np.max),
+            "breakdown_low_20": c < _rolling_prev(l, BREAKOUT_WINDOW, np.min),
+        }
+    return masks
+
+
+def build_patterns(masks, idx, indicators, high, low, atr=None, zones=()):
+    """Словарь patterns для промпта по строке idx (idx=-1 — последняя свеча).
+
+    zones — касания зон S/R из SwingIndex.zones_at: [("support"|"resistance", price, touches)]
+    """
+    patterns = {
+        "candlestick": [name for name in CANDLESTICK_PATTERNS if masks[name][idx]],
+        "support_resistance": [],
+        "price_action": [name for name in PRICE_ACTION_PATTERNS if masks[name][idx]],
+    }
+
+    # Тест полос Боллинджера: допуск — доля ATR, а не абсолютные 0.1
+    bollinger = indicators.get("bollinger") if indicators else None
+    if bollinger:
+        atr = atr if atr is not None and np.isfinite(atr) and atr > 0 else (indicators.get("atr") or {}).get("current")
+        tolerance = 0.1 * atr if atr else 0.1
+        if abs(bollinger["upper"] - high) < tolerance:
+            patterns["support_resistance"].append(f"resistance_{bollinger['upper']:.2f}_tested")
+        if abs(low - bollinger["lower"]) < tolerance:
+            patterns["support_resistance"].append(f"support_{bollinger['lower']:.2f}_tested")
+    for kind, price, touches in zones:
+        patterns["support_resistance"].append(f"{kind}_zone_{price:.2f}_touches_{touches}")
+    return patterns
+
+
+def scan_last(df, indicators, swing_index=None):
+    """Live: паттерны последней свечи по короткому хвосту истории"""
+    tail = df.iloc[-PATTERN_LOOKBACK:]
+    masks = scan_patterns(tail['open'].to_numpy(), tail['high'].to_numpy(), tail['low'].to_numpy(),
+                          tail['close'].to_numpy())
+    last = tail.iloc[-1]
+    zones = swing_index.zones_at(float(last['open']), float(last['high']), float(last['low']), float(last['close']),
+                                 (indicators.get("atr") or {}).get("current")) if swing_index is not None else ()
+    return build_patterns(masks, -1, indicators, float(last['high']), float(last['low']), zones=zones)
@@ -0,0 +1,114 @@
+"""Сборка market_data для промпта: последняя свеча одним чтением, статичные секции — готовыми байтами.
+
+JSON собирается один раз за цикл (MarketPayload.encoded) и переиспользуется промптом (api_client,
+ensemble, пакетный запрос) и записью на диск (market_data_*.json, PredictionHandler). Порядок ключей
+и байты совпадают с json.dumps(data, separators=(',', ':')) — промпт и кэш провайдера не меняются.
+"""
+import json
+
+CANDLE_COLUMNS = ("open", "high", "low", "close", "volume")
+
+
+def encode(obj):
+    """Компактный JSON в UTF-8 — тот же формат, что уходит в промпт"""
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode("utf-8")
+
+
+def payload_text(market_data):
+    """Текст для промпта: готовый JSON из MarketPayload или сериализация обычного dict"""
+    encoded = getattr(market_data, "encoded", None)
+    if encoded is not None:
+        return encoded.decode("utf-8")
+    return json.dumps(market_data, ensure_ascii=False, separators=(',', ':'))
+
+
+def payload_bytes(market_data):
+    encoded = getattr(market_data, "encoded", None)
+    return encoded if encoded is not None else encode(market_data)
+
+
+def last_candle(df):
+    """(open, high, low, close, volume) последней свечи: одна строка вместо пяти df[col].iloc[-1]"""
+    row = df.iloc[-1].to_numpy()
+    columns = df.columns
+    o, h, l, c, v = (row[columns.get_loc(name)] for name in CANDLE_COLUMNS)
+    return float(o), float(h), float(l), float(c), int(v)
+
+
+class MarketPayload(dict):
+    """market_data как dict (fallback, исполнение, алерты) + его компактный JSON в encoded.
+    После сборки не изменяется — иначе encoded разойдётся с содержимым"""
+    __slots__ = ("encoded",)
+
+
+class PayloadBuilder:
+    """Статичные секции (лимиты риска, издержки, спецификация инструмента) кодируются один раз"""
+
+    def __init__(self, config):
+        self.config = config
+        self.risk_limits = {
+            "max_risk_per_trade_pct": config.RISK_PER_TRADE_PCT,
+            "max_exposure_per_asset_pct": config.MAX_EXPOSURE_PCT,
+            "min_risk_reward": config.MIN_RISK_REWARD,
+            "volatility_threshold": config.VOLATILITY_THRESHOLD
+        }
+        self.cost_structure = {
+            "commission_per_share": config.COMMISSION_PER_SHARE,
+            "fixed_commission": config.FIXED_COMMISSION,
+            "max_slippage": config.MAX_SLIPPAGE
+        }
+        # b',"max_risk_per_trade_pct":1.0,...}' — дописывается после account_equity
+        self._risk_tail = b',' + encode(self.risk_limits)[1:]
+        self._cost_tail = b',"cost_structure":' + encode(self.cost_structure) + b'}'
+        self._specs = None
+        self._specs_head = b''
+
+    def _specs_prefix(self, specs):
+        """b'{"symbol":...,"min_order_size":1,"avg_daily_volume":' — пересобирается, только если спецификация сменилась"""
+        if specs != self._specs:
+            head = encode(specs)[:-1]
+            self._specs = dict(specs)
+            self._specs_head = head + (b',' if specs else b'') + b'"avg_daily_volume":'
+        return self._specs_head
+
+    def build(self, df, timestamp, indicators, patterns, account_equity, instrument_specs, avg_daily_volume,
+              positions, multi_timeframe=None):
+        o, h, l, c, v = last_candle(df)
+        market = {
+            "price_current": c,
+            "candle_current": {"open": o, "high": h, "low": l, "close": c},
+            "volume_current": v,
+            "indicators": indicators,
+            "patterns": patterns
+        }
+        if multi_timeframe is not None:
+            market["multi_timeframe"] = multi_timeframe
+        account_equity = float(account_equity)
+
+        payload = MarketPayload(
+            timestamp=timestamp,
+            market_data=market,
+            risk_params={"account_equity": account_equity, **self.risk_limits},
+            instrument_specs={**instrument_specs, "avg_daily_volume": avg_daily_volume, "margin_requirement": 0},
+            current_positions=positions,
+            cost_structure=dict(self.cost_structure)
+        )
+        payload.encoded = b''.join((
+            b'{"timestamp":', encode(timestamp),
+            b',"market_data":', encode(market),
+            b',"risk_params":{"account_equity":', encode(account_equity), self._risk_tail,
+            b',"instrument_specs":', self._specs_prefix(instrument_specs), encode(avg_daily_volume),
+            b',"margin_requirement":0}',
+            b',"current_positions":', encode(positions),
+            self._cost_tail
+        ))
+        return payload
+
+
+def encode_batch(snapshots):
+    """{"batch":[{"id":0,...},...]} из готовых байтов снимков, без повторной сериализации"""
+    items = []
+    for i, snapshot in enumerate(snapshots):
+        body = payload_bytes(snapshot)
+        items.append(b'{"id":' + str(i).encode() + (b',' + body[1:] if len(body) > 2 else b'}'))
+    return b'{"batch":[' + b','.join(items) + b']}'
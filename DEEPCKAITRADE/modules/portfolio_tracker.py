@@ -1,4 +1,3 @@
-from tinkoff.invest import Client
 from DEEPCKAITRADE.config import Config
 from DEEPCKAITRADE.utils.logger import logger
 
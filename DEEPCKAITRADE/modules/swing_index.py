@@ -0,0 +1,164 @@
+from bisect import bisect_left, insort
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+SWING_K = 2                 # свеча — swing high/low, если она экстремум среди k соседей с каждой стороны
+DIVERGENCE_MAX_AGE = 30     # последний swing не старше N свечей
+DIVERGENCE_MAX_SPAN = 60    # и предыдущий — не дальше N свечей от него
+LEVEL_TOLERANCE_ATR = 0.25  # касания в пределах 0.25 ATR сливаются в одну зону
+LEVEL_MAX_AGE = 2000        # зоны без касаний дольше N свечей забываются
+STATELESS_TAIL = 200        # сколько свечей берём, когда индекс строится с нуля
+
+
+class PriceLevels:
+    """Отсортированные зоны поддержки/сопротивления из swing-точек"""
+
+    def __init__(self, max_age=LEVEL_MAX_AGE):
+        self.max_age = max_age
+        self.prices = []      # центры зон, по возрастанию
+        self._zones = {}      # center -> [touches, last_seq]
+        self._adds = 0
+
+    def add(self, price, seq, tolerance):
+        pos = bisect_left(self.prices, price)
+        best = None
+        for j in (pos - 1, pos):
+            if 0 <= j < len(self.prices) and abs(self.prices[j] - price) <= tolerance:
+                if best is None or abs(self.prices[j] - price) < abs(self.prices[best] - price):
+                    best = j
+        if best is None:
+            insort(self.prices, price)
+            self._zones[price] = [1, seq]
+        else:
+            center = self.prices.pop(best)
+            touches, _ = self._zones.pop(center)
+            new_center = (center * touches + price) / (touches + 1)
+            insort(self.prices, new_center)
+            self._zones[new_center] = [touches + 1, seq]
+        self._adds += 1
+        if self._adds % 256 == 0:
+            self.prune(seq)
+
+    def prune(self, seq):
+        stale = [p for p in self.prices if self._zones[p][1] < seq - self.max_age]
+        for p in stale:
+            self.prices.remove(p)
+            del self._zones[p]
+
+    def touches(self, price):
+        return self._zones[price][0]
+
+    def nearest(self, price, min_touches=2):
+        """(ближайшая поддержка ниже, ближайшее сопротивление выше) или None"""
+        pos = bisect_left(self.prices, price)
+        support = next((p for p in reversed(self.prices[:pos]) if self._zones[p][0] >= min_touches), None)
+        resistance = next((p for p in self.prices[pos:] if self._zones[p][0] >= min_touches), None)
+        return support, resistance
+
+    def tested(self, open_, high, low, close, tolerance, min_touches=3):
+        """Ближайшие к закрытию зоны, которых коснулась свеча: [("support"|"resistance", center, touches)]"""
+        lo = bisect_left(self.prices, low - tolerance)
+        hi = bisect_left(self.prices, high + tolerance)
+        body_top, body_bottom = max(open_, close), min(open_, close)
+        support = resistance = None
+        for p in self.prices[lo:hi]:
+            if self._zones[p][0] < min_touches:
+                continue
+            if p >= body_top and resistance is None:
+                resistance = p  # цены по возрастанию: первая — ближайшая сверху
+            elif p <= body_bottom:
+                support = p     # последняя — ближайшая снизу
+        return [(kind, p, self._zones[p][0]) for kind, p in (("support", support), ("resistance", resistance))
+                if p is not None]
+
+
+class SwingIndex:
+    """Инкрементальный индекс swing high/low и зон S/R.
+
+    Подаются только завершённые свечи (update/sync); swing подтверждается через k свечей.
+    Вместе с ценой хранятся значения индикаторов (rsi, obv) в точке swing — для дивергенций.
+    """
+
+    def __init__(self, k=SWING_K, max_swings=64):
+        self.k = k
+        self.highs = deque(maxlen=max_swings)  # (seq, price, values)
+        self.lows = deque(maxlen=max_swings)
+        self.levels = PriceLevels()
+        self._window = deque(maxlen=2 * k + 1)
+        self.seq = -1          # порядковый номер последней поданной свечи
+        self.last_time = None  # время последней поданной свечи (нс)
+
+    def update(self, high, low, values, atr=None, time_ns=None):
+        self.seq += 1
+        self.last_time = time_ns
+        self._window.append((self.seq, high, low, values, atr))
+        if len(self._window) < self._window.maxlen:
+            return
+        k = self.k
+        seq, mid_high, mid_low, mid_values, mid_atr = self._window[k]
+        highs = [w[1] for w in self._window]
+        lows = [w[2] for w in self._window]
+        tolerance = LEVEL_TOLERANCE_ATR * mid_atr if mid_atr and mid_atr > 0 else mid_high * 0.001
+        # Слева — строго, справа — нестрого: из равных вершин берём первую
+        if mid_high > max(highs[:k]) and mid_high >= max(highs[k + 1:]):
+            self.highs.append((seq, mid_high, mid_values))
+            self.levels.add(mid_high, seq, tolerance)
+        if mid_low < min(lows[:k]) and mid_low <= min(lows[k + 1:]):
+            self.lows.append((seq, mid_low, mid_values))
+            self.levels.add(mid_low, seq, tolerance)
+
+    def sync(self, times, high, low, values, atr=None, upto=None):
+        """Догоняет индекс до свечи upto (включительно) по массивам; при разрыве истории — перестраивает"""
+        upto = len(times) - 1 if upto is None else upto
+        if upto < 0:
+            return self
+        start = None
+        if self.last_time is not None:
+            start = int(np.searchsorted(times, self.last_time, side="right"))
+            if start == 0 or times[start - 1] != self.last_time:
+                self.__init__(self.k, self.highs.maxlen)  # история не стыкуется — начинаем заново
+                start = None
+        if start is None:
+            start = max(0, upto + 1 - STATELESS_TAIL)
+        for i in range(start, upto + 1):
+            self.update(float(high[i]), float(low[i]), {name: float(v[i]) for name, v in values.items()},
+                        float(atr[i]) if atr is not None else None, int(times[i]))
+        return self
+
+    def divergence(self, name, max_age=DIVERGENCE_MAX_AGE, max_span=DIVERGENCE_MAX_SPAN):
+        """bullish: цена — lower low, индикатор — higher low; bearish: higher high / lower high"""
+        candidates = []
+        if len(self.lows) >= 2:
+            (s1, p1, v1), (s2, p2, v2) = self.lows[-2], self.lows[-1]
+            if self.seq - s2 <= max_age and s2 - s1 <= max_span and p2 < p1 and v2[name] > v1[name]:
+                candidates.append((s2, "bullish"))
+        if len(self.highs) >= 2:
+            (s1, p1, v1), (s2, p2, v2) = self.highs[-2], self.highs[-1]
+            if self.seq - s2 <= max_age and s2 - s1 <= max_span and p2 > p1 and v2[name] < v1[name]:
+                candidates.append((s2, "bearish"))
+        return max(candidates)[1] if candidates else "none"
+
+    def zones_at(self, open_, high, low, close, atr=None):
+        """Зоны S/R, которых коснулась свеча (обычно текущая, ещё не поданная в индекс)"""
+        tolerance = LEVEL_TOLERANCE_ATR * atr if atr and atr > 0 else close * 0.001
+        return self.levels.tested(open_, high, low, close, tolerance)
+
+
+def frame_times_ns(df):
+    try:
+        return pd.DatetimeIndex(df['time']).as_unit("ns").asi8
+    except (KeyError, TypeError, ValueError):
+        return np.arange(len(df), dtype=np.int64)
+
+
+def sync_frame(swing_index, df, values, atr=None):
+    """Индекс по DataFrame свечей: подаются все строки, кроме последней (она может ещё формироваться).
+
+    swing_index=None — разовый индекс по хвосту STATELESS_TAIL свечей.
+    """
+    swing_index = swing_index if swing_index is not None else SwingIndex()
+    return swing_index.sync(frame_times_ns(df), df['high'].to_numpy(), df['low'].to_numpy(),
+                            {name: np.asarray(v, dtype=np.float64) for name, v in values.items()},
+                            None if atr is None else np.asarray(atr, dtype=np.float64), upto=len(df) - 2)
@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+
+from DEEPCKAITRADE.modules.indicators import calculate_indicators
+from DEEPCKAITRADE.modules.swing_index import SwingIndex
+
+MIN_BARS = 50  # меньше — calculate_indicators всё равно вернёт {}
+OHLCV = ("open", "high", "low", "close", "volume")
+
+
+def aggregate_rows(times, o, h, l, c, v, step_ns):
+    """Свёртка отсортированных M5-свечей в бары step_ns (границы по UTC): dict колонок"""
+    buckets = times - times % step_ns
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(times)] - 1
+    return {
+        "time": buckets[starts],
+        "open": o[starts],
+        "high": np.maximum.reduceat(h, starts),
+        "low": np.minimum.reduceat(l, starts),
+        "close": c[ends],
+        "volume": np.add.reduceat(v, starts),
+    }
+
+
+class TimeframeAggregator:
+    """Старший таймфрейм из буфера M5: закрытые бары копятся, пересчитывается только текущий.
+
+    Каждый вызов update смотрит лишь на M5-свечи после последнего закрытого бара,
+    поэтому стоимость не зависит от длины истории.
+    """
+
+    def __init__(self, timeframe, max_bars=500):
+        self.timeframe = timeframe
+        self.step_ns = pd.Timedelta(timeframe).value
+        self.max_bars = max_bars
+        self.swing_index = SwingIndex()
+        self._closed = {name: np.empty(0) for name in ("time",) + OHLCV}
+        self._closed["time"] = np.empty(0, dtype=np.int64)
+        self._open_from = None  # начало текущего (незакрытого) бара, нс
+
+    def update(self, candles):
+        """candles — отсортированный по времени DataFrame M5; возвращает DataFrame баров таймфрейма"""
+        if candles.empty:
+            return self.frame(None)
+        start = 0
+        if self._open_from is not None:
+            start = int(candles['time'].searchsorted(pd.Timestamp(self._open_from, tz=candles['time'].dt.tz)))
+        tail = candles.iloc[start:]
+        times = pd.DatetimeIndex(tail['time']).as_unit("ns").asi8
+        if not len(times):
+            return self.frame(None)
+        current_start = times[-1] - times[-1] % self.step_ns
+        split = int(np.searchsorted(times, current_start))
+        cols = [tail[name].to_numpy(dtype=np.float64) for name in OHLCV]
+
+        if split > 0:
+            closed = aggregate_rows(times[:split], *(col[:split] for col in cols), self.step_ns)
+            self._closed = {name: np.concatenate([self._closed[name], closed[name]])[-self.max_bars:]
+                            for name in self._closed}
+        self._open_from = int(current_start)
+        current = aggregate_rows(times[split:], *(col[split:] for col in cols), self.step_ns)
+        return self.frame(current)
+
+    def frame(self, current):
+        columns = self._closed if current is None else {
+            name: np.concatenate([self._closed[name], current[name]]) for name in self._closed}
+        df = pd.DataFrame({name: columns[name] for name in OHLCV})
+        df.insert(0, 'time', pd.to_datetime(columns["time"], utc=True))
+        return df
+
+
+class MultiTimeframe:
+    """Секция market_data["multi_timeframe"]: индикаторы по каждому старшему таймфрейму"""
+
+    def __init__(self, timeframes, max_bars=500):
+        self.aggregators = [TimeframeAggregator(tf, max_bars) for tf in timeframes]
+
+    def snapshot(self, candles):
+        section = {}
+        for agg in self.aggregators:
+            bars = agg.update(candles)
+            entry = {"bars": len(bars)}
+            if len(bars):
+                last = bars.iloc[-1]
+                entry["candle_current"] = {name: round(float(last[name]), 2) for name in OHLCV[:4]}
+            # На короткой истории (1h/1d при HISTORY_DAYS=2) индикаторы не считаем — не хватит свечей
+            entry["indicators"] = calculate_indicators(bars, agg.swing_index) if len(bars) >= MIN_BARS else {}
+            section[agg.timeframe] = entry
+        return section
@@ -0,0 +1,116 @@
+# tests/test_trade_executor.py
+"""TradeExecutor против FakeBroker: идемпотентность, повторный сигнал, OCO, разворот позиции"""
+import pytest
+
+from DEEPCKAITRADE.live.fake_broker import FakeBroker
+from DEEPCKAITRADE.live.trade_executor import TradeExecutor
+
+FIGI = "TEST"
+BUY = {"action": "BUY", "size": 2, "entry_price": 100.0, "stop_loss": 95.0, "take_profit": 110.0}
+SELL = {"action": "SELL", "size": 2, "entry_price": 100.0, "stop_loss": 105.0, "take_profit": 90.0}
+
+
+@pytest.fixture
+def broker():
+    return FakeBroker(last_prices={FIGI: 100.0})
+
+
+@pytest.fixture
+def executor(broker):
+    executor = TradeExecutor(broker, FIGI)
+    yield executor
+    executor.shutdown()
+
+
+def submit(executor, prediction, candle):
+    state = executor.submit(prediction, {"timestamp": f"cycle-{candle}"}, signal_time=candle)
+    executor.wait()
+    return state
+
+
+def posted(broker, method):
+    return [order_id for name, order_id in broker.calls if name == method]
+
+
+def active_legs(broker):
+    return {order["kind"]: order for order in broker.stop_orders.values() if order["status"] == "active"}
+
+
+def test_duplicate_order_id_sends_one_order(executor, broker):
+    first = submit(executor, BUY, "2024-01-08T10:00:00")
+    again = executor.submit(BUY, {"timestamp": "next-cycle"}, signal_time="2024-01-08T10:00:00")
+    executor.wait()
+
+    assert again is first
+    assert posted(broker, "post_order") == [first["client_order_id"]]
+    assert broker.post_order(FIGI, 2, "BUY", first["client_order_id"]) == broker.orders[first["client_order_id"]]
+    assert broker.positions[FIGI] == 2
+
+
+def test_same_direction_on_new_candle_is_skipped(executor, broker):
+    first = submit(executor, BUY, "2024-01-08T10:00:00")
+    second = submit(executor, BUY, "2024-01-08T10:05:00")
+
+    assert second is first
+    assert len(posted(broker, "post_order")) == 1
+    assert broker.positions[FIGI] == 2
+    assert len(broker.stop_orders) == 2
+
+
+def test_filled_leg_cancels_the_other(executor, broker):
+    state = submit(executor, BUY, "2024-01-08T10:00:00")
+    legs = active_legs(broker)
+    assert set(legs) == {"stop_loss", "take_profit"}
+    assert all(leg["lots"] == 2 and leg["direction"] == "SELL" for leg in legs.values())
+
+    broker.trigger_stop(state["exits"]["take_profit"]["stop_order_id"])
+    executor.poll_fills()
+
+    assert state["exits"]["take_profit"]["status"] == "filled"
+    assert state["exits"]["stop_loss"]["status"] == "cancelled"
+    assert broker.stop_orders[state["exits"]["stop_loss"]["stop_order_id"]]["status"] == "cancelled"
+    assert broker.positions[FIGI] == 0
+    assert state["closed"]
+
+
+def test_opposite_signal_reverses_position(executor, broker):
+    long = submit(executor, BUY, "2024-01-08T10:00:00")
+    short = submit(executor, SELL, "2024-01-08T10:05:00")
+
+    assert short["status"] == "filled"
+    assert short["lots_executed"] == 4  # 2 закрывают long, 2 открывают short
+    assert broker.positions[FIGI] == -2
+    assert all(leg["status"] == "cancelled" for leg in long["exits"].values())
+    legs = active_legs(broker)
+    assert set(legs) == {"stop_loss", "take_profit"}
+    assert all(leg["lots"] == 2 and leg["direction"] == "BUY" for leg in legs.values())
+
+    executor.poll_fills()  # позиция short открыта — ноги остаются
+    assert len(active_legs(broker)) == 2
+
+
+class PartialFillBroker(FakeBroker):
+    """Исполняет не больше fill_lots, остаток заявки снимается биржей"""
+
+    def __init__(self, fill_lots, **kwargs):
+        super().__init__(**kwargs)
+        self.fill_lots = fill_lots
+
+    def post_order(self, figi, lots, direction, order_id, price=None):
+        return super().post_order(figi, min(lots, self.fill_lots), direction, order_id, price) | {"status": "cancelled"}
+
+
+def test_no_exit_legs_when_fill_only_closes_opposite():
+    broker = PartialFillBroker(2, last_prices={FIGI: 100.0})
+    broker.positions[FIGI] = -2
+    executor = TradeExecutor(broker, FIGI)
+    try:
+        state = submit(executor, BUY, "2024-01-08T10:00:00")
+    finally:
+        executor.shutdown()
+
+    assert posted(broker, "post_order") == [state["client_order_id"]]
+    assert state["lots_executed"] == 2
+    assert broker.positions[FIGI] == 0
+    assert state["exits"] == {}
+    assert not broker.stop_orders
@@ -1,21 +1,87 @@
 # utils/logger.py
+import atexit
+import copy
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import os
+import queue
 import sys
+import threading
+import time
 
-def setup_logger():
-    logger = logging.getLogger("deepckaitrade")
-    if logger.hasHandlers():
-        logger.handlers.clear()
+# Стабильные поля структурированного лога: передаются через extra={"stage": ..., "figi": ..., "latency": ...}
+STRUCTURED_FIELDS = ("stage", "figi", "latency")
 
-    logger.setLevel(logging.INFO)
+_listener = None
 
-    # Формат без эмодзи в консоли Windows
-    console_formatter = logging.Formatter('%(asctime)s | %(levelname)s | %(message)s')
-    file_formatter = logging.Formatter('%(asctime)s | %(levelname)s | %(message)s')
 
-    # Консольный хендлер — без эмодзи на Windows
+class JsonLineFormatter(logging.Formatter):
+    """Одна запись — одна JSON-строка с фиксированным набором ключей"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "msg": record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            entry[field] = getattr(record, field, None)
+        suppressed = getattr(record, "suppressed", None)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:  # из очереди (TracebackQueueHandler) приходит уже отформатированным
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TracebackQueueHandler(QueueHandler):
+    """QueueHandler.prepare вклеивает traceback в msg и обнуляет exc_info/exc_text — в JSON не попадает "exc".
+    Здесь msg — только сообщение, traceback форматируется в вызывающем потоке и едет в exc_text"""
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None  # traceback с фреймами не передаём между потоками
+        return record
+
+
+class RepeatedErrorFilter(logging.Filter):
+    """Глушит одинаковые ERROR-сообщения в пределах окна, затем пишет одно с числом подавленных"""
+
+    def __init__(self, window_sec=60.0):
+        super().__init__()
+        self.window_sec = window_sec
+        self._seen = {}  # message -> [first_ts, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < logging.ERROR:
+            return True
+        key = record.getMessage()[:200]
+        now = time.monotonic()
+        with self._lock:
+            state = self._seen.get(key)
+            if state is not None and now - state[0] < self.window_sec:
+                state[1] += 1
+                return False
+            suppressed = state[1] if state else 0
+            self._seen[key] = [now, 0]
+            if len(self._seen) > 1000:  # не растём бесконечно на уникальных ошибках
+                self._seen = {k: v for k, v in self._seen.items() if now - v[0] < self.window_sec}
+        if suppressed:
+            record.suppressed = suppressed
+            record.msg = f"{record.getMessage()} (повторов подавлено: {suppressed})"
+            record.args = None
+        return True
+
+
+def _console_handler(formatter):
     ch = logging.StreamHandler(sys.stdout)
     if os.name == 'nt':  # Windows
         # Убираем эмодзи только из вывода в консоль
@@ -27,15 +93,56 @@ def setup_logger():
             # Можно просто оставить как есть — главное не падать
             return True
         ch.addFilter(clean_message)
-    ch.setFormatter(console_formatter)
-    logger.addHandler(ch)
+    ch.setFormatter(formatter)
+    return ch
+
+
+def _stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener.stop()  # дописывает очередь до конца
+        _listener = None
+
+
+def setup_logger(mode=None):
+    """mode: "sync" — хендлеры в вызывающем потоке (по умолчанию),
+    "async" — очередь + поток-слушатель, файл пишется JSON-строками (LOG_MODE=async)"""
+    mode = mode or os.getenv("LOG_MODE", "sync")
+    logger = logging.getLogger("deepckaitrade")
+    _stop_listener()
+    if logger.hasHandlers():
+        logger.handlers.clear()
+
+    logger.setLevel(logging.INFO)
+
+    # Формат без эмодзи в консоли Windows
+    console_formatter = logging.Formatter('%(asctime)s | %(levelname)s | %(message)s')
+    file_formatter = logging.Formatter('%(asctime)s | %(levelname)s | %(message)s')
 
     # Файловый хендлер — с эмодзи (UTF-8)
     os.makedirs("logs", exist_ok=True)
-    fh = RotatingFileHandler("logs/app.log", maxBytes=10*1024*1024, backupCount=5, encoding="utf-8")
-    fh.setFormatter(file_formatter)
-    logger.addHandler(fh)
 
+    if mode != "async":
+        # Консольный хендлер — без эмодзи на Windows
+        logger.addHandler(_console_handler(console_formatter))
+        fh = RotatingFileHandler("logs/app.log", maxBytes=10*1024*1024, backupCount=5, encoding="utf-8")
+        fh.setFormatter(file_formatter)
+        logger.addHandler(fh)
+        return logger
+
+    # === Асинхронный режим: вызывающий поток только кладёт запись в очередь ===
+    global _listener
+    fh = RotatingFileHandler("logs/app.jsonl", maxBytes=10*1024*1024, backupCount=5, encoding="utf-8")
+    fh.setFormatter(JsonLineFormatter())
+    log_queue = queue.SimpleQueue()
+    qh = TracebackQueueHandler(log_queue)
+    qh.addFilter(RepeatedErrorFilter(float(os.getenv("LOG_ERROR_WINDOW", "60"))))
+    logger.addHandler(qh)
+    _listener = QueueListener(log_queue, _console_handler(console_formatter), fh, respect_handler_level=True)
+    _listener.start()
     return logger
 
-logger = setup_logger()
\ No newline at end of file
+
+atexit.register(_stop_listener)
+
+logger = setup_logger()
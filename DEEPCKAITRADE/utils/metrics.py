@@ -0,0 +1,200 @@
+# utils/metrics.py
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from DEEPCKAITRADE.utils.logger import logger
+
+# Границы бакетов (секунды): от вызова индикаторов до таймаута DeepSeek
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRIC_PREFIX = "deepckaitrade"
+
+
+class Histogram:
+    """Кумулятивная гистограмма в формате Prometheus (без зависимостей)"""
+
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # последний — +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self):
+        acc = 0
+        out = []
+        for c in self.counts:
+            acc += c
+            out.append(acc)
+        return out
+
+
+class MetricsRegistry:
+    """Гистограммы по стадиям цикла + счётчики событий. Один на процесс."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self._buckets = buckets
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.started_at = time.time()
+        self._server = None
+        self._dump_thread = None
+        self.samples = None  # stage -> [секунды], только при keep_samples() (replay, бенчмарки)
+
+    # === Запись ===
+    def observe(self, stage, seconds):
+        with self._lock:
+            hist = self.histograms.get(stage)
+            if hist is None:
+                hist = self.histograms[stage] = Histogram(self._buckets)
+            hist.observe(seconds)
+            if self.samples is not None:
+                self.samples.setdefault(stage, []).append(seconds)
+
+    def inc(self, event, value=1):
+        with self._lock:
+            self.counters[event] = self.counters.get(event, 0) + value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    @contextmanager
+    def stage(self, name):
+        """with metrics.stage("llm"): ... — замер длительности стадии"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def keep_samples(self, enabled=True):
+        """Хранить сырые замеры стадий для точных перцентилей (в live не включается: память растёт)"""
+        with self._lock:
+            self.samples = {} if enabled else None
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.gauges.clear()
+            if self.samples is not None:
+                self.samples = {}
+            self.started_at = time.time()
+
+    # === Экспорт ===
+    def snapshot(self):
+        with self._lock:
+            stages = {
+                name: {
+                    "count": h.count,
+                    "sum": round(h.total, 6),
+                    "avg": round(h.total / h.count, 6) if h.count else 0.0,
+                    "buckets": dict(zip([str(b) for b in h.buckets] + ["+Inf"], h.cumulative()))
+                }
+                for name, h in self.histograms.items()
+            }
+            return {
+                "generated_at": time.time(),
+                "uptime_sec": round(time.time() - self.started_at, 1),
+                "stages": stages,
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges)
+            }
+
+    def render_prometheus(self):
+        lines = [
+            f"# HELP {METRIC_PREFIX}_stage_seconds Длительность стадий цикла",
+            f"# TYPE {METRIC_PREFIX}_stage_seconds histogram"
+        ]
+        with self._lock:
+            for name, h in sorted(self.histograms.items()):
+                for bound, acc in zip(list(h.buckets) + ["+Inf"], h.cumulative()):
+                    lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {acc}')
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{{stage="{name}"}} {h.total:.6f}')
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_count{{stage="{name}"}} {h.count}')
+
+            lines.append(f"# HELP {METRIC_PREFIX}_events_total Счётчики событий (кэш, ретраи, пропуски)")
+            lines.append(f"# TYPE {METRIC_PREFIX}_events_total counter")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'{METRIC_PREFIX}_events_total{{event="{name}"}} {value}')
+
+            lines.append(f"# TYPE {METRIC_PREFIX}_gauge gauge")
+            for name, value in sorted(self.gauges.items()):
+                lines.append(f'{METRIC_PREFIX}_gauge{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def dump_json(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)  # атомарно, чтобы читатель не увидел половину файла
+
+    def start_http_server(self, port, host="127.0.0.1"):
+        """Локальный эндпоинт /metrics в фоновом потоке"""
+        if self._server is not None or not port:
+            return self._server
+        registry = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.startswith("/metrics.json"):
+                    body = json.dumps(registry.snapshot(), ensure_ascii=False).encode("utf-8")
+                    content_type = "application/json; charset=utf-8"
+                elif self.path.startswith("/metrics"):
+                    body = registry.render_prometheus().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                else:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # не засоряем лог каждым scrape
+
+        try:
+            self._server = ThreadingHTTPServer((host, port), _Handler)
+        except OSError as e:
+            logger.error(f"[Metrics] Не удалось открыть порт {port}: {e}")
+            return None
+        threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True).start()
+        logger.info(f"[Metrics] Prometheus: http://{host}:{port}/metrics")
+        return self._server
+
+    def start_json_dump(self, path, interval_sec):
+        """Периодический дамп snapshot() в JSON"""
+        if self._dump_thread is not None or interval_sec <= 0:
+            return
+
+        def _loop():
+            while True:
+                time.sleep(interval_sec)
+                try:
+                    self.dump_json(path)
+                except Exception as e:
+                    logger.error(f"[Metrics] Dump error: {e}")
+
+        self._dump_thread = threading.Thread(target=_loop, name="metrics-dump", daemon=True)
+        self._dump_thread.start()
+        logger.info(f"[Metrics] JSON-дамп каждые {interval_sec}s → {path}")
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,158 @@
+# utils/profiling.py
+import argparse
+import glob
+import io
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+from DEEPCKAITRADE.utils.logger import logger
+
+# cProfile/pstats/tracemalloc импортируются только при включённом профилировании и в отчётах.
+# Выключенный профайлер возвращает один и тот же nullcontext — без аллокаций и замеров
+_NULL = nullcontext()
+
+
+class CycleProfiler:
+    """Семплирующий профайлер: cProfile + tracemalloc на каждом N-м вызове maybe(tag).
+
+    Включается переменными окружения:
+        PROFILE_EVERY_N     — 0 (выкл) или период семплирования
+        PROFILE_DIR         — каталог для .pstats и .alloc.txt
+        PROFILE_KEEP        — сколько последних снимков хранить на каждый tag
+        PROFILE_TRACEMALLOC — 1, чтобы писать топ аллокаций
+    """
+
+    def __init__(self, every_n=0, output_dir="data/profiles", keep=20, trace_alloc=False, top_allocs=25):
+        self.every_n = int(every_n)
+        self.output_dir = output_dir
+        self.keep = int(keep)
+        self.trace_alloc = trace_alloc
+        self.top_allocs = top_allocs
+        self.enabled = self.every_n > 0
+        self._counters = {}
+        self._active = False
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            every_n=os.getenv("PROFILE_EVERY_N", "0"),
+            output_dir=os.getenv("PROFILE_DIR", os.path.join("data", "profiles")),
+            keep=os.getenv("PROFILE_KEEP", "20"),
+            trace_alloc=os.getenv("PROFILE_TRACEMALLOC", "0") == "1"
+        )
+
+    def maybe(self, tag):
+        """with profiler.maybe("live_cycle"): ... — профилирует каждый every_n-й вход"""
+        if not self.enabled or self._active:
+            return _NULL
+        n = self._counters.get(tag, 0) + 1
+        self._counters[tag] = n
+        if n % self.every_n:
+            return _NULL
+        return self._profile(tag, n)
+
+    @contextmanager
+    def _profile(self, tag, n):
+        import cProfile
+        import tracemalloc
+        self._active = True
+        profile = cProfile.Profile()
+        started_tracing = False
+        if self.trace_alloc and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            started_tracing = True
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - start
+            snapshot = tracemalloc.take_snapshot() if self.trace_alloc and tracemalloc.is_tracing() else None
+            if started_tracing:
+                tracemalloc.stop()
+            self._active = False
+            try:
+                self._write(tag, n, profile, snapshot, elapsed)
+            except OSError as e:
+                logger.error(f"[Profile] Ошибка записи: {e}")
+
+    def _write(self, tag, n, profile, snapshot, elapsed):
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, f"{tag}_{time.strftime('%Y%m%d_%H%M%S')}_{n:06d}")
+        profile.dump_stats(base + ".pstats")
+        if snapshot is not None:
+            stats = snapshot.statistics("lineno")[:self.top_allocs]
+            with open(base + ".alloc.txt", "w", encoding="utf-8") as f:
+                for stat in stats:
+                    f.write(f"{stat}\n")
+        self._rotate(tag)
+        logger.info(f"[Profile] {tag} #{n}: {elapsed:.3f}s → {base}.pstats")
+
+    def _rotate(self, tag):
+        for pattern in (f"{tag}_*.pstats", f"{tag}_*.alloc.txt"):
+            files = sorted(glob.glob(os.path.join(self.output_dir, pattern)))
+            for path in files[:-self.keep] if self.keep > 0 else []:
+                os.remove(path)
+
+
+profiler = CycleProfiler.from_env()
+
+
+# === Сводка и сравнение профилей ===
+def load_function_times(path):
+    """{'file:line(func)': (calls, tottime, cumtime)}"""
+    import pstats
+    stats = pstats.Stats(path, stream=io.StringIO())
+    out = {}
+    for (filename, line, func), (cc, nc, tt, ct, callers) in stats.stats.items():
+        out[f"{os.path.basename(filename)}:{line}({func})"] = (nc, tt, ct)
+    return out
+
+
+def print_top(path, top=25, sort="cumulative"):
+    import pstats
+    pstats.Stats(path).strip_dirs().sort_stats(sort).print_stats(top)
+
+
+def print_diff(base_path, new_path, top=25):
+    """Функции с наибольшим изменением собственного времени (tottime)"""
+    base = load_function_times(base_path)
+    new = load_function_times(new_path)
+    rows = []
+    for key in set(base) | set(new):
+        b = base.get(key, (0, 0.0, 0.0))
+        n = new.get(key, (0, 0.0, 0.0))
+        rows.append((n[1] - b[1], key, b, n))
+    rows.sort(key=lambda r: abs(r[0]), reverse=True)
+
+    total_base = sum(v[1] for v in base.values())
+    total_new = sum(v[1] for v in new.values())
+    print(f"Всего tottime: {total_base:.4f}s → {total_new:.4f}s ({total_new - total_base:+.4f}s)")
+    print(f"{'Δtottime':>10s} {'base':>9s} {'new':>9s} {'calls b→n':>17s}  function")
+    for delta, key, b, n in rows[:top]:
+        print(f"{delta:+10.4f} {b[1]:9.4f} {n[1]:9.4f} {b[0]:>8d}→{n[0]:<8d}  {key}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Просмотр и сравнение профилей циклов")
+    sub = parser.add_subparsers(dest="command", required=True)
+    show = sub.add_parser("show", help="Топ функций одного профиля")
+    show.add_argument("path")
+    show.add_argument("--top", type=int, default=25)
+    show.add_argument("--sort", default="cumulative")
+    diff = sub.add_parser("diff", help="Сравнение двух профилей")
+    diff.add_argument("base")
+    diff.add_argument("new")
+    diff.add_argument("--top", type=int, default=25)
+    args = parser.parse_args(argv)
+
+    if args.command == "show":
+        print_top(args.path, args.top, args.sort)
+    else:
+        print_diff(args.base, args.new, args.top)
+
+
+if __name__ == "__main__":
+    main()